@@ -0,0 +1,21 @@
+# core/admin.py
+from django.contrib import admin
+from django.utils import timezone
+
+from .models import Task
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "queue", "status", "priority", "attempts", "run_at", "finished_at")
+    list_filter = ("status", "queue", "name")
+    search_fields = ("name", "last_error")
+    readonly_fields = ("created_at", "finished_at", "locked_by", "locked_at")
+    date_hierarchy = "created_at"
+    actions = ("retry_now",)
+
+    @admin.action(description="Retry selected tasks now")
+    def retry_now(self, request, queryset):
+        queryset.exclude(status=Task.Status.RUNNING).update(
+            status=Task.Status.QUEUED, run_at=timezone.now(), attempts=0, finished_at=None
+        )
@@ -0,0 +1,123 @@
+# core/admin_base.py
+"""
+ModelAdmin base for tables too large for the admin's defaults.
+
+- Related objects in list_display and `str_select_related` are joined, on the change list
+  and wherever the admin renders objects, like delete confirmations and actions.
+- Counts are exact up to ADMIN_EXACT_COUNT_THRESHOLD rows and estimated by Postgres above.
+- Pages after the first are fetched by primary key (`?cursor=<pk>`) instead of OFFSET,
+  as long as the list keeps its default newest-first order.
+- The date hierarchy lists every period between the oldest and newest row instead of
+  running SELECT DISTINCT over the table, so some choices may turn out empty.
+"""
+
+import json
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+CURSOR_VAR = "cursor"
+
+
+def estimate_count(queryset):
+    """Postgres' row estimate for `queryset`, from the table statistics when it's unfiltered."""
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)",
+                [connection.ops.quote_name(queryset.model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+            # -1 until the table was first analyzed
+            if row and row[0] >= 0:
+                return row[0]
+        sql, params = queryset.order_by().query.sql_with_params()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Counts up to ADMIN_EXACT_COUNT_THRESHOLD rows, and estimates larger results on Postgres."""
+
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connections[queryset.db].vendor != "postgresql":
+            return super().count
+        threshold = settings.ADMIN_EXACT_COUNT_THRESHOLD
+        count = queryset.order_by()[: threshold + 1].count()
+        if count <= threshold:
+            return count
+        self.estimated = True
+        return max(estimate_count(queryset), count)
+
+
+class KeysetChangeList(ChangeList):
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        params.pop(CURSOR_VAR, None)
+        return params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # Filter, search and sort links start over from the first page
+        new_params = {CURSOR_VAR: None, **(new_params or {})}
+        return super().get_query_string(new_params, remove)
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.uses_keyset = (
+            ORDER_VAR not in self.params
+            and not self.show_all
+            and tuple(self.model_admin.get_ordering(request)) == ("-pk",)
+        )
+        self.cursor = request.GET.get(CURSOR_VAR)
+        if self.uses_keyset and self.cursor:
+            self.result_list = self.queryset.filter(pk__lt=self.cursor)[: self.list_per_page]
+
+    def next_cursor(self):
+        results = list(self.result_list)
+        if len(results) < self.list_per_page:
+            return None
+        return results[-1].pk
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """See the module docstring."""
+
+    # Relations __str__ follows, joined wherever the admin loads the model
+    str_select_related = ()
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    ordering = ("-pk",)
+    change_list_template = "admin/large_table_change_list.html"
+
+    def get_list_select_related(self, request):
+        if self.list_select_related not in (False, True):
+            return self.list_select_related
+        related = []
+        for name in self.list_display:
+            try:
+                field = self.model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if field.many_to_one and name != field.attname:
+                related.append(name)
+        return (*related, *self.str_select_related)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return queryset.select_related(*self.str_select_related) if self.str_select_related else queryset
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class CoreConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "core"
+
+    def ready(self):
+        if settings.INSTRUMENTATION_SAMPLE_RATE > 0:
+            from .instrumentation import install_serializer_timing
+
+            install_serializer_timing()
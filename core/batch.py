@@ -0,0 +1,133 @@
+# core/batch.py
+"""
+In-process dispatch of batched API sub-requests, see core.views.BatchView.
+
+Sub-requests go through the URL conf and the views like any request, minus the middleware,
+and reuse the batch's authenticated user instead of validating the JWT again. They carry
+the batch's FORWARDED_HEADERS and their own `headers`, and the QUERY_LIMITS of their view.
+They run in order; runs of consecutive GETs are spread over BATCH_READ_THREADS threads when
+that's set, each thread using its own database connection.
+"""
+
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+
+from .middleware import view_label
+from .query_guard import QueryGuard, guard_queries
+
+logger = logging.getLogger(__name__)
+
+# The batch's headers every sub-request gets, a spec's own headers go on top.
+# X-Forwarded-For keeps the client address the IP throttles go by.
+FORWARDED_HEADERS = (
+    "HTTP_HOST",
+    "HTTP_ACCEPT",
+    "HTTP_ACCEPT_LANGUAGE",
+    "HTTP_AUTHORIZATION",
+    "HTTP_COOKIE",
+    "HTTP_X_FORWARDED_FOR",
+)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.BATCH_READ_THREADS, thread_name_prefix="batch")
+    return _executor
+
+
+def build_request(outer, spec):
+    path, _, query = spec["path"].partition("?")
+    body = json.dumps(spec["body"]).encode() if "body" in spec else b""
+    environ = {
+        key: value
+        for key, value in outer.META.items()
+        if key in FORWARDED_HEADERS or key in ("REMOTE_ADDR", "SERVER_NAME", "SERVER_PORT", "wsgi.url_scheme")
+    }
+    environ.update(("HTTP_" + name.upper().replace("-", "_"), value) for name, value in spec.get("headers", {}).items())
+    environ.update(
+        REQUEST_METHOD=spec["method"],
+        PATH_INFO=path,
+        QUERY_STRING=query,
+        CONTENT_TYPE="application/json",
+        CONTENT_LENGTH=str(len(body)),
+        **{"wsgi.input": io.BytesIO(body)},
+    )
+    environ.setdefault("wsgi.url_scheme", outer.scheme)
+    request = WSGIRequest(environ)
+    # Picked up by DRF's Request in place of the authentication classes
+    request._force_auth_user = outer.user
+    request._force_auth_token = outer.auth
+    return request
+
+
+def dispatch(outer, spec):
+    request = build_request(outer, spec)
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return respond(spec, 404, {"detail": "Not found."})
+    try:
+        with guard_queries(QueryGuard(view_label(match.func, request.method))) as guard:
+            request._query_guard = guard
+            response = match.func(request, *match.args, **match.kwargs)
+            if hasattr(response, "render"):
+                response.render()
+    except Exception:
+        logger.exception("Batched %s %s failed", spec["method"], spec["path"])
+        return respond(spec, 500, {"detail": "Internal server error."})
+
+    if not response.content:
+        body = None
+    elif response.get("Content-Type", "").startswith("application/json"):
+        body = json.loads(response.content)
+    else:
+        body = response.content.decode(response.charset, errors="replace")
+    return respond(spec, response.status_code, body)
+
+
+def respond(spec, status, body):
+    response = {"status": status, "body": body}
+    if "id" in spec:
+        response = {"id": spec["id"], **response}
+    return response
+
+
+def _dispatch_in_thread(outer, spec):
+    close_old_connections()
+    try:
+        return dispatch(outer, spec)
+    finally:
+        close_old_connections()
+
+
+def run_batch(outer, specs):
+    """Responses to `specs`, in order."""
+    responses = []
+    reads = []
+
+    def flush_reads():
+        if len(reads) > 1 and settings.BATCH_READ_THREADS > 1:
+            responses.extend(_get_executor().map(lambda spec: _dispatch_in_thread(outer, spec), reads))
+        else:
+            responses.extend(dispatch(outer, spec) for spec in reads)
+        reads.clear()
+
+    for spec in specs:
+        if spec["method"] == "GET":
+            reads.append(spec)
+            continue
+        # Writes are barriers, later reads see them
+        flush_reads()
+        responses.append(dispatch(outer, spec))
+    flush_reads()
+    return responses
@@ -0,0 +1,382 @@
+# core/cache.py
+"""
+The project's cache backend: a bounded copy of the recently used entries in each process,
+in front of files shared by every worker on the host (LOCATION, on /dev/shm where there is
+one). Neither tier needs a service of its own.
+
+A process uses its copy of an entry for as long as the entry's file is the one it was read
+from, which costs a stat instead of a read and unpickle: a set or delete by any worker is
+seen by all of them on their next lookup. On top of Django's cache API:
+
+- `fetch(key, compute, timeout, tags)` returns the cached value or computes and stores it.
+  Before an entry expires, each caller may recompute it early, the more likely the closer
+  to expiry and the longer it took to compute (XFetch), so the callers of a hot key don't
+  all recompute it at once when it expires. The first to decide holds a lock file while it
+  does, the others keep getting the current value meanwhile.
+- `set` and `fetch` take tags. `invalidate_tags` turns every entry stored with one of them
+  into a miss without having to find them.
+- Hits of each tier and misses are counted in `stats()` and in the metrics.
+
+Values served from a process' copy are shared by its callers and must not be mutated.
+Expired files are removed by `cull`, which core.tasks.cull_caches runs periodically, and it
+keeps the files under MAX_ENTRIES and MAX_BYTES (by default a quarter of the filesystem, the
+other alias and the metrics share it). Every CULL_EVERY writes a process also culls the
+subdirectory it wrote to, against its share of the limits. The tags' versions are never
+culled, they are few and small. A write that fails, e.g. on a full disk, leaves a miss behind
+rather than an error.
+"""
+
+import hashlib
+import logging
+import math
+import os
+import pickle
+import random
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict, namedtuple
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.functional import cached_property
+
+from .metrics import record_cache, registry
+
+# Expiry time (0 for never) and seconds the value took to compute, before the pickled (value, tags)
+HEADER = struct.Struct("<dd")
+SUFFIX = ".cache"
+LOCK_SUFFIX = ".lock"
+TAG_KEY = "cache-tag:{tag}"
+# Subdirectory of the tags' versions, never culled: a missing version would revive their stale entries
+TAGS = "tags"
+# Subdirectories entries are spread over, by the first two hex digits of their key's digest
+DIRECTORIES = 256
+
+logger = logging.getLogger(__name__)
+
+_Entry = namedtuple("_Entry", ("signature", "value", "expires_at", "delta", "tags", "size"))
+
+
+def _signature(stat):
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class TieredCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self.location = os.path.abspath(location)
+        # Label of the metrics, the alias it's configured under
+        self.name = options.get("NAME", "default")
+        self._local_max_bytes = int(options.get("LOCAL_MAX_BYTES", 16 * 2**20))
+        self._local_max_entries = int(options.get("LOCAL_MAX_ENTRIES", 10000))
+        self._max_bytes_option = int(options.get("MAX_BYTES", 0))
+        self._cull_every = int(options.get("CULL_EVERY", 100))
+        self._writes = 0
+        self._local = OrderedDict()
+        self._local_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = Counter()
+
+    def _path(self, key, version=None):
+        digest = hashlib.md5(self.make_and_validate_key(key, version).encode(), usedforsecurity=False).hexdigest()
+        return os.path.join(self.location, digest[:2], digest + SUFFIX)
+
+    def _tag_path(self, tag, version=None):
+        return os.path.join(self.location, TAGS, os.path.basename(self._path(TAG_KEY.format(tag=tag), version)))
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                signature = _signature(os.fstat(f.fileno()))
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        expires_at, delta = HEADER.unpack_from(data)
+        value, tags = pickle.loads(memoryview(data)[HEADER.size :])
+        return _Entry(signature, value, expires_at, delta, tags, len(data))
+
+    def _remember(self, path, entry):
+        with self._lock:
+            previous = self._local.pop(path, None)
+            if previous is not None:
+                self._local_bytes -= previous.size
+            if entry is None or entry.size > self._local_max_bytes // 8:
+                return
+            self._local[path] = entry
+            self._local_bytes += entry.size
+            while self._local_bytes > self._local_max_bytes or len(self._local) > self._local_max_entries:
+                _, evicted = self._local.popitem(last=False)
+                self._local_bytes -= evicted.size
+
+    def _lookup(self, path):
+        """The entry stored at path, expired or not, and the tier it came from."""
+        entry = self._local.get(path)
+        if entry is not None:
+            try:
+                current = _signature(os.stat(path))
+            except FileNotFoundError:
+                current = None
+            if current == entry.signature:
+                with self._lock:
+                    if path in self._local:
+                        self._local.move_to_end(path)
+                return entry, "local"
+        entry = self._read(path)
+        self._remember(path, entry)
+        return entry, "shared"
+
+    def _write(self, path, value, expires_at, tags=None, delta=0.0):
+        """Store an entry, returns whether it was. One that couldn't be written is removed, a miss."""
+        data = HEADER.pack(expires_at or 0, delta) + pickle.dumps((value, tags or {}), pickle.HIGHEST_PROTOCOL)
+        directory = os.path.dirname(path)
+        temporary = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with open(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                # The clock's full precision, the file's own mtime only moves every few milliseconds
+                now = time.time_ns()
+                os.utime(f.fileno(), ns=(now, now))
+                signature = _signature(os.fstat(f.fileno()))
+            os.replace(temporary, path)
+        except BaseException as exc:
+            if temporary is not None:
+                try:
+                    os.remove(temporary)
+                except FileNotFoundError:
+                    pass
+            if not isinstance(exc, OSError):
+                raise
+            logger.warning("Cache %s couldn't write %s: %s", self.name, path, exc)
+            registry.inc("habij_cache_write_errors_total", (("cache", self.name),))
+            self._delete(path)
+            if os.path.basename(directory) != TAGS:
+                self._cull_directory(directory)
+            return False
+        self._remember(path, _Entry(signature, value, expires_at or 0, delta, tags or {}, len(data)))
+        self._writes += 1
+        if self._cull_every and self._writes % self._cull_every == 0 and os.path.basename(directory) != TAGS:
+            self._cull_directory(directory)
+        return True
+
+    def _tag_versions(self, tags, version=None):
+        versions = {}
+        for tag in tags:
+            entry, _ = self._lookup(self._tag_path(tag, version))
+            versions[tag] = entry.value if entry is not None else 0
+        return versions
+
+    def _is_fresh(self, entry, version=None):
+        if entry is None or 0 < entry.expires_at <= time.time():
+            return False
+        return not entry.tags or self._tag_versions(entry.tags, version) == entry.tags
+
+    def _record(self, tier):
+        self._stats[tier] += 1
+        record_cache(self.name, tier != "miss")
+        if tier == "local":
+            registry.inc("habij_cache_local_hits_total", (("cache", self.name),))
+
+    def get(self, key, default=None, version=None):
+        entry, tier = self._lookup(self._path(key, version))
+        if not self._is_fresh(entry, version):
+            self._record("miss")
+            return default
+        self._record(tier)
+        return entry.value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, tags=()):
+        path = self._path(key, version)
+        expires_at = self.get_backend_timeout(timeout)
+        if expires_at is not None and expires_at <= time.time():
+            self._delete(path)
+            return
+        self._write(path, value, expires_at, self._tag_versions(tags, version))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, tags=()):
+        # Like the file based cache, not atomic between processes
+        entry, _ = self._lookup(self._path(key, version))
+        if self._is_fresh(entry, version):
+            return False
+        self.set(key, value, timeout, version, tags)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        path = self._path(key, version)
+        entry, _ = self._lookup(path)
+        if not self._is_fresh(entry, version):
+            return False
+        return self._write(path, entry.value, self.get_backend_timeout(timeout), entry.tags, entry.delta)
+
+    def has_key(self, key, version=None):
+        entry, _ = self._lookup(self._path(key, version))
+        return self._is_fresh(entry, version)
+
+    def _delete(self, path):
+        self._remember(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, key, version=None):
+        return self._delete(self._path(key, version))
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            self._local_bytes = 0
+        if os.path.isdir(self.location):
+            for name in os.listdir(self.location):
+                shutil.rmtree(os.path.join(self.location, name), ignore_errors=True)
+
+    def fetch(self, key, compute, timeout=DEFAULT_TIMEOUT, tags=(), version=None, beta=1.0):
+        """
+        The cached value of `key`, or the result of `compute()` stored for `timeout` with `tags`.
+        A higher `beta` refreshes earlier.
+        """
+        path = self._path(key, version)
+        entry, tier = self._lookup(path)
+        lock = None
+        if self._is_fresh(entry, version):
+            # -log(uniform) is 1 on average and rarely above 5
+            early = entry.delta * beta * -math.log(1.0 - random.random())
+            if not entry.expires_at or time.time() + early < entry.expires_at:
+                self._record(tier)
+                return entry.value
+            lock = self._claim_refresh(path, entry)
+            if lock is None:
+                # Someone else is refreshing it
+                self._record(tier)
+                return entry.value
+            self._stats["early"] += 1
+            registry.inc("habij_cache_early_refreshes_total", (("cache", self.name),))
+        else:
+            self._record("miss")
+
+        try:
+            # Read before computing, an invalidation while it runs leaves the result stale
+            versions = self._tag_versions(tags, version)
+            started = time.perf_counter()
+            value = compute()
+            delta = time.perf_counter() - started
+            expires_at = self.get_backend_timeout(timeout)
+            if expires_at is None or expires_at > time.time():
+                self._write(path, value, expires_at, versions, delta)
+        finally:
+            if lock is not None:
+                os.remove(lock)
+        return value
+
+    def _claim_refresh(self, path, entry):
+        """The lock file of an early refresh of the entry, None when another caller holds it."""
+        lock = path + LOCK_SUFFIX
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            try:
+                # Left by a caller that died computing
+                if os.stat(lock).st_mtime < time.time() - max(entry.delta * 4, 1):
+                    os.remove(lock)
+            except FileNotFoundError:
+                pass
+            return None
+        except OSError:
+            # No room for it, the current value will do
+            return None
+        return lock
+
+    def invalidate_tags(self, *tags, version=None):
+        """Turn the entries stored with any of the tags into misses."""
+        for tag in tags:
+            if not self._write(self._tag_path(tag, version), time.time_ns(), None):
+                # Its entries could be served again, drop them all
+                self.clear()
+                return
+
+    def stats(self):
+        """This process' lookups: hits from its own copy ("local") and the shared files, misses and early refreshes."""
+        return {name: self._stats[name] for name in ("local", "shared", "miss", "early")}
+
+    @cached_property
+    def _max_bytes(self):
+        if self._max_bytes_option:
+            return self._max_bytes_option
+        path = self.location
+        while not os.path.isdir(path):
+            path = os.path.dirname(path)
+        filesystem = os.statvfs(path)
+        return filesystem.f_blocks * filesystem.f_frsize // 4
+
+    def _scan(self, directory, now):
+        """Remove a directory's expired and abandoned files. Returns the rest as (mtime, size, path), and how many."""
+        entries, removed = [], 0
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return entries, removed
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                if name.endswith(SUFFIX):
+                    with open(path, "rb") as f:
+                        expires_at, _ = HEADER.unpack(f.read(HEADER.size))
+                        stat = os.fstat(f.fileno())
+                    if 0 < expires_at <= now:
+                        os.remove(path)
+                        removed += 1
+                    else:
+                        entries.append((stat.st_mtime, stat.st_size, path))
+                elif os.stat(path).st_mtime < now - 60:
+                    # Left behind by a process killed while writing or refreshing
+                    os.remove(path)
+            except (FileNotFoundError, IsADirectoryError, struct.error):
+                continue
+        return entries, removed
+
+    def _evict(self, entries, max_entries, max_bytes):
+        """Remove the least recently written entries while they're over either limit, and a margin. Returns how many."""
+        count, size = len(entries), sum(entry[1] for entry in entries)
+        if count <= max_entries and size <= max_bytes:
+            return 0
+        max_entries -= max_entries // self._cull_frequency
+        max_bytes -= max_bytes // self._cull_frequency
+        removed = 0
+        for _, entry_size, path in sorted(entries):
+            if count <= max_entries and size <= max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            count -= 1
+            size -= entry_size
+        return removed
+
+    def _cull_directory(self, directory):
+        entries, removed = self._scan(directory, time.time())
+        limits = max(self._max_entries // DIRECTORIES, 1), self._max_bytes // DIRECTORIES
+        return removed + self._evict(entries, *limits)
+
+    def cull(self):
+        """
+        Remove expired entries, then the least recently written while there are over MAX_ENTRIES
+        or MAX_BYTES of them. Returns how many.
+        """
+        now = time.time()
+        entries, removed = [], 0
+        directories = [self.location]
+        if os.path.isdir(self.location):
+            directories += [entry.path for entry in os.scandir(self.location) if entry.is_dir() and entry.name != TAGS]
+        for directory in directories:
+            scanned, expired = self._scan(directory, now)
+            entries += scanned
+            removed += expired
+        return removed + self._evict(entries, self._max_entries, self._max_bytes)
@@ -0,0 +1,114 @@
+# core/compression.py
+"""
+Content codings for core.middleware.CompressionMiddleware and the precompressed static
+files of core.storage.
+
+gzip is always available. Brotli (`br`) and zstd need the `brotli` and `zstandard`
+packages and are left out when those aren't installed.
+
+`compress` can add `padding` bytes that decoders skip, as Django's GZipMiddleware does
+against BREACH: a gzip file name, a brotli metadata block or a zstd skippable frame.
+"""
+
+import gzip
+import mimetypes
+import struct
+
+from django.conf import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Padding a brotli metadata block can hold with a one byte length
+MAX_PADDING = 256
+ZSTD_SKIPPABLE_FRAME = 0x184D2A50
+
+
+def _gzip(data, level, padding=0):
+    # mtime=0 so the same content always compresses to the same bytes
+    compressed = gzip.compress(data, compresslevel=level, mtime=0)
+    if not padding:
+        return compressed
+    header = bytearray(compressed[:10])
+    header[3] = gzip.FNAME
+    return bytes(header) + b"a" * padding + b"\x00" + compressed[10:]
+
+
+def _brotli(data, level, padding=0):
+    if not padding:
+        return brotli.compress(data, quality=level)
+    compressor = brotli.Compressor(quality=level)
+    # Flushed to a block boundary, then a metadata block (RFC 7932 9.2): ISLAST 0, MNIBBLES 0,
+    # reserved 0, MSKIPBYTES 1, MSKIPLEN - 1 in 8 bits, zero bits to the byte boundary
+    block = (0b11 << 1 | 1 << 4 | (padding - 1) << 6).to_bytes(2, "little") + b"a" * padding
+    return compressor.process(data) + compressor.flush() + block + compressor.finish()
+
+
+def _zstd(data, level, padding=0):
+    compressed = zstandard.ZstdCompressor(level=level).compress(data)
+    if not padding:
+        return compressed
+    # After the data frame, where one-shot decoders stop reading
+    return compressed + struct.pack("<II", ZSTD_SKIPPABLE_FRAME, padding) + b"a" * padding
+
+
+# Content coding: (compress, file extension of precompressed files, highest level)
+CODECS = {"gzip": (_gzip, ".gz", 9)}
+if brotli is not None:
+    CODECS["br"] = (_brotli, ".br", 11)
+if zstandard is not None:
+    CODECS["zstd"] = (_zstd, ".zst", 19)
+
+COMPRESSIBLE_TYPES = (
+    "application/javascript",
+    "application/json",
+    "application/vnd.oai.openapi",
+    "application/vnd.oai.openapi+json",
+    "application/xml",
+    "application/yaml",
+    "image/svg+xml",
+)
+
+
+def compress(encoding, data, level=None, padding=0):
+    function, _, highest = CODECS[encoding]
+    return function(data, highest if level is None else level, min(padding, MAX_PADDING))
+
+
+def is_compressible(content_type):
+    media_type = content_type.partition(";")[0].strip().lower()
+    return media_type.startswith("text/") or media_type in COMPRESSIBLE_TYPES
+
+
+def is_compressible_file(path):
+    content_type, encoding = mimetypes.guess_type(path)
+    return encoding is None and content_type is not None and is_compressible(content_type)
+
+
+def negotiate(accept_encoding):
+    """The first of COMPRESSION_ENCODINGS the client accepts, None to send the response as is."""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding.strip():
+            accepted[coding.strip()] = quality
+    for encoding in settings.COMPRESSION_ENCODINGS:
+        if encoding in CODECS and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
@@ -0,0 +1,56 @@
+# core/db_routers.py
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Set per request by core.mixins.ReplicaReadMixin, reads go to the primary unless it's on
+_read_from_replica = ContextVar("read_from_replica", default=False)
+
+PIN_KEY = "replica-pin:{user_id}"
+
+
+def use_replica(enabled=True):
+    """Route reads for the current request/context; returns a token for `reset_replica`."""
+    return _read_from_replica.set(enabled)
+
+
+def reset_replica(token):
+    _read_from_replica.reset(token)
+
+
+def pin_to_primary(user_id):
+    """Send this user's reads to the primary for a while, so they read their own writes."""
+    if not settings.DATABASE_REPLICAS:
+        return
+    caches[settings.REPLICA_PIN_CACHE].set(PIN_KEY.format(user_id=user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned_to_primary(user_id):
+    if not settings.DATABASE_REPLICAS:
+        return False
+    return bool(caches[settings.REPLICA_PIN_CACHE].get(PIN_KEY.format(user_id=user_id)))
+
+
+class ReplicaRouter:
+    """Sends reads to a random read replica while the current request allows it, everything else to default."""
+
+    def db_for_read(self, model, **hints):
+        if settings.DATABASE_REPLICAS and _read_from_replica.get():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {"default", *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
@@ -0,0 +1,190 @@
+# core/idempotency.py
+"""
+Idempotency-Key handling for write endpoints, so clients can retry them safely.
+
+The first request with a key claims it with a row in IdempotencyKey and runs the view;
+its response is stored there and in IDEMPOTENCY_CACHE for IDEMPOTENCY_TTL_SECONDS and
+replayed to retries without running the view again. Duplicates arriving while the first
+one runs wait up to IDEMPOTENCY_WAIT_SECONDS for its response. Keys are scoped to the
+user, or the client IP before login, and can't be reused for a different payload.
+
+Payloads are fingerprinted with an HMAC keyed by SECRET_KEY, since they hold passwords,
+and cookies and credentials in the response are never stored: views that return them
+name them as `private` and pass a `reissue` function that mints new ones for the replay.
+"""
+
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+CACHE_KEY = "idempotency:{scope}:{key}"
+# Headers of the first response that are replayed along with its body
+REPLAYED_HEADERS = ("Location",)
+MAX_POLL_INTERVAL = 0.5
+REUSED = f"{HEADER} was already used for a different request."
+
+
+def request_scope(request):
+    if request.user.is_authenticated:
+        return f"user:{request.user.pk}"
+    return f"anon:{BaseThrottle().get_ident(request)}"
+
+
+def fingerprint(request):
+    data = request.data
+    if hasattr(data, "lists"):
+        data = dict(data.lists())
+    payload = json.dumps([request.method, request.path, data], sort_keys=True, default=str)
+    return salted_hmac("core.idempotency.fingerprint", payload, algorithm="sha256").hexdigest()
+
+
+def serialize_response(response, private=()):
+    data = response.data
+    if isinstance(data, dict):
+        data = {name: value for name, value in data.items() if name not in private}
+    return {
+        "data": data,
+        "headers": {name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)},
+    }
+
+
+def replay(status_code, stored, reissue=None):
+    if reissue is not None and status.is_success(status_code):
+        response = reissue(stored["data"])
+    else:
+        response = Response(stored["data"], status=status_code, headers=stored["headers"])
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def error(detail, status_code, **headers):
+    return Response({"detail": detail}, status=status_code, headers=headers)
+
+
+class Claim:
+    def __init__(self, scope, key, fingerprint, private=()):
+        self.scope = scope
+        self.key = key
+        self.fingerprint = fingerprint
+        self.private = private
+        self.cache_key = CACHE_KEY.format(scope=scope, key=hashlib.sha256(key.encode()).hexdigest())
+
+    @property
+    def records(self):
+        return IdempotencyKey.objects.using("default").filter(scope=self.scope, key=self.key)
+
+    def acquire(self):
+        """The stored record when the key was used before, None when this request claimed it."""
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS)
+        try:
+            with transaction.atomic(using="default"):
+                IdempotencyKey.objects.using("default").create(
+                    scope=self.scope, key=self.key, fingerprint=self.fingerprint, locked_at=now, expires_at=expires_at
+                )
+            return None
+        except IntegrityError:
+            pass
+
+        record = self.records.first()
+        if record is None:
+            return self.acquire()
+        abandoned = now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_SECONDS)
+        if record.expires_at <= now or (record.status_code is None and record.locked_at <= abandoned):
+            # Expired, or the request that claimed it died, take it over
+            taken = self.records.filter(pk=record.pk, locked_at=record.locked_at).update(
+                fingerprint=self.fingerprint, status_code=None, response=None, locked_at=now, expires_at=expires_at
+            )
+            return None if taken else self.records.first()
+        return record
+
+    def wait(self, record):
+        """The completed record, once the request holding the key has stored its response."""
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        interval = 0.05
+        while record is not None and record.status_code is None and time.monotonic() < deadline:
+            time.sleep(interval)
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+            record = self.records.first()
+        return record
+
+    def store(self, response):
+        stored = serialize_response(response, self.private)
+        self.records.update(status_code=response.status_code, response=stored)
+        caches[settings.IDEMPOTENCY_CACHE].set(
+            self.cache_key, (self.fingerprint, response.status_code, stored), settings.IDEMPOTENCY_TTL_SECONDS
+        )
+
+    def release(self):
+        self.records.filter(status_code__isnull=True).delete()
+
+
+def idempotent(view=None, *, private=(), reissue=None):
+    """
+    Honour the Idempotency-Key header on a DRF view or viewset action.
+
+    Returned client errors are stored and replayed like successes. Server errors, throttled
+    requests and exceptions, DRF's validation errors included, release the key so the
+    retry runs again. The `private` fields of a response body aren't stored, successes are
+    replayed with `reissue(data)` instead, which builds the response from the rest.
+    """
+    if view is None:
+        return functools.partial(idempotent, private=private, reissue=reissue)
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        request = next(arg for arg in args if isinstance(arg, Request))
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field("key").max_length:
+            return error(f"{HEADER} is too long.", status.HTTP_400_BAD_REQUEST)
+
+        claim = Claim(request_scope(request), key, fingerprint(request), private)
+        cached = caches[settings.IDEMPOTENCY_CACHE].get(claim.cache_key)
+        if cached is not None:
+            cached_fingerprint, status_code, stored = cached
+            if cached_fingerprint != claim.fingerprint:
+                return error(REUSED, status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return replay(status_code, stored, reissue)
+
+        record = claim.acquire()
+        if record is not None:
+            if record.fingerprint != claim.fingerprint:
+                return error(REUSED, status.HTTP_422_UNPROCESSABLE_ENTITY)
+            record = claim.wait(record)
+            if record is None:
+                # The first request failed and released the key
+                return wrapper(*args, **kwargs)
+            if record.status_code is None:
+                detail = "A request with this key is still being processed."
+                return error(detail, status.HTTP_409_CONFLICT, **{"Retry-After": "1"})
+            return replay(record.status_code, record.response, reissue)
+
+        try:
+            response = view(*args, **kwargs)
+        except BaseException:
+            claim.release()
+            raise
+        if response.status_code >= 500 or response.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+            claim.release()
+        else:
+            claim.store(response)
+        return response
+
+    return wrapper
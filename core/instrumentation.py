@@ -0,0 +1,91 @@
+# core/instrumentation.py
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from rest_framework.serializers import BaseSerializer
+
+# Metrics of the current request, None when the request isn't sampled
+current_metrics = ContextVar("request_metrics", default=None)
+
+_NUMBER_RE = re.compile(r"\b\d+\b")
+_PLACEHOLDER_LIST_RE = re.compile(r"%s(?:\s*,\s*%s)+")
+
+
+def query_shape(sql):
+    """SQL with literals and IN-lists collapsed, so repeats of the same query compare equal."""
+    return _PLACEHOLDER_LIST_RE.sub("%s, ...", _NUMBER_RE.sub("N", sql))
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view = None
+        self.query_count = 0
+        self.shapes = Counter()
+        self.timings = {"db": 0.0}
+
+    def add_timing(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def record_query(self, sql, seconds):
+        self.query_count += 1
+        self.shapes[query_shape(sql)] += 1
+        self.timings["db"] += seconds
+
+    def repeated_queries(self, threshold):
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def server_timing(self):
+        entries = [f'db;dur={self.timings["db"] * 1000:.1f};desc="{self.query_count} queries"']
+        entries += [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.timings.items() if name != "db"]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request's `name` timing, if it's sampled."""
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_timing(name, time.perf_counter() - started)
+
+
+def query_recorder(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.record_query(sql, time.perf_counter() - started)
+
+
+_serializer_data = BaseSerializer.data
+
+
+def _timed_serializer_data(self):
+    # Nested and list serializers go through here too, only time the outermost call
+    metrics = current_metrics.get()
+    if metrics is None or getattr(metrics, "_serializing", False):
+        return _serializer_data.fget(self)
+    metrics._serializing = True
+    try:
+        with timed("serialize"):
+            return _serializer_data.fget(self)
+    finally:
+        metrics._serializing = False
+
+
+def install_serializer_timing():
+    """DRF has no hook around serialization, so wrap BaseSerializer.data (every serializer's .data goes through it)."""
+    BaseSerializer.data = property(_timed_serializer_data)
@@ -0,0 +1,240 @@
+# core/management/commands/benchmark_api.py
+import http.client
+import json
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_MIX = "login=1,refresh=1,list=6,create=3,done=2,habitize=1"
+LIST_QUERIES = ("", "?type=todo", "?type=habit", "?date={today}")
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class ApiClient:
+    """One keep-alive connection and one seeded user per benchmark thread."""
+
+    def __init__(self, base_url, email, password):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=30)
+        self.prefix = parts.path.rstrip("/")
+        self.email = email
+        self.password = password
+        self.access = self.refresh = None
+
+    def request(self, method, path, payload=None):
+        headers = {"Accept": "application/json"}
+        body = None
+        if payload is not None:
+            body = json.dumps(payload)
+            headers["Content-Type"] = "application/json"
+        if self.access:
+            headers["Authorization"] = f"Bearer {self.access}"
+        started = time.perf_counter()
+        try:
+            self.connection.request(method, self.prefix + path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            raise
+        elapsed = time.perf_counter() - started
+        data = (
+            json.loads(content)
+            if content and response.getheader("Content-Type", "").startswith("application/json")
+            else None
+        )
+        return response.status, data, elapsed
+
+    def login(self):
+        self.access = None
+        status, data, elapsed = self.request(
+            "POST", "/api/auth/login/", {"email": self.email, "password": self.password}
+        )
+        if status == 200:
+            self.access, self.refresh = data["access"], data["refresh"]
+        return status, elapsed
+
+    def create_log(self, log_type="log"):
+        payload = {"text": f"benchmark {log_type} {random.random():.6f}", "type": log_type}
+        if log_type == "todo":
+            payload["scheduled_for"] = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+        return self.request("POST", "/api/journal-logs/", payload)
+
+    # Scenarios, each returns (status, seconds) of the measured request
+
+    def scenario_login(self):
+        return self.login()
+
+    def scenario_refresh(self):
+        status, data, elapsed = self.request("POST", "/api/auth/refresh/", {"refresh": self.refresh})
+        if status == 200:
+            self.access = data["access"]
+            self.refresh = data.get("refresh", self.refresh)
+        return status, elapsed
+
+    def scenario_list(self):
+        query = random.choice(LIST_QUERIES).format(today=date.today().isoformat())
+        status, _, elapsed = self.request("GET", f"/api/journal-logs/{query}")
+        return status, elapsed
+
+    def scenario_create(self):
+        status, _, elapsed = self.create_log()
+        return status, elapsed
+
+    def scenario_done(self):
+        status, data, _ = self.create_log("todo")
+        if status != 201:
+            return status, 0.0
+        status, _, elapsed = self.request("POST", f"/api/journal-logs/{data['id']}/done/")
+        return status, elapsed
+
+    def scenario_habitize(self):
+        status, data, _ = self.create_log()
+        if status != 201:
+            return status, 0.0
+        status, _, elapsed = self.request("POST", f"/api/journal-logs/{data['id']}/habitize/")
+        return status, elapsed
+
+
+class Command(BaseCommand):
+    help = (
+        "Run scripted API scenarios (login, refresh, list with filters, create, done, habitize) against a "
+        "running server with users from seed_benchmark_data, report throughput and p50/p95/p99 latency, "
+        "and compare them to a JSON baseline. Raise the throttle rates on the server first."
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000")
+        parser.add_argument("--users", type=int, default=100, help="Seeded users to spread the load over")
+        parser.add_argument("--password", default="benchmark-password")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--duration", type=float, default=30.0, help="Seconds of measured load")
+        parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Scenario weights (default: {DEFAULT_MIX})")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--baseline", help="Baseline JSON to compare against")
+        parser.add_argument("--save-baseline", action="store_true", help="Write the results to --baseline instead")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.15,
+            help="Allowed regression: p95 up or throughput down by more than this fraction fails",
+        )
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options["mix"])
+        results = self.run(options, mix)
+        self.report(results)
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+
+        if options["baseline"]:
+            if options["save_baseline"]:
+                with open(options["baseline"], "w") as f:
+                    json.dump(results, f, indent=2)
+                self.stdout.write(f"Baseline written to {options['baseline']}")
+            else:
+                self.compare(results, options["baseline"], options["threshold"])
+
+    def parse_mix(self, value):
+        mix = {}
+        for entry in value.split(","):
+            name, _, weight = entry.partition("=")
+            if not hasattr(ApiClient, f"scenario_{name}"):
+                raise CommandError(f"Unknown scenario '{name}'")
+            mix[name] = float(weight or 1)
+        return mix
+
+    def run(self, options, mix):
+        samples = {name: [] for name in mix}
+        errors = {name: {} for name in mix}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options["duration"]
+        names, weights = list(mix), list(mix.values())
+
+        def worker(index):
+            client = ApiClient(options["url"], f"bench-{index % options['users']}@example.com", options["password"])
+            status, _ = client.login()
+            if status != 200:
+                with lock:
+                    errors.setdefault("setup", {})[str(status)] = errors.get("setup", {}).get(str(status), 0) + 1
+                return
+            while time.monotonic() < deadline:
+                name = random.choices(names, weights)[0]
+                try:
+                    status, elapsed = getattr(client, f"scenario_{name}")()
+                except (OSError, http.client.HTTPException) as exc:
+                    status, elapsed = type(exc).__name__, 0.0
+                with lock:
+                    if isinstance(status, int) and status < 400:
+                        samples[name].append(elapsed)
+                    else:
+                        errors[name][str(status)] = errors[name].get(str(status), 0) + 1
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(options["concurrency"])]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        if "setup" in errors:
+            raise CommandError(f"Login failed for some benchmark users: {errors['setup']}, run seed_benchmark_data")
+
+        results = {"duration": round(elapsed, 2), "concurrency": options["concurrency"], "scenarios": {}}
+        for name, values in samples.items():
+            values.sort()
+            results["scenarios"][name] = {
+                "requests": len(values),
+                "errors": errors[name],
+                "throughput": round(len(values) / elapsed, 2),
+                **{
+                    f"p{int(fraction * 100)}_ms": round(_percentile(values, fraction) * 1000, 2) if values else None
+                    for fraction in (0.5, 0.95, 0.99)
+                },
+            }
+        return results
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'scenario':<10} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  errors"
+        )
+        for name, result in results["scenarios"].items():
+            p50, p95, p99 = (
+                result[key] if result[key] is not None else float("nan") for key in ("p50_ms", "p95_ms", "p99_ms")
+            )
+            self.stdout.write(
+                f"{name:<10} {result['requests']:>9} {result['throughput']:>8.1f} {p50:>8.1f} {p95:>8.1f} "
+                f"{p99:>8.1f}  {result['errors'] or ''}"
+            )
+            if "429" in result["errors"]:
+                self.stdout.write(self.style.WARNING(f"{name}: throttled, raise the THROTTLE_* rates on the server"))
+
+    def compare(self, results, baseline_path, threshold):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+        regressions = []
+        for name, result in results["scenarios"].items():
+            base = baseline["scenarios"].get(name)
+            if not base or not result["requests"]:
+                continue
+            if base["p95_ms"] and result["p95_ms"] > base["p95_ms"] * (1 + threshold):
+                regressions.append(f"{name}: p95 {result['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+            if base["throughput"] and result["throughput"] < base["throughput"] * (1 - threshold):
+                regressions.append(f"{name}: {result['throughput']} req/s vs baseline {base['throughput']} req/s")
+
+        if regressions:
+            raise CommandError("Regressions beyond {:.0%}:\n".format(threshold) + "\n".join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regressions beyond {threshold:.0%} against {baseline_path}"))
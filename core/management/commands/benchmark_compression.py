@@ -0,0 +1,75 @@
+# core/management/commands/benchmark_compression.py
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIClient
+
+from core.compression import CODECS, compress, is_compressible_file
+
+DEFAULT_PATHS = (
+    "/api/journal-logs/",
+    "/api/journal-logs/?type=todo",
+    "/api/journal-logs/agenda/",
+    "/api/users/",
+    "/api/schema/?format=json",
+)
+STATIC_FILES = ("admin/css/base.css", "admin/js/actions.js", "admin/js/vendor/jquery/jquery.min.js")
+LEVELS = {"gzip": (1, 6, 9), "br": (1, 4, 11), "zstd": (1, 3, 19)}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compression CPU cost against bytes saved, on real API responses of a user and on static files. "
+        "`net` is the transfer time saved on a --link-mbps link minus the compression time, "
+        "negative when compressing costs more than it saves."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--email", required=True, help="User whose API responses are compressed")
+        parser.add_argument("--path", action="append", help="API path to compress (repeatable)")
+        parser.add_argument("--repeat", type=int, default=20, help="Compressions per payload and level")
+        parser.add_argument("--link-mbps", type=float, default=10.0, help="Client bandwidth for the net column")
+
+    def handle(self, *args, **options):
+        user = get_user_model().objects.filter(email=options["email"]).first()
+        if user is None:
+            raise CommandError(f"No user with email {options['email']}")
+        host = next((host for host in settings.ALLOWED_HOSTS if "*" not in host), "localhost")
+        client = APIClient(HTTP_HOST=host)
+        client.force_authenticate(user)
+
+        payloads = []
+        for path in options["path"] or DEFAULT_PATHS:
+            response = client.get(path)
+            if response.status_code != 200:
+                self.stderr.write(f"Skipping {path}: {response.status_code}")
+                continue
+            payloads.append((path, response.content))
+        for name in STATIC_FILES:
+            found = finders.find(name)
+            if found and is_compressible_file(found):
+                with open(found, "rb") as f:
+                    payloads.append((f"static {name}", f.read()))
+
+        bytes_per_ms = options["link_mbps"] * 1e6 / 8 / 1000
+        self.stdout.write(
+            f"{'payload':<42} {'bytes':>9} {'coding':>8} {'out':>9} {'saved':>7} {'cpu ms':>8} {'net ms':>8}"
+        )
+        for label, content in payloads:
+            for encoding in CODECS:
+                for level in LEVELS[encoding]:
+                    timings = []
+                    for _ in range(options["repeat"]):
+                        started = time.perf_counter()
+                        compressed = compress(encoding, content, level)
+                        timings.append((time.perf_counter() - started) * 1000)
+                    cpu_ms = statistics.median(timings)
+                    saved = len(content) - len(compressed)
+                    self.stdout.write(
+                        f"{label[:42]:<42} {len(content):>9} {f'{encoding}-{level}':>8} {len(compressed):>9} "
+                        f"{saved / len(content):>7.1%} {cpu_ms:>8.2f} {saved / bytes_per_ms - cpu_ms:>8.1f}"
+                    )
@@ -0,0 +1,92 @@
+# core/management/commands/benchmark_db_connections.py
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure connection acquisition latency under concurrency with the configured database settings. "
+        "Each iteration acquires a connection, runs SELECT 1 and releases it, the way a request does."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--threads", type=int, default=16, help="Concurrent request threads")
+        parser.add_argument("--iterations", type=int, default=200, help="Requests per thread")
+        parser.add_argument(
+            "--idle",
+            type=float,
+            default=0.0,
+            help="Seconds each thread sleeps between requests, to simulate idle gaps",
+        )
+
+    def handle(self, *args, **options):
+        alias = options["database"]
+        if alias not in connections:
+            raise CommandError(f"Unknown database alias '{alias}'")
+
+        settings_dict = connections[alias].settings_dict
+        pool = settings_dict["OPTIONS"].get("pool")
+        mode = "pool" if pool else f"CONN_MAX_AGE={settings_dict['CONN_MAX_AGE']}"
+        self.stdout.write(f"Database '{alias}' ({mode}), {options['threads']} threads x {options['iterations']}")
+
+        acquire, query = [], []
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            local_acquire, local_query = [], []
+            connection = connections[alias]
+            try:
+                for _ in range(options["iterations"]):
+                    started = time.perf_counter()
+                    connection.ensure_connection()
+                    acquired = time.perf_counter()
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                        cursor.fetchone()
+                    local_acquire.append(acquired - started)
+                    local_query.append(time.perf_counter() - acquired)
+                    # Same as the request_finished handler, returns the connection to the pool when pooling
+                    connection.close_if_unusable_or_obsolete()
+                    if options["idle"]:
+                        time.sleep(options["idle"])
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+                with lock:
+                    acquire.extend(local_acquire)
+                    query.extend(local_query)
+
+        threads = [threading.Thread(target=worker) for _ in range(options["threads"])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        if errors:
+            self.stdout.write(self.style.ERROR(f"{len(errors)} threads failed, first error: {errors[0]!r}"))
+        if not acquire:
+            raise CommandError("No successful iterations")
+
+        acquire.sort()
+        query.sort()
+        self.stdout.write(f"{'':<10} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}  (ms)")
+        for label, values in (("acquire", acquire), ("select 1", query)):
+            self.stdout.write(
+                f"{label:<10} {statistics.fmean(values) * 1000:>9.3f} {_percentile(values, 0.5) * 1000:>9.3f} "
+                f"{_percentile(values, 0.95) * 1000:>9.3f} {_percentile(values, 0.99) * 1000:>9.3f} "
+                f"{values[-1] * 1000:>9.3f}"
+            )
+        self.stdout.write(f"throughput {len(acquire) / elapsed:.1f} requests/s")
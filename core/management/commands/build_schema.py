@@ -0,0 +1,12 @@
+# core/management/commands/build_schema.py
+from django.core.management.base import BaseCommand
+
+from core.schema import write_artifacts
+
+
+class Command(BaseCommand):
+    help = "Render the OpenAPI schema into API_SCHEMA_DIR, served by /api/schema/ unless DEBUG is on."
+
+    def handle(self, *args, **options):
+        for path in write_artifacts():
+            self.stdout.write(f"Wrote {path}")
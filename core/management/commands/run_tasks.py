@@ -0,0 +1,98 @@
+# core/management/commands/run_tasks.py
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils.module_loading import autodiscover_modules
+
+from core import tasks
+from core.metrics import registry
+
+MAINTENANCE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background tasks from the database queue. Start as many workers as needed, "
+        "per-queue concurrency limits from TASK_QUEUES hold across all of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--queue",
+            action="append",
+            dest="queues",
+            help="Queue to work on (repeatable), defaults to every queue in TASK_QUEUES",
+        )
+        parser.add_argument("--threads", type=int, default=settings.TASK_WORKER_THREADS, help="Tasks run at once")
+        parser.add_argument(
+            "--poll-interval", type=float, default=settings.TASK_POLL_INTERVAL, help="Seconds between empty polls"
+        )
+        parser.add_argument("--burst", action="store_true", help="Exit once no task is due instead of polling")
+
+    def handle(self, *args, **options):
+        autodiscover_modules("tasks")
+        queues = options["queues"] or list(settings.TASK_QUEUES)
+        threads = options["threads"]
+        if threads < 1:
+            raise CommandError("--threads must be at least 1")
+
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+        self.stdout.write(f"Worker {worker} on {', '.join(queues)} with {threads} threads")
+
+        self.busy = 0
+        self.changed = threading.Condition()
+        next_maintenance = 0.0
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="task") as pool:
+            while not self.stopping.is_set():
+                if time.monotonic() >= next_maintenance:
+                    tasks.requeue_abandoned()
+                    tasks.schedule_periodic()
+                    tasks.purge_finished()
+                    next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+
+                claimed = 0
+                for queue in queues:
+                    if self.busy >= threads:
+                        break
+                    for task in tasks.claim(queue, threads - self.busy, worker):
+                        with self.changed:
+                            self.busy += 1
+                        pool.submit(self.run, task)
+                        claimed += 1
+                registry.flush()
+
+                if claimed and self.busy < threads:
+                    continue
+                if not claimed and options["burst"] and not self.busy:
+                    break
+                with self.changed:
+                    # Poll again after the interval, or as soon as a thread frees up when all are busy
+                    self.changed.wait_for(
+                        lambda: self.stopping.is_set() or (claimed and self.busy < threads),
+                        timeout=options["poll_interval"],
+                    )
+            self.stdout.write("Waiting for running tasks to finish")
+        registry.flush(force=True)
+
+    def run(self, task):
+        close_old_connections()
+        try:
+            tasks.execute(task)
+        finally:
+            close_old_connections()
+            with self.changed:
+                self.busy -= 1
+                self.changed.notify()
+
+    def stop(self, signum, frame):
+        self.stopping.set()
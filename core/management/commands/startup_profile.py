@@ -0,0 +1,112 @@
+# core/management/commands/startup_profile.py
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+# Runs in a fresh interpreter, the way a worker starts: import the WSGI app, optionally warm
+# it up, then serve the same request twice
+WORKER = """
+import io, json, os, sys, time
+started = time.perf_counter()
+from habij.wsgi import application
+imported = time.perf_counter()
+if os.environ["STARTUP_PROFILE_WARMUP"] == "1":
+    from core.warmup import warmup
+    warmup()
+ready = time.perf_counter()
+
+def request():
+    path, _, query = os.environ["STARTUP_PROFILE_PATH"].partition("?")
+    host = os.environ["STARTUP_PROFILE_HOST"]
+    environ = {
+        "REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": query, "SERVER_NAME": host, "SERVER_PORT": "80",
+        "HTTP_HOST": host, "wsgi.input": io.BytesIO(), "wsgi.url_scheme": "http", "wsgi.errors": sys.stderr,
+    }
+    if os.environ.get("STARTUP_PROFILE_TOKEN"):
+        environ["HTTP_AUTHORIZATION"] = "Bearer " + os.environ["STARTUP_PROFILE_TOKEN"]
+    statuses = []
+    start = time.perf_counter()
+    body = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b"".join(body)
+    body.close()
+    return time.perf_counter() - start, statuses[0]
+
+first, status = request()
+second, _ = request()
+print(json.dumps({
+    "import": imported - started, "warmup": ready - imported, "first_request": first, "second_request": second,
+    "first_response": ready - started + first, "status": status,
+}))
+"""
+STEPS = ("import", "warmup", "first_request", "second_request", "first_response")
+
+
+class Command(BaseCommand):
+    help = (
+        "Profile worker startup: import time per top-level package, and the time from a fresh interpreter "
+        "to its first response with and without core.warmup."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default="/api/journal-logs/", help="Request served after startup")
+        parser.add_argument("--email", help="Authenticate the request as this user, anonymous otherwise")
+        parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per variant, medians are shown")
+        parser.add_argument("--top", type=int, default=20, help="Packages shown in the import breakdown")
+
+    def handle(self, *args, **options):
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "habij.settings"),
+            "STARTUP_PROFILE_PATH": options["path"],
+            "STARTUP_PROFILE_HOST": next((host for host in settings.ALLOWED_HOSTS if "*" not in host), "localhost"),
+        }
+        if options["email"]:
+            from django.contrib.auth import get_user_model
+            from rest_framework_simplejwt.tokens import AccessToken
+
+            user = get_user_model().objects.filter(email=options["email"]).first()
+            if user is None:
+                raise CommandError(f"No user with email {options['email']}")
+            env["STARTUP_PROFILE_TOKEN"] = str(AccessToken.for_user(user))
+
+        self.imports(env, options["top"])
+        self.stdout.write(f"\nTime to first response, GET {options['path']}, median of {options['runs']} runs (ms)")
+        self.stdout.write(f"{'':>10} " + " ".join(f"{step:>15}" for step in STEPS))
+        for name, warmup in (("cold", "0"), ("warmed up", "1")):
+            runs = [self.run_worker({**env, "STARTUP_PROFILE_WARMUP": warmup}) for _ in range(options["runs"])]
+            medians = [statistics.median(run[step] for run in runs) * 1000 for step in STEPS]
+            self.stdout.write(f"{name:>10} " + " ".join(f"{median:>15.1f}" for median in medians))
+        self.stdout.write(f"Response status: {runs[-1]['status']}")
+
+    def imports(self, env, top):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import habij.wsgi"],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            raise CommandError(f"Importing the WSGI app failed:\n{result.stderr[-2000:]}")
+        packages = Counter()
+        for line in result.stderr.splitlines():
+            if match := IMPORT_TIME.match(line):
+                packages[match[4].split(".")[0]] += int(match[1])
+        total = sum(packages.values())
+        self.stdout.write(f"Import time of the WSGI app: {total / 1000:.1f}ms, by top-level package (self time)")
+        for package, micros in packages.most_common(top):
+            self.stdout.write(f"  {package:<30} {micros / 1000:>8.1f}ms {micros / total:>6.1%}")
+
+    def run_worker(self, env):
+        result = subprocess.run([sys.executable, "-c", WORKER], env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError(f"Startup run failed:\n{result.stderr[-2000:]}")
+        return json.loads(result.stdout.strip().splitlines()[-1])
@@ -0,0 +1,60 @@
+# core/management/commands/trace_sampling.py
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.tracing import policy
+
+
+class Command(BaseCommand):
+    help = (
+        "Show or change Sentry trace sampling at runtime. Changes are written to SENTRY_SAMPLING_FILE "
+        "and picked up by running workers within seconds, no restart needed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--default", type=float, help="Base rate for routes without their own rate")
+        parser.add_argument("--slow-ms", type=float, help="Requests at least this slow are always kept")
+        parser.add_argument("--max-per-second", type=float, help="Cap on recorded requests per second per worker")
+        parser.add_argument(
+            "--route",
+            action="append",
+            default=[],
+            metavar="PREFIX=RATE",
+            help="Base rate for a path prefix (repeatable), e.g. /api/journal-logs/=0.02",
+        )
+        parser.add_argument("--reset", action="store_true", help="Drop all runtime overrides")
+
+    def handle(self, *args, **options):
+        path = settings.SENTRY_SAMPLING_FILE
+        if options["reset"]:
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            overrides = {}
+            if os.path.exists(path):
+                with open(path) as f:
+                    overrides = json.load(f)
+
+            for option, key in (
+                ("default", "default"),
+                ("slow_ms", "slow_ms"),
+                ("max_per_second", "max_per_second"),
+            ):
+                if options[option] is not None:
+                    overrides[key] = options[option]
+            for route in options["route"]:
+                prefix, separator, rate = route.partition("=")
+                if not separator:
+                    raise CommandError(f"Invalid --route '{route}', expected PREFIX=RATE")
+                overrides.setdefault("routes", {})[prefix] = float(rate)
+
+            if overrides:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(overrides, f, indent=2)
+                os.replace(tmp_path, path)
+
+        self.stdout.write(json.dumps(policy.current(), indent=2))
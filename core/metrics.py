@@ -0,0 +1,272 @@
+# core/metrics.py
+"""
+Prometheus-style metrics shared by all worker processes without an external service.
+
+Each process keeps its metrics in memory and flushes them to its own JSON file under
+METRICS_DIR at most every METRICS_FLUSH_INTERVAL seconds. The scrape endpoint merges the
+files: counters and histograms are summed over every process that ever ran, gauges only
+over live ones. Files of dead processes are folded into an archive file so counters never
+go backwards when gunicorn recycles workers.
+
+Writers are told apart by hostname and pid, since containers sharing METRICS_DIR have
+their own pid namespaces. A process on this host is dead once its pid is gone, one on
+another host once it hasn't flushed for METRICS_WRITER_TIMEOUT seconds. A process whose
+file was folded while it was idle keeps counting from what the archive holds.
+"""
+
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HOSTNAME = socket.gethostname()
+
+HELP = {
+    "habij_http_request_duration_seconds": ("histogram", "Request latency by view and action"),
+    "habij_http_responses_total": ("counter", "Responses by view, action and status code"),
+    "habij_http_requests_in_progress": ("gauge", "Requests being handled"),
+    "habij_auth_failures_total": ("counter", "401/403 responses by view and action"),
+    "habij_compression_input_bytes_total": ("counter", "Response bytes before compression by encoding"),
+    "habij_compression_output_bytes_total": ("counter", "Response bytes after compression by encoding"),
+    "habij_cache_requests_total": ("counter", "Cache lookups by cache and result"),
+    "habij_cache_local_hits_total": ("counter", "Cache hits served from the process' own copy by cache"),
+    "habij_cache_early_refreshes_total": ("counter", "Cache entries recomputed before they expired by cache"),
+    "habij_cache_write_errors_total": ("counter", "Cache writes that failed, e.g. on a full disk, by cache"),
+    "habij_db_pool_size": ("gauge", "Open connections in the database pool"),
+    "habij_db_pool_available": ("gauge", "Idle connections in the database pool"),
+    "habij_db_pool_requests_waiting": ("gauge", "Requests waiting for a pooled connection"),
+    "habij_sse_connections": ("gauge", "Open journal event streams"),
+    "habij_query_guard_total": ("counter", "Requests ended by a query limit by view, action and limit"),
+    "habij_tasks_total": ("counter", "Background task runs by queue, task and outcome"),
+    "habij_task_duration_seconds": ("histogram", "Background task run time by queue and task"),
+}
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.gauges = defaultdict(float)
+        self.histograms = {}
+        self.last_flush = 0.0
+        self.path = None
+        # The snapshot in the file at `path`
+        self.flushed = None
+
+    def inc(self, name, labels=(), value=1.0):
+        with self.lock:
+            self.counters[(name, labels)] += value
+
+    def add_gauge(self, name, labels=(), value=1.0):
+        with self.lock:
+            self.gauges[(name, labels)] += value
+
+    def set_gauge(self, name, labels=(), value=0.0):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[(name, labels)] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "host": HOSTNAME,
+                "pid": os.getpid(),
+                "flushed_at": time.time(),
+                "counters": [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                "gauges": [[name, list(labels), value] for (name, labels), value in self.gauges.items()],
+                "histograms": [
+                    [name, list(labels), dict(h, buckets=list(h["buckets"]))]
+                    for (name, labels), h in self.histograms.items()
+                ],
+            }
+
+    def flush(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_flush < settings.METRICS_FLUSH_INTERVAL:
+            return
+        self.last_flush = now
+        collect_pool_stats(self)
+        prefix = os.path.join(settings.METRICS_DIR, f"{HOSTNAME}-{os.getpid()}-")
+        if self.path is None or not self.path.startswith(prefix):
+            # New file per process, forked workers must not share their parent's
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            self.path = f"{prefix}{time.time_ns()}.json"
+            self.flushed = None
+        # Locked like collect(), so a file isn't replaced between being folded and removed
+        with open(os.path.join(settings.METRICS_DIR, "lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.flushed is not None and not os.path.exists(self.path):
+                # Folded into the archive while idle, which counts it from now on
+                self.subtract(self.flushed)
+            snapshot = self.snapshot()
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+        self.flushed = snapshot
+
+    def subtract(self, snapshot):
+        with self.lock:
+            for name, labels, value in snapshot["counters"]:
+                self.counters[(name, tuple(map(tuple, labels)))] -= value
+            for name, labels, archived in snapshot["histograms"]:
+                histogram = self.histograms[(name, tuple(map(tuple, labels)))]
+                histogram["buckets"] = [a - b for a, b in zip(histogram["buckets"], archived["buckets"])]
+                histogram["sum"] -= archived["sum"]
+                histogram["count"] -= archived["count"]
+
+
+registry = Registry()
+
+
+def collect_pool_stats(target):
+    from django.db import connections
+
+    for alias in connections:
+        pools = getattr(connections[alias], "_connection_pools", None)
+        if pools and alias in pools:
+            stats = pools[alias].get_stats()
+            labels = (("alias", alias),)
+            target.set_gauge("habij_db_pool_size", labels, stats.get("pool_size", 0))
+            target.set_gauge("habij_db_pool_available", labels, stats.get("pool_available", 0))
+            target.set_gauge("habij_db_pool_requests_waiting", labels, stats.get("requests_waiting", 0))
+
+
+def record_cache(cache, hit):
+    registry.inc("habij_cache_requests_total", (("cache", cache), ("result", "hit" if hit else "miss")))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _writer_alive(snapshot):
+    if snapshot.get("host") == HOSTNAME:
+        return _pid_alive(snapshot["pid"])
+    # Another container's pid means nothing here, or a file from before hostnames were recorded
+    return time.time() - snapshot.get("flushed_at", 0) < settings.METRICS_WRITER_TIMEOUT
+
+
+def _merge(totals, snapshot, include_gauges):
+    for name, labels, value in snapshot["counters"]:
+        totals["counters"][(name, tuple(map(tuple, labels)))] += value
+    if include_gauges:
+        for name, labels, value in snapshot["gauges"]:
+            totals["gauges"][(name, tuple(map(tuple, labels)))] += value
+    for name, labels, histogram in snapshot["histograms"]:
+        key = (name, tuple(map(tuple, labels)))
+        empty = {"buckets": [0] * len(histogram["buckets"]), "sum": 0, "count": 0}
+        merged = totals["histograms"].setdefault(key, empty)
+        merged["buckets"] = [a + b for a, b in zip(merged["buckets"], histogram["buckets"])]
+        merged["sum"] += histogram["sum"]
+        merged["count"] += histogram["count"]
+
+
+def _empty_totals():
+    return {"counters": defaultdict(float), "gauges": defaultdict(float), "histograms": {}}
+
+
+def _dump_totals(totals):
+    return {
+        "pid": None,
+        "counters": [[name, list(labels), value] for (name, labels), value in totals["counters"].items()],
+        "gauges": [],
+        "histograms": [[name, list(labels), h] for (name, labels), h in totals["histograms"].items()],
+    }
+
+
+def collect():
+    """Merge the metrics of all processes, folding dead processes into the archive."""
+    registry.flush(force=True)
+    directory = settings.METRICS_DIR
+    archive_path = os.path.join(directory, "archive.json")
+    totals = _empty_totals()
+
+    with open(os.path.join(directory, "lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive = _empty_totals()
+        if os.path.exists(archive_path):
+            with open(archive_path) as f:
+                _merge(archive, json.load(f), include_gauges=False)
+
+        dead = []
+        for filename in os.listdir(directory):
+            if not filename.endswith(".json") or filename == "archive.json":
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if _writer_alive(snapshot):
+                _merge(totals, snapshot, include_gauges=True)
+            else:
+                _merge(archive, snapshot, include_gauges=False)
+                dead.append(path)
+
+        if dead:
+            tmp_path = f"{archive_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(_dump_totals(archive), f)
+            os.replace(tmp_path, archive_path)
+            for path in dead:
+                os.remove(path)
+
+    _merge(totals, _dump_totals(archive), include_gauges=False)
+    return totals
+
+
+def _format_labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = ((key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def exposition(totals):
+    """Render merged metrics in the Prometheus text exposition format (0.0.4)."""
+    series = defaultdict(list)
+    for (name, labels), value in sorted(totals["counters"].items()):
+        series[name].append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), value in sorted(totals["gauges"].items()):
+        series[name].append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(totals["histograms"].items(), key=lambda item: item[0]):
+        # Buckets are stored cumulative already
+        for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+            series[name].append(f"{name}_bucket{_format_labels(labels, (('le', bound),))} {count}")
+        series[name].append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {histogram['count']}")
+        series[name].append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+        series[name].append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+    lines = []
+    for name in sorted(series):
+        metric_type, description = HELP.get(name, ("untyped", ""))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(series[name])
+    return "\n".join(lines) + "\n"
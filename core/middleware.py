@@ -0,0 +1,190 @@
+# core/middleware.py
+import json
+import logging
+import random
+import secrets
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+
+from .compression import compress, is_compressible, negotiate
+from .instrumentation import RequestMetrics, current_metrics, query_recorder
+from .metrics import registry
+from .query_guard import QueryGuard, QueryTimeout, TooManyRows, guard_queries
+
+logger = logging.getLogger("core.instrumentation")
+
+
+def view_label(view_func, method):
+    """`ViewSet.action` for DRF viewsets, the view's name otherwise."""
+    view_class = getattr(view_func, "cls", None)
+    if view_class is None:
+        return getattr(view_func, "__name__", repr(view_func))
+    # Routers map HTTP methods to viewset actions on the view function
+    action = (getattr(view_func, "actions", None) or {}).get(method.lower())
+    return f"{view_class.__name__}.{action}" if action else view_class.__name__
+
+
+class InstrumentationMiddleware:
+    """
+    Records query count, DB time, serializer and render time for a sample of requests.
+
+    They're logged as one JSON line per request, and sent back in a Server-Timing header
+    with INSTRUMENTATION_SERVER_TIMING (by default only in DEBUG, they tell clients about
+    the backend).
+    Query shapes repeated INSTRUMENTATION_N_PLUS_ONE_THRESHOLD times or more in one request
+    are logged as a likely N+1.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.INSTRUMENTATION_SAMPLE_RATE:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(query_recorder))
+                response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+
+        if settings.INSTRUMENTATION_SERVER_TIMING:
+            response["Server-Timing"] = metrics.server_timing()
+        self.log(request, response, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = current_metrics.get()
+        if metrics is not None:
+            metrics.view = view_label(view_func, request.method)
+
+    def process_template_response(self, request, response):
+        metrics = current_metrics.get()
+        if metrics is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(lambda r: metrics.add_timing("render", time.perf_counter() - started))
+        return response
+
+    def log(self, request, response, metrics):
+        repeated = metrics.repeated_queries(settings.INSTRUMENTATION_N_PLUS_ONE_THRESHOLD)
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "view": metrics.view,
+            "status": response.status_code,
+            "queries": metrics.query_count,
+            "total_ms": round((time.perf_counter() - metrics.started) * 1000, 1),
+            **{f"{name}_ms": round(seconds * 1000, 1) for name, seconds in metrics.timings.items()},
+        }
+        if repeated:
+            record["n_plus_one"] = [{"count": count, "sql": shape} for shape, count in repeated]
+            logger.warning(json.dumps(record))
+        else:
+            logger.info(json.dumps(record))
+
+
+class MetricsMiddleware:
+    """Feeds request latency, status and in-flight metrics per view and action into core.metrics."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request._metrics_view = "unresolved"
+        started = time.perf_counter()
+        registry.add_gauge("habij_http_requests_in_progress")
+        try:
+            response = self.get_response(request)
+        finally:
+            registry.add_gauge("habij_http_requests_in_progress", value=-1)
+
+        labels = (("view", request._metrics_view), ("method", request.method))
+        registry.observe("habij_http_request_duration_seconds", labels, time.perf_counter() - started)
+        registry.inc("habij_http_responses_total", (*labels, ("status", str(response.status_code))))
+        if response.status_code in (401, 403):
+            registry.inc("habij_auth_failures_total", labels)
+        registry.flush()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = view_label(view_func, request.method)
+
+
+class QueryGuardMiddleware:
+    """Applies the QUERY_LIMITS of the view to its queries, see core.query_guard."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # The default limits until the view is known
+        request._query_guard = QueryGuard()
+        with guard_queries(request._query_guard):
+            return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_guard.configure(view_label(view_func, request.method))
+
+    def process_exception(self, request, exception):
+        # DRF views answer these themselves, the others (admin, metrics) would end in a 500
+        if isinstance(exception, (QueryTimeout, TooManyRows)):
+            return JsonResponse({"detail": str(exception.detail)}, status=exception.status_code)
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with the first of COMPRESSION_ENCODINGS the client accepts.
+
+    Streaming responses, responses smaller than COMPRESSION_MIN_SIZE, types that are compressed
+    already and responses that carry a Content-Encoding are sent as they are. Like Django's
+    GZipMiddleware, it pads compressed responses with up to max_random_bytes against BREACH.
+    """
+
+    max_random_bytes = 100
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            response.streaming
+            or response.has_header("Content-Encoding")
+            or not is_compressible(response.get("Content-Type", ""))
+            or len(response.content) < settings.COMPRESSION_MIN_SIZE
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        encoding = negotiate(request.headers.get("Accept-Encoding", ""))
+        if encoding is None:
+            return response
+        compressed = compress(
+            encoding,
+            response.content,
+            settings.COMPRESSION_LEVELS.get(encoding),
+            padding=secrets.randbelow(self.max_random_bytes),
+        )
+        if len(compressed) >= len(response.content):
+            return response
+
+        labels = (("encoding", encoding),)
+        registry.inc("habij_compression_input_bytes_total", labels, len(response.content))
+        registry.inc("habij_compression_output_bytes_total", labels, len(compressed))
+        response.content = compressed
+        response["Content-Length"] = str(len(compressed))
+        response["Content-Encoding"] = encoding
+        # The bytes differ from the uncompressed response's, so its ETag only matches weakly
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = f"W/{etag}"
+        return response
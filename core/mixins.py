@@ -0,0 +1,30 @@
+# core/mixins.py
+from rest_framework.permissions import SAFE_METHODS
+
+from .db_routers import is_pinned_to_primary, pin_to_primary, reset_replica, use_replica
+
+
+class ReplicaReadMixin:
+    """
+    Lets read-only actions of a viewset read from the replicas.
+
+    Users who wrote recently stay on the primary for REPLICA_PIN_SECONDS, so a `create`
+    followed by a `list` never shows stale data because of replication lag.
+    """
+
+    replica_actions = ("list", "retrieve")
+
+    def initial(self, request, *args, **kwargs):
+        self._replica_token = None
+        super().initial(request, *args, **kwargs)
+        user_id = request.user.pk if request.user.is_authenticated else None
+        if self.action in self.replica_actions and not (user_id and is_pinned_to_primary(user_id)):
+            self._replica_token = use_replica()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, "_replica_token", None) is not None:
+            reset_replica(self._replica_token)
+            self._replica_token = None
+        if request.method not in SAFE_METHODS and response.status_code < 400 and request.user.is_authenticated:
+            pin_to_primary(request.user.pk)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,71 @@
+# core/models.py
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class Task(models.Model):
+    """A background job run by `manage.py run_tasks`, see core.tasks."""
+
+    class Status(models.TextChoices):
+        QUEUED = "queued", _("Queued")
+        RUNNING = "running", _("Running")
+        DONE = "done", _("Done")
+        FAILED = "failed", _("Failed")
+
+    name = models.CharField(max_length=200)
+    queue = models.CharField(max_length=64, default="default")
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=7, choices=Status.choices, default=Status.QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("task")
+        verbose_name_plural = _("tasks")
+        db_table = "core_tasks"
+        indexes = [
+            # Only queued rows are scanned when claiming, keep the index small
+            models.Index(
+                fields=["queue", "-priority", "run_at"],
+                name="core_tasks_claim_idx",
+                condition=models.Q(status="queued"),
+            ),
+            models.Index(fields=["status", "locked_at"], name="core_tasks_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.name} on {self.queue} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """The first response to a request sent with an Idempotency-Key header, see core.idempotency."""
+
+    # "user:<id>", or "anon:<ip>" for unauthenticated requests
+    scope = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    # Hash of the method, path and payload, the key can't be reused for a different request
+    fingerprint = models.CharField(max_length=64)
+    # Null while the first request is still running
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    locked_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = _("idempotency key")
+        verbose_name_plural = _("idempotency keys")
+        db_table = "core_idempotency_keys"
+        constraints = [models.UniqueConstraint(fields=["scope", "key"], name="core_idempotency_keys_unique")]
+
+    def __str__(self):
+        return f"{self.key} of {self.scope}"
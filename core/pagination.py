@@ -0,0 +1,14 @@
+# core/pagination.py
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on an indexed, newest-first column: every page is a range scan,
+    however deep, and there's no COUNT(*).
+    """
+
+    ordering = "-created_at"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
@@ -0,0 +1,166 @@
+# core/pubsub.py
+"""
+Fan-out of database events to asyncio subscribers, one database listener per process.
+
+A Hub LISTENs on a Postgres channel over a single dedicated connection, read from the
+event loop with add_reader, so an idle subscriber costs a queue and no thread or DB
+connection. Notifications carry "<key>:<event id>"; events for keys that have
+subscribers are loaded from the `source` in one query per batch and pushed to their
+queues. Databases without LISTEN/NOTIFY are polled instead.
+
+Subscribers that fall SSE_CLIENT_BUFFER events behind get OVERFLOW instead of more
+events, and are expected to resync from the source.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW = object()
+RECONNECT_DELAY = 1.0
+
+
+class Subscription:
+    def __init__(self, key, size):
+        self.key = key
+        self.queue = asyncio.Queue(maxsize=size)
+        self.overflowed = False
+
+    def push(self, item):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Don't hold more events for a client that can't keep up, it resyncs instead
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+
+class Hub:
+    """
+    `source` provides the events:
+    `load(ids, keys)` and `load_after(event_id, keys)` return `(key, event_id, item)` tuples,
+    `latest()` the newest event id.
+    """
+
+    def __init__(self, channel, source):
+        self.channel = channel
+        self.source = source
+        self.subscribers = {}
+        self.cursor = None
+        self.loop = None
+        self.task = None
+        # One thread, so the hub's queries share a single database connection
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"hub-{channel}")
+
+    @property
+    def connections(self):
+        return sum(len(subscriptions) for subscriptions in self.subscribers.values())
+
+    def subscribe(self, key):
+        loop = asyncio.get_running_loop()
+        if self.task is None or self.task.done() or self.loop is not loop:
+            self.loop = loop
+            self.task = loop.create_task(self.run_forever())
+        subscription = Subscription(key, settings.SSE_CLIENT_BUFFER)
+        self.subscribers.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self.subscribers.get(subscription.key)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.subscribers[subscription.key]
+
+    async def call(self, func, *args):
+        """Run a blocking (database) call on the hub's thread."""
+
+        def run():
+            close_old_connections()
+            return func(*args)
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, run)
+
+    def dispatch(self, events):
+        for key, event_id, item in events:
+            self.cursor = max(self.cursor or 0, event_id)
+            for subscription in tuple(self.subscribers.get(key, ())):
+                subscription.push(item)
+
+    async def run_forever(self):
+        if self.cursor is None:
+            self.cursor = await self.call(self.source.latest) or 0
+        while True:
+            try:
+                if connections["default"].vendor == "postgresql":
+                    await self.listen()
+                else:
+                    await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Listener on %s failed, reconnecting", self.channel)
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    async def catch_up(self):
+        keys = list(self.subscribers)
+        if keys:
+            self.dispatch(await self.call(self.source.load_after, self.cursor, keys))
+
+    async def poll(self):
+        while True:
+            await self.catch_up()
+            await asyncio.sleep(settings.SSE_POLL_INTERVAL)
+
+    async def listen(self):
+        raw = await self.call(self.connect)
+        readable = asyncio.Event()
+        self.loop.add_reader(raw.fileno(), readable.set)
+        try:
+            # Whatever was sent while we weren't listening
+            await self.catch_up()
+            while True:
+                await readable.wait()
+                readable.clear()
+                ids = []
+                for payload in drain_notifications(raw):
+                    key, _, event_id = payload.rpartition(":")
+                    if key.isdigit() and int(key) in self.subscribers:
+                        ids.append(int(event_id))
+                if ids:
+                    self.dispatch(await self.call(self.source.load, ids, list(self.subscribers)))
+        finally:
+            self.loop.remove_reader(raw.fileno())
+            raw.close()
+
+    def connect(self):
+        # A plain connection outside Django's pool, LISTEN needs it for the life of the process
+        wrapper = connections["default"]
+        params = wrapper.get_connection_params()
+        if settings.EVENTS_LISTEN_HOST:
+            params.update(host=settings.EVENTS_LISTEN_HOST, port=settings.EVENTS_LISTEN_PORT)
+        raw = wrapper.Database.connect(**params)
+        raw.autocommit = True
+        with raw.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return raw
+
+
+def drain_notifications(raw):
+    """Payloads of the notifications received on a LISTEN connection, without blocking."""
+    if hasattr(raw, "pgconn"):
+        # psycopg 3
+        return [notify.payload for notify in raw.notifies(timeout=0)]
+    raw.poll()
+    payloads = [notify.payload for notify in raw.notifies]
+    raw.notifies.clear()
+    return payloads
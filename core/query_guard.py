@@ -0,0 +1,125 @@
+# core/query_guard.py
+"""
+Per view and action limits on what one request may ask of the database, applied by
+core.middleware.QueryGuardMiddleware through an execute wrapper on every connection.
+
+QUERY_LIMITS maps view labels (as in the metrics, e.g. "JournalLogViewSet.list") to a
+`timeout_ms`, falling back to its "default" entry, and a `max_rows`. The timeout is the
+Postgres statement_timeout, set on a connection when a request needs a value it doesn't
+have and kept for the next requests: views on the default timeout cost no round trip.
+The row limit only applies to the views that set one, unpaginated lists: Django's delete
+collector and the admin legitimately load whole relations. It is checked on each result
+set, which psycopg has fetched but Django not yet turned into objects when execute returns.
+
+A query over the timeout ends the request with a 503, a result over the row limit with a
+413, and either is logged with the query. Batched sub-requests (core.batch) get the limits
+of their own view, their guard takes over from the batch's while they run. Neither limit
+applies outside requests, nor on SQLite; behind PgBouncer in transaction mode (DB_PGBOUNCER)
+the timeout can't be set per session and only the row limit applies, give the database role
+a statement_timeout instead.
+"""
+
+import logging
+import weakref
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import OperationalError, connections
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .metrics import registry
+
+try:
+    from psycopg import pq
+except ImportError:
+    # Only used on Postgres connections
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+QUERY_CANCELED = "57014"
+
+# statement_timeout in effect per raw connection, shared by requests using it in turn
+_timeouts = weakref.WeakKeyDictionary()
+
+
+class QueryTimeout(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The request took too long, please try again shortly."
+    default_code = "query_timeout"
+
+
+class TooManyRows(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "The result is too large, narrow it down with filters."
+    default_code = "too_many_rows"
+
+
+def limits_for(label):
+    limits = settings.QUERY_LIMITS.get(label, {})
+    timeout_ms = limits.get("timeout_ms", settings.QUERY_LIMITS["default"].get("timeout_ms"))
+    return timeout_ms or 0, limits.get("max_rows") or 0
+
+
+def active_guard(connection):
+    """The innermost guard on the connection, e.g. a batched sub-request's rather than the batch's."""
+    return next((wrapper for wrapper in reversed(connection.execute_wrappers) if isinstance(wrapper, QueryGuard)), None)
+
+
+@contextmanager
+def guard_queries(guard):
+    """Apply `guard` to the queries of this thread's connections."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(guard))
+        yield guard
+
+
+class QueryGuard:
+    """Execute wrapper enforcing the limits of one view."""
+
+    def __init__(self, label="default"):
+        self.configure(label)
+
+    def configure(self, label):
+        self.label = label
+        self.timeout_ms, self.max_rows = limits_for(label)
+
+    def __call__(self, execute, sql, params, many, context):
+        connection = context["connection"]
+        if connection.vendor != "postgresql" or self is not active_guard(connection):
+            return execute(sql, params, many, context)
+        if not settings.DB_PGBOUNCER:
+            self.set_timeout(connection, context["cursor"])
+
+        try:
+            result = execute(sql, params, many, context)
+        except OperationalError as exc:
+            if getattr(exc.__cause__, "sqlstate", None) != QUERY_CANCELED:
+                raise
+            self.report("timeout", f"over {self.timeout_ms}ms", sql)
+            raise QueryTimeout() from exc
+
+        cursor = context["cursor"]
+        if self.max_rows and cursor.description is not None and cursor.rowcount > self.max_rows:
+            self.report("rows", f"{cursor.rowcount} rows, limit {self.max_rows}", sql)
+            raise TooManyRows()
+        return result
+
+    def set_timeout(self, connection, cursor):
+        raw = connection.connection
+        timeout_ms, settled = _timeouts.get(raw, (None, False))
+        if timeout_ms == self.timeout_ms and (settled or connection.in_atomic_block):
+            return
+        if raw.info.transaction_status == pq.TransactionStatus.INERROR:
+            # Nothing runs before the rollback, which is on its way through here
+            return
+        # Straight on the driver's cursor, it's the connection's setting rather than the request's query
+        cursor.cursor.execute("SELECT set_config('statement_timeout', %s, false)", [f"{self.timeout_ms}ms"])
+        # Set in a transaction, a rollback reverts it: checked again once the transaction is over
+        _timeouts[raw] = (self.timeout_ms, not connection.in_atomic_block)
+
+    def report(self, limit, detail, sql):
+        registry.inc("habij_query_guard_total", (("view", self.label), ("limit", limit)))
+        logger.warning("Query limit hit in %s, %s: %s", self.label, detail, sql)
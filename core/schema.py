@@ -0,0 +1,67 @@
+# core/schema.py
+"""
+The OpenAPI schema as a build artifact: `manage.py build_schema` renders it once into
+API_SCHEMA_DIR when the image is built, and core.views.SchemaView serves those files from
+memory with their content hash as ETag. Only with DEBUG is it generated per request.
+"""
+
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+from drf_spectacular.settings import spectacular_settings
+
+logger = logging.getLogger(__name__)
+
+# One artifact per format of SpectacularAPIView's renderers
+RENDERERS = {"yaml": OpenApiYamlRenderer, "json": OpenApiJsonRenderer}
+
+_artifacts = None
+
+
+def render_schema():
+    """The rendered schema per format."""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(urlconf=spectacular_settings.SERVE_URLCONF)
+    schema = generator.get_schema(request=None, public=True)
+    return {format: renderer().render(schema, renderer_context={}) for format, renderer in RENDERERS.items()}
+
+
+def artifact_path(format):
+    return os.path.join(settings.API_SCHEMA_DIR, f"schema.{format}")
+
+
+def write_artifacts():
+    os.makedirs(settings.API_SCHEMA_DIR, exist_ok=True)
+    paths = []
+    for format, content in render_schema().items():
+        path = artifact_path(format)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(content)
+        os.replace(f"{path}.tmp", path)
+        paths.append(path)
+    return paths
+
+
+def load_artifacts():
+    """(content, etag) per format, read from API_SCHEMA_DIR once per process."""
+    global _artifacts
+    if _artifacts is None:
+        try:
+            contents = {}
+            for format in RENDERERS:
+                with open(artifact_path(format), "rb") as f:
+                    contents[format] = f.read()
+        except FileNotFoundError:
+            logger.warning("No schema in %s, generating it; run manage.py build_schema", settings.API_SCHEMA_DIR)
+            contents = render_schema()
+        _artifacts = {
+            format: (content, f'"{hashlib.sha256(content).hexdigest()[:32]}"') for format, content in contents.items()
+        }
+    return _artifacts
+
+
+def reset_artifacts():
+    global _artifacts
+    _artifacts = None
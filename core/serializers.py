@@ -0,0 +1,56 @@
+# core/serializers.py
+from django.conf import settings
+from rest_framework import serializers
+
+BATCH_PATH = "/api/batch/"
+# Sub-requests share the batch's host and client address, and their body is always JSON
+RESERVED_HEADERS = {
+    "host",
+    "content-type",
+    "content-length",
+    # Set by the proxies in front of the app, throttles go by them
+    "x-forwarded-for",
+    "x-forwarded-host",
+    "x-forwarded-proto",
+    "x-forwarded-port",
+    "x-real-ip",
+    "forwarded",
+}
+
+
+class SubRequestSerializer(serializers.Serializer):
+    id = serializers.CharField(required=False, help_text="Echoed back on the matching response")
+    method = serializers.ChoiceField(choices=["GET", "POST", "PUT", "PATCH", "DELETE"], default="GET")
+    path = serializers.CharField(help_text="API path with an optional query string, e.g. /api/journal-logs/?type=todo")
+    body = serializers.JSONField(required=False)
+    headers = serializers.DictField(
+        child=serializers.CharField(allow_blank=True),
+        required=False,
+        help_text="Headers of this request, e.g. If-None-Match, on top of the batch's Accept, language and credentials",
+    )
+
+    def validate_headers(self, value):
+        # X_Forwarded_For would end up as HTTP_X_FORWARDED_FOR as well
+        reserved = sorted(name for name in value if name.lower().replace("_", "-") in RESERVED_HEADERS)
+        if reserved:
+            raise serializers.ValidationError(f"Set by the batch: {', '.join(reserved)}.")
+        return value
+
+    def validate_path(self, value):
+        if not value.startswith("/api/") or value.split("?")[0] == BATCH_PATH:
+            raise serializers.ValidationError("Only API paths other than the batch endpoint can be batched.")
+        return value
+
+
+class BatchRequestSerializer(serializers.Serializer):
+    requests = serializers.ListField(child=SubRequestSerializer(), min_length=1, max_length=settings.BATCH_MAX_REQUESTS)
+
+
+class SubResponseSerializer(serializers.Serializer):
+    id = serializers.CharField(required=False)
+    status = serializers.IntegerField()
+    body = serializers.JSONField(allow_null=True)
+
+
+class BatchResponseSerializer(serializers.Serializer):
+    responses = SubResponseSerializer(many=True)
@@ -0,0 +1,34 @@
+# core/storage.py
+from django.conf import settings
+from django.contrib.staticfiles.storage import StaticFilesStorage
+from django.core.files.base import ContentFile
+
+from .compression import CODECS, compress, is_compressible_file
+
+
+class PrecompressedStaticFilesStorage(StaticFilesStorage):
+    """
+    Static files storage whose collectstatic post-processing writes a compressed copy of every
+    text file next to it, at the highest level of each available encoding (`app.js.gz`,
+    `app.js.br`, `app.js.zst`), for the web server to send instead of compressing per request.
+    Copies that don't save at least 5% are skipped.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        for name in paths:
+            if not is_compressible_file(name):
+                continue
+            with self.open(name) as f:
+                content = f.read()
+            if len(content) < settings.COMPRESSION_MIN_SIZE:
+                continue
+            for encoding, (_, extension, _) in CODECS.items():
+                compressed = compress(encoding, content)
+                if len(compressed) > len(content) * 0.95:
+                    continue
+                if self.exists(name + extension):
+                    self.delete(name + extension)
+                self._save(name + extension, ContentFile(compressed))
+            yield name, name, True
@@ -0,0 +1,189 @@
+# core/tasks.py
+"""
+Background tasks stored in the default database and run by `manage.py run_tasks`.
+
+Workers claim due tasks with SELECT ... FOR UPDATE SKIP LOCKED, so any number of them can
+poll the same table without handing a task out twice. Queues listed in TASK_QUEUES with a
+concurrency limit are claimed under a transaction-level advisory lock, which makes the
+limit hold across all workers. Failed tasks are retried with exponential backoff until
+they run out of attempts.
+"""
+
+import logging
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .cache import TieredCache
+from .metrics import registry
+from .models import IdempotencyKey, Task
+
+logger = logging.getLogger(__name__)
+
+# Every function decorated with @task, by name
+TASKS = {}
+
+
+class TaskFunction:
+    def __init__(self, func, queue, priority, max_attempts):
+        self.func = func
+        self.name = f"{func.__module__}.{func.__qualname__}"
+        self.queue = queue
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, *args, **kwargs):
+        """Queue a run with these (JSON serializable) arguments once the current transaction commits."""
+        self.enqueue_with(args, kwargs)
+
+    def enqueue_with(self, args=(), kwargs=None, run_at=None, delay=None, priority=None):
+        if run_at is None:
+            run_at = timezone.now() + timedelta(seconds=delay or 0)
+        task = Task(
+            name=self.name,
+            queue=self.queue,
+            args=list(args),
+            kwargs=kwargs or {},
+            priority=self.priority if priority is None else priority,
+            run_at=run_at,
+            max_attempts=self.max_attempts,
+        )
+        # Nothing is queued for work that gets rolled back, and workers never see a task before its data
+        transaction.on_commit(lambda: task.save(using="default"), using="default")
+
+
+def task(func=None, *, queue="default", priority=0, max_attempts=5):
+    """Register a function as a background task, adding `.enqueue()` and `.enqueue_with()` to it."""
+
+    def decorator(func):
+        task_function = TaskFunction(func, queue, priority, max_attempts)
+        TASKS[task_function.name] = task_function
+        return task_function
+
+    return decorator(func) if func is not None else decorator
+
+
+def retry_delay(attempts):
+    delay = min(settings.TASK_RETRY_BACKOFF * 2 ** (attempts - 1), settings.TASK_RETRY_BACKOFF_MAX)
+    # Jitter, so tasks that failed together don't all retry together
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _lock_queue(queue):
+    connection = connections["default"]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [f"core_tasks:{queue}"])
+
+
+def claim(queue, limit, worker):
+    """Mark up to `limit` due tasks of the queue as running on `worker` and return them."""
+    now = timezone.now()
+    concurrency = settings.TASK_QUEUES.get(queue, 0)
+    with transaction.atomic(using="default"):
+        if concurrency:
+            _lock_queue(queue)
+            running = Task.objects.using("default").filter(queue=queue, status=Task.Status.RUNNING).count()
+            limit = min(limit, concurrency - running)
+            if limit <= 0:
+                return []
+        ids = list(
+            Task.objects.using("default")
+            .select_for_update(skip_locked=True)
+            .filter(queue=queue, status=Task.Status.QUEUED, run_at__lte=now)
+            .order_by("-priority", "run_at")
+            .values_list("id", flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        Task.objects.using("default").filter(id__in=ids).update(
+            status=Task.Status.RUNNING, locked_by=worker, locked_at=now, attempts=F("attempts") + 1
+        )
+        return list(Task.objects.using("default").filter(id__in=ids).order_by("-priority", "run_at"))
+
+
+def execute(claimed):
+    """Run a claimed task and record the outcome, scheduling a retry when it fails."""
+    task_function = TASKS.get(claimed.name)
+    started = time.perf_counter()
+    try:
+        if task_function is None:
+            raise LookupError(f"Unknown task {claimed.name}")
+        task_function.func(*claimed.args, **claimed.kwargs)
+    except Exception as exc:
+        error = f"{type(exc).__name__}: {exc}"
+        if claimed.attempts < claimed.max_attempts:
+            status, finished_at = Task.Status.QUEUED, None
+            run_at = timezone.now() + timedelta(seconds=retry_delay(claimed.attempts))
+            logger.warning("Task %s (%s) failed, retrying at %s: %s", claimed.pk, claimed.name, run_at, error)
+        else:
+            status, finished_at, run_at = Task.Status.FAILED, timezone.now(), claimed.run_at
+            logger.exception("Task %s (%s) failed after %s attempts", claimed.pk, claimed.name, claimed.attempts)
+        Task.objects.using("default").filter(pk=claimed.pk).update(
+            status=status, run_at=run_at, last_error=error, locked_by="", locked_at=None, finished_at=finished_at
+        )
+    else:
+        status = Task.Status.DONE
+        Task.objects.using("default").filter(pk=claimed.pk).update(
+            status=status, last_error="", locked_by="", locked_at=None, finished_at=timezone.now()
+        )
+
+    labels = (("queue", claimed.queue), ("task", claimed.name))
+    registry.inc("habij_tasks_total", (*labels, ("status", status)))
+    registry.observe("habij_task_duration_seconds", labels, time.perf_counter() - started)
+    return status
+
+
+def requeue_abandoned():
+    """Hand tasks whose worker died mid-run (running for longer than TASK_LEASE_SECONDS) back out."""
+    expired = Task.objects.using("default").filter(
+        status=Task.Status.RUNNING, locked_at__lt=timezone.now() - timedelta(seconds=settings.TASK_LEASE_SECONDS)
+    )
+    failed = expired.filter(attempts__gte=F("max_attempts")).update(
+        status=Task.Status.FAILED, last_error="Lease expired", locked_by="", locked_at=None, finished_at=timezone.now()
+    )
+    requeued = expired.update(status=Task.Status.QUEUED, locked_by="", locked_at=None)
+    return requeued + failed
+
+
+def schedule_periodic():
+    """Queue the next run of every TASK_PERIODIC task that has none queued or running."""
+    pending = set(
+        Task.objects.using("default")
+        .filter(name__in=settings.TASK_PERIODIC, status__in=(Task.Status.QUEUED, Task.Status.RUNNING))
+        .values_list("name", flat=True)
+    )
+    for name, interval in settings.TASK_PERIODIC.items():
+        if name not in pending and name in TASKS:
+            TASKS[name].enqueue_with(delay=interval)
+
+
+def purge_finished():
+    cutoff = timezone.now() - timedelta(days=settings.TASK_RETENTION_DAYS)
+    deleted, _ = Task.objects.using("default").filter(status=Task.Status.DONE, finished_at__lt=cutoff).delete()
+    return deleted
+
+
+@task
+def purge_idempotency_keys():
+    IdempotencyKey.objects.using("default").filter(expires_at__lt=timezone.now()).delete()
+
+
+@task
+def cull_caches():
+    culled = set()
+    for alias in settings.CACHES:
+        cache = caches[alias]
+        if isinstance(cache, TieredCache) and cache.location not in culled:
+            culled.add(cache.location)
+            cache.cull()
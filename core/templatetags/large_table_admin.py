@@ -0,0 +1,120 @@
+# core/templatetags/large_table_admin.py
+import calendar
+import datetime
+
+from django import template
+from django.contrib.admin.templatetags.admin_list import date_hierarchy, pagination
+from django.contrib.admin.templatetags.base import InclusionAdminNode
+from django.utils import formats, timezone
+from django.utils.text import capfirst
+from django.utils.translation import gettext as _
+
+from core.admin_base import CURSOR_VAR
+
+register = template.Library()
+
+
+def keyset_pagination(cl):
+    context = pagination(cl)
+    if cl.uses_keyset and context["pagination_required"]:
+        next_cursor = cl.next_cursor()
+        context.update(
+            pagination_required=False,
+            first_url=cl.get_query_string() if cl.cursor else None,
+            next_url=cl.get_query_string({CURSOR_VAR: next_cursor}) if next_cursor is not None else None,
+        )
+    context["estimated"] = cl.paginator.estimated
+    return context
+
+
+@register.tag(name="keyset_pagination")
+def keyset_pagination_tag(parser, token):
+    return InclusionAdminNode(
+        parser, token, func=keyset_pagination, template_name="large_table_pagination.html", takes_context=False
+    )
+
+
+def date_range(cl):
+    """
+    Dates of the oldest and newest rows by primary key, which follows creation order. Taken
+    from the whole table, finding them among filtered rows can take a scan.
+    """
+    values = cl.root_queryset.values_list(cl.date_hierarchy, flat=True)
+    first, last = values.order_by("pk").first(), values.order_by("-pk").first()
+    if first is None or last is None:
+        return None
+    first, last = (
+        timezone.localdate(value) if isinstance(value, datetime.datetime) and timezone.is_aware(value) else value
+        for value in (first, last)
+    )
+    return min(first, last), max(first, last)
+
+
+def cheap_date_hierarchy(cl):
+    """
+    Like the admin's date_hierarchy, without its SELECT DISTINCT over the table: the choices
+    are every year, month or day up to today, and may include periods without rows.
+    """
+    field_name = cl.date_hierarchy
+    year_field, month_field, day_field = (f"{field_name}__{part}" for part in ("year", "month", "day"))
+    year, month = cl.params.get(year_field), cl.params.get(month_field)
+    if cl.params.get(day_field):
+        return date_hierarchy(cl)
+
+    def link(filters):
+        return cl.get_query_string(filters, [f"{field_name}__"])
+
+    today = timezone.localdate()
+    if not (year or month):
+        bounds = date_range(cl)
+        if bounds is None:
+            return {"show": True, "back": None, "choices": []}
+        first, last = bounds
+        if first.year != last.year:
+            return {
+                "show": True,
+                "back": None,
+                "choices": [
+                    {"link": link({year_field: str(year)}), "title": str(year)}
+                    for year in range(first.year, last.year + 1)
+                ],
+            }
+        year = first.year
+        if first.month == last.month:
+            month = first.month
+
+    year = int(year)
+    if month:
+        month = int(month)
+        days = range(1, calendar.monthrange(year, month)[1] + 1)
+        return {
+            "show": True,
+            "back": {"link": link({year_field: year}), "title": str(year)},
+            "choices": [
+                {
+                    "link": link({year_field: year, month_field: month, day_field: day}),
+                    "title": capfirst(formats.date_format(datetime.date(year, month, day), "MONTH_DAY_FORMAT")),
+                }
+                for day in days
+                if datetime.date(year, month, day) <= today
+            ],
+        }
+    return {
+        "show": True,
+        "back": {"link": link({}), "title": _("All dates")},
+        "choices": [
+            {
+                "link": link({year_field: year, month_field: month}),
+                "title": capfirst(formats.date_format(datetime.date(year, month, 1), "YEAR_MONTH_FORMAT")),
+            }
+            for month in range(1, 13)
+            if datetime.date(year, month, 1) <= today
+        ],
+    }
+
+
+@register.tag(name="cheap_date_hierarchy")
+def cheap_date_hierarchy_tag(parser, token):
+    return InclusionAdminNode(
+        parser, token, func=cheap_date_hierarchy, template_name="date_hierarchy.html", takes_context=False
+    )
@@ -0,0 +1,169 @@
+# core/testing.py
+import tempfile
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .middleware import view_label
+
+# Every declared budget, checked against the URL conf by core.tests
+BUDGETS = []
+
+
+class Budget:
+    """
+    Query and response size budget of one endpoint action.
+
+    `path` and `data` may hold `{placeholders}` filled from the test case's `dataset()`.
+    The query count must be the same for every dataset size and at most `queries`, plus
+    `sharded_queries` when DB_SHARDS is set, the response body of the largest dataset at most `max_bytes`.
+    """
+
+    def __init__(
+        self, method, path, queries, max_bytes=None, data=None, status=200, authenticated=True, sharded_queries=0
+    ):
+        self.method = method
+        self.path = path
+        self.queries = queries + (sharded_queries if settings.JOURNAL_SHARDS else 0)
+        self.max_bytes = max_bytes
+        self.data = data
+        self.status = status
+        self.authenticated = authenticated
+
+    def label(self):
+        match = resolve(self.path.split("?")[0].format_map(_AnyId()))
+        return view_label(match.func, self.method)
+
+
+class _AnyId(dict):
+    def __missing__(self, key):
+        return "1"
+
+
+def _fill(value, fixtures):
+    if isinstance(value, str):
+        return value.format_map(fixtures)
+    if isinstance(value, dict):
+        return {key: _fill(item, fixtures) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill(item, fixtures) for item in value]
+    return value
+
+
+class IsolatedStoresMixin:
+    """
+    Fresh token buckets and shared cache for every test. Both live on disk and would otherwise
+    replay the throttles and cached responses of an earlier run, whose ids the new test database reuses.
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        isolated = override_settings(
+            THROTTLE_STORE_PATH=f"{directory.name}/throttle.sqlite3",
+            CACHES={
+                alias: {**cache, "LOCATION": f"{directory.name}/cache/{alias}"}
+                for alias, cache in settings.CACHES.items()
+            },
+        )
+        isolated.enable()
+        self.addCleanup(isolated.disable)
+
+
+@override_settings(
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+    PASSWORD_HASHING_WORKERS=0,
+    INSTRUMENTATION_SAMPLE_RATE=0,
+)
+class QueryBudgetTestCase(IsolatedStoresMixin, APITestCase):
+    """
+    Generates one test per entry of `budgets`, run once per size in `dataset_sizes`.
+
+    Subclasses override `dataset(size)`: seed a user with a dataset of that size and return
+    the placeholders for the budget paths and payloads, including the `user` to authenticate as.
+    The default seeds nothing, enough for budgets of unauthenticated endpoints without placeholders.
+    """
+
+    # Journal queries go to the user's shard when DB_SHARDS is set, and count towards the budget
+    databases = {"default", *settings.JOURNAL_SHARDS}
+    budgets = {}
+    dataset_sizes = (1, 5, 25)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for name, budget in cls.budgets.items():
+            BUDGETS.append(budget)
+            setattr(cls, f"test_budget_{name}", lambda self, budget=budget: self.check_budget(budget))
+
+    def dataset(self, size):
+        return {}
+
+    def authenticate(self, user):
+        refresh = RefreshToken.for_user(user)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {refresh.access_token}")
+        return refresh
+
+    def check_budget(self, budget):
+        runs = []
+        for size in self.dataset_sizes:
+            fixtures = self.dataset(size)
+            self.client.credentials()
+            self.client.cookies.clear()
+            if budget.authenticated:
+                if "user" not in fixtures:
+                    self.fail(f"{budget.method} {budget.path}: authenticated, but dataset() seeds no user")
+                self.authenticate(fixtures["user"])
+            path = _fill(budget.path, fixtures)
+            data = _fill(budget.data, fixtures)
+
+            # Work deferred to on_commit, like queueing tasks, is part of the request's cost
+            with ExitStack() as stack:
+                captured = {
+                    alias: stack.enter_context(CaptureQueriesContext(connections[alias]))
+                    for alias in sorted(self.databases)
+                }
+                for alias in captured:
+                    stack.enter_context(self.captureOnCommitCallbacks(using=alias, execute=True))
+                response = getattr(self.client, budget.method.lower())(path, data, format="json")
+            self.assertEqual(
+                response.status_code,
+                budget.status,
+                f"{budget.method} {path} returned {response.status_code}: {response.content[:500]!r}",
+            )
+            queries = [
+                query["sql"] if alias == "default" else f"[{alias}] {query['sql']}"
+                for alias, context in captured.items()
+                for query in context.captured_queries
+            ]
+            runs.append((size, queries, len(response.content)))
+
+        counts = {size: len(queries) for size, queries, _ in runs}
+        smallest, largest = runs[0], runs[-1]
+        if len(set(counts.values())) > 1:
+            # Queries that repeat more often with more data are the N+1
+            grown = [
+                f"  {largest[1].count(sql)}x {sql}"
+                for sql in dict.fromkeys(largest[1])
+                if largest[1].count(sql) > smallest[1].count(sql)
+            ]
+            self.fail(
+                f"{budget.method} {budget.path}: query count grows with the data {counts}, repeated queries:\n"
+                + "\n".join(grown or [f"  {sql}" for sql in largest[1]])
+            )
+        if counts[largest[0]] > budget.queries:
+            self.fail(
+                f"{budget.method} {budget.path}: {counts[largest[0]]} queries, budget is {budget.queries}:\n"
+                + "\n".join(f"  {sql}" for sql in largest[1])
+            )
+        if budget.max_bytes is not None and largest[2] > budget.max_bytes:
+            self.fail(
+                f"{budget.method} {budget.path}: {largest[2]} byte response for {largest[0]} rows, "
+                f"budget is {budget.max_bytes}"
+            )
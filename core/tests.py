@@ -0,0 +1,656 @@
+import errno
+import gzip
+import io
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from rest_framework.throttling import BaseThrottle
+from rest_framework_simplejwt.tokens import AccessToken
+
+from journal import tests as journal_tests  # noqa: F401
+from journal.models import JournalLog
+from journal.sharding import user_journal
+from users import tests as users_tests  # noqa: F401
+from users.models import User
+
+from . import metrics, warmup
+from .batch import build_request
+from .cache import TieredCache
+from .compression import brotli, compress, negotiate, zstandard
+from .db_routers import PIN_KEY, is_pinned_to_primary, pin_to_primary
+from .middleware import view_label
+from .models import IdempotencyKey, Task
+from .query_guard import QueryGuard, QueryTimeout, TooManyRows
+from .schema import reset_artifacts
+from .tasks import claim, execute, requeue_abandoned, retry_delay, schedule_periodic, task
+from .testing import BUDGETS, Budget, IsolatedStoresMixin, QueryBudgetTestCase
+from .tracing import SamplingPolicy, before_send_transaction, profiles_sampler, traces_sampler
+
+
+@task(queue="tests", max_attempts=2)
+def failing_task():
+    raise ValueError("Broken")
+
+
+def api_actions(patterns, prefix=""):
+    """Labels of every DRF view action routed under /api/, as used in metrics and budgets."""
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from api_actions(pattern.url_patterns, route)
+        elif isinstance(pattern, URLPattern) and route.startswith("api/"):
+            view_class = getattr(pattern.callback, "cls", None)
+            if view_class is None or view_class.__module__.startswith(("drf_spectacular", "rest_framework.")):
+                continue
+            actions = getattr(pattern.callback, "actions", None)
+            methods = actions or {method: None for method in view_class().allowed_methods if method != "OPTIONS"}
+            for method in methods:
+                yield view_label(pattern.callback, method.upper())
+
+
+class QueryBudgetCoverageTests(SimpleTestCase):
+    def test_every_api_action_has_a_budget(self):
+        covered = {budget.label() for budget in BUDGETS}
+        missing = sorted(set(api_actions(get_resolver().url_patterns)) - covered)
+        self.assertFalse(missing, f"API actions without a query budget, add them to the app's tests: {missing}")
+
+
+class BatchQueryBudgetTests(QueryBudgetTestCase):
+    budgets = {
+        "app_start": Budget(
+            "POST",
+            "/api/batch/",
+            # One authentication for the whole batch, then the sub-requests' own queries
+            queries=7,
+            max_bytes=16000,
+            data={
+                "requests": [
+                    {"id": "me", "path": "/api/users/{me}/"},
+                    {"id": "today", "path": "/api/journal-logs/?date={today}"},
+                    {"id": "todos", "path": "/api/journal-logs/?type=todo"},
+                    {"id": "new", "method": "POST", "path": "/api/journal-logs/", "body": {"text": "new"}},
+                ]
+            },
+        ),
+    }
+
+    def dataset(self, size):
+        user = User.objects.create_user(f"batch-{size}@example.com", "password")
+        with user_journal(user.pk):
+            JournalLog.objects.bulk_create(
+                [JournalLog(user=user, text=f"log {index}") for index in range(size)]
+                + [JournalLog(user=user, text=f"todo {index}", type=JournalLog.LogType.TODO) for index in range(size)]
+            )
+        return {"user": user, "me": user.pk, "today": timezone.localdate().isoformat()}
+
+    def test_responses_keep_request_order_and_status(self):
+        fixtures = self.dataset(1)
+        self.authenticate(fixtures["user"])
+        response = self.client.post(
+            "/api/batch/",
+            {
+                "requests": [
+                    {"path": "/api/journal-logs/", "method": "POST", "body": {}},
+                    {"id": "x", "path": "/api/nope/"},
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        first, second = response.json()["responses"]
+        self.assertEqual(first["status"], 400)
+        self.assertEqual(second, {"id": "x", "status": 404, "body": {"detail": "Not found."}})
+
+    def test_rejects_nested_batches(self):
+        self.authenticate(self.dataset(1)["user"])
+        response = self.client.post("/api/batch/", {"requests": [{"path": "/api/batch/"}]}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    def test_sub_requests_get_the_allowed_headers_and_their_own(self):
+        outer = RequestFactory().post(
+            "/api/batch/",
+            HTTP_ACCEPT_LANGUAGE="fr",
+            HTTP_COOKIE="refresh_token=token",
+            HTTP_IDEMPOTENCY_KEY="batch",
+            HTTP_X_FORWARDED_FOR="10.0.0.1",
+        )
+        outer.user, outer.auth = AnonymousUser(), None
+        request = build_request(
+            outer, {"method": "GET", "path": "/api/journal-logs/", "headers": {"If-None-Match": '"etag"'}}
+        )
+        self.assertEqual(request.headers["Accept-Language"], "fr")
+        self.assertEqual(request.COOKIES, {"refresh_token": "token"})
+        self.assertEqual(request.headers["If-None-Match"], '"etag"')
+        self.assertNotIn("Idempotency-Key", request.headers)
+        self.assertEqual(request.headers["X-Forwarded-For"], "10.0.0.1")
+
+    def test_rejects_headers_the_batch_sets(self):
+        self.authenticate(self.dataset(1)["user"])
+        for headers in ({"Host": "elsewhere.example.com"}, {"X-Forwarded-For": "10.0.0.1"}, {"x_real_ip": "10.0.0.1"}):
+            spec = {"path": "/api/journal-logs/", "headers": headers}
+            response = self.client.post("/api/batch/", {"requests": [spec]}, format="json")
+            self.assertEqual(response.status_code, 400, headers)
+
+
+@override_settings(IDEMPOTENCY_CACHE="default")
+class SchemaQueryBudgetTests(QueryBudgetTestCase):
+    budgets = {"schema": Budget("GET", "/api/schema/", queries=0, authenticated=False)}
+
+
+class SchemaTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.schema_dir = override_settings(API_SCHEMA_DIR=directory.name)
+        self.schema_dir.enable()
+        self.addCleanup(self.schema_dir.disable)
+        reset_artifacts()
+        self.addCleanup(reset_artifacts)
+
+    def test_serves_the_built_schema_with_an_etag(self):
+        call_command("build_schema", stdout=io.StringIO())
+        with open(os.path.join(self.schema_dir.options["API_SCHEMA_DIR"], "schema.json"), "rb") as f:
+            built = f.read()
+
+        response = self.client.get("/api/schema/", HTTP_ACCEPT="application/vnd.oai.openapi+json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, built)
+        self.assertEqual(response["Content-Type"], "application/vnd.oai.openapi+json")
+
+        response = self.client.get(
+            "/api/schema/", HTTP_ACCEPT="application/vnd.oai.openapi+json", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get("/api/schema/")["Content-Type"], "application/vnd.oai.openapi")
+
+    def test_compressed_schema_revalidates_with_its_weak_etag(self):
+        plain = self.client.get("/api/schema/")
+        response = self.client.get("/api/schema/", HTTP_ACCEPT_ENCODING="br;q=0, gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(response["ETag"], f"W/{plain['ETag']}")
+
+        response = self.client.get("/api/schema/", HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(COMPRESSION_ENCODINGS=["gzip"])
+class CompressionTests(SimpleTestCase):
+    def test_negotiate(self):
+        self.assertEqual(negotiate("gzip, deflate, br"), "gzip")
+        self.assertEqual(negotiate("*;q=0.1"), "gzip")
+        self.assertIsNone(negotiate("gzip;q=0, *"))
+        self.assertIsNone(negotiate("identity"))
+        self.assertIsNone(negotiate(""))
+
+    def test_padding_is_skipped_by_decoders(self):
+        decoders = {"gzip": gzip.decompress}
+        if brotli is not None:
+            decoders["br"] = brotli.decompress
+        if zstandard is not None:
+            decoders["zstd"] = zstandard.ZstdDecompressor().decompress
+        data = b'{"text": "padded"}' * 100
+        for encoding, decode in decoders.items():
+            unpadded = compress(encoding, data, 3)
+            for padding in (1, 99, 256):
+                padded = compress(encoding, data, 3, padding)
+                self.assertGreater(len(padded), len(unpadded) + padding, encoding)
+                self.assertEqual(decode(padded), data, encoding)
+
+    def test_small_responses_are_sent_as_is(self):
+        response = self.client.get("/api/journal-logs/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        params = {"OPTIONS": {"MAX_ENTRIES": 4, "LOCAL_MAX_BYTES": 4096}}
+        # Two worker processes on the same host
+        self.cache, self.other = (TieredCache(self.directory, params) for _ in range(2))
+
+    def test_tiers_stay_consistent_between_processes(self):
+        self.cache.set("key", "first", 60)
+        self.assertEqual(self.other.get("key"), "first")
+        self.assertEqual(self.other.get("key"), "first")
+        self.assertEqual(self.other.stats(), {"local": 1, "shared": 1, "miss": 0, "early": 0})
+
+        self.cache.set("key", "second", 60)
+        self.assertEqual(self.other.get("key"), "second")
+        self.cache.delete("key")
+        self.assertIsNone(self.other.get("key"))
+        self.cache.set("short", "value", 1)
+        with mock.patch("time.time", return_value=time.time() + 2):
+            self.assertIsNone(self.other.get("short"))
+            self.assertEqual(self.cache.cull(), 1)
+
+    def test_local_copies_are_bounded(self):
+        for index in range(10):
+            self.cache.set(f"key-{index}", "x" * 400)
+        self.assertLessEqual(self.cache._local_bytes, 4096)
+        self.assertEqual(self.cache.get("key-0"), "x" * 400)
+        # Files over MAX_ENTRIES go, least recently written first
+        self.cache.cull()
+        self.assertIsNone(self.other.get("key-0"))
+        self.assertEqual(self.other.get("key-9"), "x" * 400)
+
+    def test_aliases_clear_only_their_own_entries(self):
+        default, shared = (TieredCache(os.path.join(self.directory, alias), {}) for alias in ("default", "shared"))
+        default.set("key", "default")
+        shared.set("key", "shared")
+        default.clear()
+        self.assertIsNone(default.get("key"))
+        self.assertEqual(shared.get("key"), "shared")
+
+    def test_failed_writes_leave_a_miss(self):
+        self.cache.set("key", "first")
+        self.assertEqual(self.other.get("key"), "first")
+        full = OSError(errno.ENOSPC, "No space left on device")
+        with mock.patch("tempfile.mkstemp", side_effect=full), self.assertLogs("core.cache", "WARNING"):
+            self.cache.set("key", "second")
+        self.assertIsNone(self.cache.get("key"))
+        self.assertIsNone(self.other.get("key"))
+
+    def test_writes_cull_their_directory(self):
+        cache = TieredCache(self.directory, {"OPTIONS": {"MAX_ENTRIES": 256, "CULL_EVERY": 1}})
+        keys = {}
+        for index in itertools.count():
+            directory = os.path.dirname(cache._path(f"key-{index}"))
+            if directory in keys:
+                older, newer = keys[directory], f"key-{index}"
+                break
+            keys[directory] = f"key-{index}"
+        cache.set(older, "older")
+        cache.set(newer, "newer")
+        self.assertIsNone(self.other.get(older))
+        self.assertEqual(self.other.get(newer), "newer")
+
+    def test_cull_keeps_the_entries_under_max_bytes(self):
+        cache = TieredCache(self.directory, {"OPTIONS": {"MAX_BYTES": 2000}})
+        for index in range(10):
+            cache.set(f"key-{index}", "x" * 400)
+        cache.cull()
+        files = [os.path.join(path, name) for path, _, names in os.walk(self.directory) for name in names]
+        self.assertLessEqual(sum(map(os.path.getsize, files)), 2000)
+        self.assertEqual(cache.get("key-9"), "x" * 400)
+
+    def test_tags_invalidate_their_entries(self):
+        self.cache.set("agenda", "cached", 60, tags=["user:1"])
+        self.cache.set("other", "cached", 60, tags=["user:2"])
+        self.other.invalidate_tags("user:1")
+        self.assertIsNone(self.cache.get("agenda"))
+        self.assertEqual(self.cache.get("other"), "cached")
+        self.assertEqual(self.cache.fetch("agenda", lambda: "rebuilt", 60, tags=["user:1"]), "rebuilt")
+        self.assertEqual(self.other.get("agenda"), "rebuilt")
+
+    def test_culling_keeps_the_tags_versions(self):
+        cache = TieredCache(self.directory, {"OPTIONS": {"MAX_ENTRIES": 1, "CULL_EVERY": 1}})
+        cache.set("stale", "cached", 60, tags=["user:1"])
+        cache.invalidate_tags("user:1")
+        # Written long ago, the first to go if tags were culled like entries
+        os.utime(cache._tag_path("user:1"), (0, 0))
+        for index in range(10):
+            cache.set(f"key-{index}", "x")
+        cache.cull()
+        self.assertTrue(os.path.exists(cache._tag_path("user:1")))
+        self.assertIsNone(self.other.get("stale"))
+
+    def test_fetch_refreshes_early_before_expiry(self):
+        compute = mock.Mock(return_value="value")
+        self.cache.fetch("key", compute, 60)
+        self.cache.fetch("key", compute, 60)
+        self.assertEqual(compute.call_count, 1)
+        # A draw far in the tail, and an entry that took long to compute
+        with mock.patch("random.random", return_value=1 - 1e-12), mock.patch.object(self.cache, "_write"):
+            self.cache._local[self.cache._path("key")] = self.cache._local[self.cache._path("key")]._replace(delta=3)
+            self.cache.fetch("key", compute, 60)
+        self.assertEqual(compute.call_count, 2)
+        self.assertEqual(self.cache.stats()["early"], 1)
+
+
+@override_settings(
+    SENTRY_SAMPLING_FILE="/nonexistent/sentry-sampling.json",
+    SENTRY_TRACES_MAX_PER_SECOND=2,
+    SENTRY_TRACES_ROUTE_RATES={"/metrics/": 0.0, "/api/journal-logs/": 0.5},
+)
+class TracingTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch("core.tracing.policy", SamplingPolicy())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def transaction(self, trace_id, status="ok", seconds=0.1):
+        start = timezone.now()
+        return {
+            "contexts": {"trace": {"trace_id": trace_id, "status": status}},
+            "request": {"url": "http://testserver/api/journal-logs/"},
+            "start_timestamp": start,
+            "timestamp": start + timedelta(seconds=seconds),
+        }
+
+    def test_records_requests_up_to_the_cap(self):
+        context = {"wsgi_environ": {"PATH_INFO": "/api/journal-logs/"}}
+        self.assertEqual([traces_sampler(context) for _ in range(3)], [1.0, 1.0, 0.0])
+        self.assertEqual(traces_sampler({"wsgi_environ": {"PATH_INFO": "/metrics/"}}), 0.0)
+
+    def test_errors_and_slow_requests_are_always_sent(self):
+        # Above the route's rate
+        unlucky = "c" * 32
+        self.assertIsNone(before_send_transaction(self.transaction(unlucky), {}))
+        self.assertIsNotNone(before_send_transaction(self.transaction(unlucky, status="internal_error"), {}))
+        self.assertIsNotNone(before_send_transaction(self.transaction(unlucky, seconds=2), {}))
+
+    def test_profiles_the_transactions_sent_anyway(self):
+        for trace_id in ("0" * 32, "7" * 32, "8" * 32, "f" * 32):
+            context = {
+                "wsgi_environ": {"PATH_INFO": "/api/journal-logs/"},
+                "transaction_context": {"trace_id": trace_id},
+            }
+            sent = before_send_transaction(self.transaction(trace_id), {}) is not None
+            self.assertEqual(profiles_sampler(context), float(sent), trace_id)
+            self.assertEqual(sent, trace_id < "8", trace_id)
+
+
+class WarmupTests(SimpleTestCase):
+    def test_prime_runs_once_without_the_database(self):
+        # Runs in gunicorn's master before forking, a connection opened there would be shared by the workers
+        with mock.patch.object(warmup, "_primed", False):
+            self.assertEqual(set(warmup.prime()), {"urls", "serializers", "authentication", "translations"})
+            self.assertEqual(warmup.prime(), {})
+
+
+class ThrottleIdentTests(SimpleTestCase):
+    def test_clients_cannot_choose_the_address_they_are_throttled_by(self):
+        idents = {
+            BaseThrottle().get_ident(
+                RequestFactory().get("/", HTTP_X_FORWARDED_FOR=f"{spoofed}, 203.0.113.7", REMOTE_ADDR="10.0.0.2")
+            )
+            for spoofed in ("198.51.100.1", "198.51.100.2")
+        }
+        self.assertEqual(idents, {"203.0.113.7"})
+
+
+class ReplicaPinTests(SimpleTestCase):
+    def test_pins_only_with_replicas(self):
+        cache = caches[settings.REPLICA_PIN_CACHE]
+        with override_settings(DATABASE_REPLICAS=[]), mock.patch.object(cache, "set") as set_pin:
+            pin_to_primary(1)
+            self.assertFalse(is_pinned_to_primary(1))
+        set_pin.assert_not_called()
+        with override_settings(DATABASE_REPLICAS=["replica_0"]):
+            pin_to_primary(1)
+            self.assertTrue(is_pinned_to_primary(1))
+        cache.delete(PIN_KEY.format(user_id=1))
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        isolated = override_settings(METRICS_DIR=directory.name)
+        isolated.enable()
+        self.addCleanup(isolated.disable)
+
+    def test_needs_the_token(self):
+        with override_settings(METRICS_TOKEN="secret"):
+            self.assertEqual(self.client.get("/metrics/").status_code, 403)
+            response = self.client.get("/metrics/", headers={"Authorization": "Bearer secret"})
+            self.assertEqual(response.status_code, 200)
+
+    def test_closed_without_a_token_unless_debugging(self):
+        with override_settings(METRICS_TOKEN=""):
+            self.assertEqual(self.client.get("/metrics/").status_code, 403)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.client.get("/metrics/").status_code, 200)
+
+    def write(self, host, flushed_at):
+        snapshot = {
+            "host": host,
+            # Not running here, but maybe in another container
+            "pid": 2**22 + 1,
+            "flushed_at": flushed_at,
+            "counters": [["test_total", [], 2.0]],
+            "gauges": [["test_gauge", [], 3.0]],
+            "histograms": [],
+        }
+        with open(os.path.join(settings.METRICS_DIR, f"{host}-{flushed_at}.json"), "w") as f:
+            json.dump(snapshot, f)
+
+    def test_processes_on_other_hosts_are_dead_once_they_stop_flushing(self):
+        self.write("other-host", time.time())
+        totals = metrics.collect()
+        self.assertEqual((totals["counters"]["test_total", ()], totals["gauges"]["test_gauge", ()]), (2.0, 3.0))
+
+        self.write(metrics.HOSTNAME, time.time())
+        self.write("gone-host", time.time() - settings.METRICS_WRITER_TIMEOUT - 1)
+        totals = metrics.collect()
+        self.assertEqual((totals["counters"]["test_total", ()], totals["gauges"]["test_gauge", ()]), (6.0, 3.0))
+        # Folded into the archive
+        self.assertEqual(len([name for name in os.listdir(settings.METRICS_DIR) if name.endswith(".json")]), 3)
+
+    def test_processes_folded_while_idle_are_not_counted_twice(self):
+        registry = metrics.Registry()
+        registry.inc("test_total", value=2.0)
+        registry.flush(force=True)
+        with mock.patch.object(metrics, "_writer_alive", return_value=False):
+            metrics.collect()
+        registry.inc("test_total")
+        registry.flush(force=True)
+        self.assertEqual(metrics.collect()["counters"]["test_total", ()], 3.0)
+
+
+class IdempotencyKeyTests(IsolatedStoresMixin, APITestCase):
+    databases = {"default", *settings.JOURNAL_SHARDS}
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("idempotent@example.com", "password")
+        self.client.force_authenticate(self.user)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.client.post("/api/journal-logs/", {"text": "once"}, format="json", HTTP_IDEMPOTENCY_KEY="k1")
+        with self.assertNumQueries(0):
+            retry = self.client.post("/api/journal-logs/", {"text": "once"}, format="json", HTTP_IDEMPOTENCY_KEY="k1")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        with user_journal(self.user.pk):
+            self.assertEqual(JournalLog.objects.filter(user=self.user).count(), 1)
+
+        # Another process without the cached copy replays it from the database
+        caches[settings.IDEMPOTENCY_CACHE].clear()
+        retry = self.client.post("/api/journal-logs/", {"text": "once"}, format="json", HTTP_IDEMPOTENCY_KEY="k1")
+        self.assertEqual(retry.json(), first.json())
+        with user_journal(self.user.pk):
+            self.assertEqual(JournalLog.objects.filter(user=self.user).count(), 1)
+
+    def test_key_cannot_be_reused_for_another_payload(self):
+        self.client.post("/api/journal-logs/", {"text": "one"}, format="json", HTTP_IDEMPOTENCY_KEY="k2")
+        response = self.client.post("/api/journal-logs/", {"text": "two"}, format="json", HTTP_IDEMPOTENCY_KEY="k2")
+        self.assertEqual(response.status_code, 422)
+
+    def test_failed_validation_releases_the_key(self):
+        response = self.client.post("/api/journal-logs/", {"type": "todo"}, format="json", HTTP_IDEMPOTENCY_KEY="k3")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_signup_retry_does_not_register_twice(self):
+        self.client.force_authenticate(None)
+        data = {"email": "retry@example.com", "password": "S3cure-pass", "confirm_password": "S3cure-pass"}
+        first = self.client.post("/api/auth/signup/", data, format="json", HTTP_IDEMPOTENCY_KEY="signup")
+        # The response never made it back to the client
+        self.client.cookies.clear()
+        retry = self.client.post("/api/auth/signup/", data, format="json", HTTP_IDEMPOTENCY_KEY="signup")
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.json()["user"], first.json()["user"])
+        self.assertEqual(User.objects.filter(email="retry@example.com").count(), 1)
+
+        # The tokens aren't stored, the retry gets tokens of its own
+        record = IdempotencyKey.objects.get()
+        self.assertNotIn("tokens", record.response["data"])
+        self.assertNotIn("refresh_token", str(record.response))
+        access = AccessToken(retry.json()["tokens"]["access"])
+        self.assertEqual(str(access["user_id"]), str(first.json()["user"]["id"]))
+        self.assertEqual(retry.cookies["refresh_token"].value, retry.json()["tokens"]["refresh"])
+
+
+@skipUnless(connection.vendor == "postgresql", "Query limits only apply on Postgres")
+class QueryGuardTests(IsolatedStoresMixin, APITestCase):
+    databases = {"default", *settings.JOURNAL_SHARDS}
+
+    def test_result_over_the_row_limit_ends_in_413(self):
+        user = User.objects.create_user("guarded@example.com", "password")
+        with user_journal(user.pk):
+            JournalLog.objects.bulk_create([JournalLog(user=user, text=f"log {index}") for index in range(3)])
+        self.client.force_authenticate(user)
+        limits = {**settings.QUERY_LIMITS, "JournalLogViewSet.list": {"max_rows": 2}}
+        with override_settings(QUERY_LIMITS=limits), self.assertLogs("core.query_guard", "WARNING") as logs:
+            response = self.client.get("/api/journal-logs/")
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('FROM "journal_logs"', logs.output[0])
+        self.assertEqual(self.client.get("/api/journal-logs/?type=todo").status_code, 200)
+
+    def test_users_with_more_logs_than_a_row_limit_can_be_deleted(self):
+        user = User.objects.create_user("deleted@example.com", "password")
+        with user_journal(user.pk) as database:
+            JournalLog.objects.bulk_create([JournalLog(user=user, text=f"log {index}") for index in range(3)])
+        self.client.force_authenticate(user)
+        # Row limits only apply to the views that set one, not through "default"
+        limits = {"default": {"max_rows": 2}, "JournalLogViewSet.list": {"max_rows": 2}}
+        with override_settings(QUERY_LIMITS=limits):
+            response = self.client.delete(f"/api/users/{user.pk}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(JournalLog.objects.using(database).filter(user_id=user.pk).exists())
+
+    def test_batched_requests_get_the_limits_of_their_view(self):
+        user = User.objects.create_user("batched@example.com", "password")
+        with user_journal(user.pk):
+            JournalLog.objects.bulk_create([JournalLog(user=user, text=f"log {index}") for index in range(3)])
+        self.client.force_authenticate(user)
+        limits = {**settings.QUERY_LIMITS, "JournalLogViewSet.list": {"max_rows": 2}, "BatchView": {"max_rows": 1}}
+        batch = {"requests": [{"path": "/api/journal-logs/"}, {"path": f"/api/users/{user.pk}/"}]}
+        with override_settings(QUERY_LIMITS=limits), self.assertLogs("core.query_guard", "WARNING") as logs:
+            response = self.client.post("/api/batch/", batch, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([sub["status"] for sub in response.json()["responses"]], [413, 200])
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("JournalLogViewSet.list", logs.output[0])
+
+    def test_limits_end_views_outside_drf_with_their_status(self):
+        admin = User.objects.create_superuser("admin@example.com", "password")
+        # The admin browses the journals on default
+        JournalLog.objects.using("default").bulk_create(
+            [JournalLog(user=admin, text=f"log {index}") for index in range(3)]
+        )
+        self.client.force_login(admin)
+        limits = {**settings.QUERY_LIMITS, "changelist_view": {"max_rows": 2}}
+        with override_settings(QUERY_LIMITS=limits), self.assertLogs("core.query_guard", "WARNING"):
+            response = self.client.get("/admin/journal/journallog/")
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json(), {"detail": TooManyRows.default_detail})
+
+    def test_query_over_the_timeout_ends_in_503(self):
+        limits = {**settings.QUERY_LIMITS, "slow": {"timeout_ms": 50}}
+        with override_settings(QUERY_LIMITS=limits), connection.execute_wrapper(QueryGuard("slow")):
+            with self.assertRaises(QueryTimeout), self.assertLogs("core.query_guard", "WARNING"):
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_sleep(1)")
+
+
+@override_settings(TASK_QUEUES={"tests": 0}, TASK_RETRY_BACKOFF=10, TASK_RETRY_BACKOFF_MAX=60)
+class TaskQueueTests(TestCase):
+    def enqueue(self, **options):
+        with self.captureOnCommitCallbacks(execute=True):
+            failing_task.enqueue_with(**options)
+        return Task.objects.latest("pk")
+
+    def test_retry_delay_backs_off_with_jitter(self):
+        for attempts, (low, high) in ((1, (5, 10)), (2, (10, 20)), (10, (30, 60))):
+            self.assertTrue(all(low <= retry_delay(attempts) <= high for _ in range(20)), attempts)
+
+    def test_failed_tasks_are_retried_until_out_of_attempts(self):
+        queued = self.enqueue()
+        claimed = claim("tests", 10, "worker")
+        self.assertEqual([task.pk for task in claimed], [queued.pk])
+        # Running, nobody else gets it
+        self.assertEqual(claim("tests", 10, "other"), [])
+
+        with self.assertLogs("core.tasks", "WARNING"):
+            self.assertEqual(execute(claimed[0]), Task.Status.QUEUED)
+        retried = Task.objects.get(pk=queued.pk)
+        self.assertEqual((retried.attempts, retried.last_error), (1, "ValueError: Broken"))
+        self.assertGreaterEqual(retried.run_at, timezone.now() + timedelta(seconds=4))
+        self.assertEqual(claim("tests", 10, "worker"), [])
+
+        Task.objects.filter(pk=queued.pk).update(run_at=timezone.now())
+        with self.assertLogs("core.tasks", "ERROR"):
+            self.assertEqual(execute(claim("tests", 10, "worker")[0]), Task.Status.FAILED)
+        self.assertEqual(Task.objects.get(pk=queued.pk).attempts, 2)
+
+    def test_tasks_of_dead_workers_are_handed_out_again(self):
+        queued = self.enqueue()
+        claim("tests", 10, "dead")
+        self.assertEqual(requeue_abandoned(), 0)
+
+        expired = timezone.now() - timedelta(seconds=settings.TASK_LEASE_SECONDS + 1)
+        Task.objects.filter(pk=queued.pk).update(locked_at=expired)
+        self.assertEqual(requeue_abandoned(), 1)
+        self.assertEqual([task.pk for task in claim("tests", 10, "worker")], [queued.pk])
+
+        # Out of attempts
+        Task.objects.filter(pk=queued.pk).update(locked_at=expired)
+        requeue_abandoned()
+        self.assertEqual(Task.objects.get(pk=queued.pk).status, Task.Status.FAILED)
+
+    def test_periodic_tasks_have_one_run_queued(self):
+        name = "core.tasks.purge_idempotency_keys"
+        with override_settings(TASK_PERIODIC={name: 300}):
+            for _ in range(2):
+                with self.captureOnCommitCallbacks(execute=True):
+                    schedule_periodic()
+        scheduled = Task.objects.get(name=name)
+        self.assertAlmostEqual(scheduled.run_at, timezone.now() + timedelta(seconds=300), delta=timedelta(seconds=5))
+
+
+@skipUnless(connection.vendor == "postgresql", "SKIP LOCKED is not supported by SQLite")
+@override_settings(TASK_QUEUES={"tests": 0})
+class TaskClaimTests(TransactionTestCase):
+    def test_claim_skips_tasks_locked_by_another_worker(self):
+        tasks = Task.objects.bulk_create([Task(name=failing_task.name, queue="tests") for _ in range(3)])
+        locked, release = threading.Event(), threading.Event()
+
+        def other_worker():
+            with transaction.atomic():
+                Task.objects.select_for_update().get(pk=tasks[0].pk)
+                locked.set()
+                release.wait(5)
+            connection.close()
+
+        thread = threading.Thread(target=other_worker)
+        thread.start()
+        try:
+            locked.wait(5)
+            claimed = claim("tests", 10, "worker")
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual({task.pk for task in claimed}, {tasks[1].pk, tasks[2].pk})
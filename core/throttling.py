@@ -0,0 +1,143 @@
+# core/throttling.py
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+
+from django.conf import settings
+from rest_framework.throttling import SimpleRateThrottle
+
+logger = logging.getLogger(__name__)
+
+# Buckets untouched for this long are full again and can be dropped
+STALE_BUCKET_SECONDS = 24 * 3600
+PURGE_PROBABILITY = 0.001
+
+
+class TokenBucketStore:
+    """Token buckets kept in a SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        if getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def consume(self, key, capacity, refill_rate, cost=1.0):
+        """Take `cost` tokens from the bucket. Returns 0 when allowed, otherwise the seconds until it would be."""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / refill_rate
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (key, tokens, now),
+            )
+            if random.random() < PURGE_PROBABILITY:
+                conn.execute("DELETE FROM buckets WHERE updated_at < ?", (now - STALE_BUCKET_SECONDS,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None or _store.path != settings.THROTTLE_STORE_PATH:
+        _store = TokenBucketStore(settings.THROTTLE_STORE_PATH)
+    return _store
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Token bucket version of DRF's rate throttles.
+
+    A rate of "5/min" is a bucket of 5 tokens refilled at 5 per minute, so short bursts are
+    allowed while the sustained rate stays capped. Throttles run before the view handler,
+    so rejected requests never reach the serializer or the password hasher.
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        try:
+            self._wait = get_store().consume(self.key, self.num_requests, self.num_requests / self.duration)
+        except sqlite3.Error:
+            # Fail open, a broken throttle store shouldn't take the API down with it
+            logger.warning("Throttle store unavailable", exc_info=True)
+            return True
+        return self._wait == 0
+
+    def wait(self):
+        return self._wait
+
+
+class IPRateThrottle(TokenBucketThrottle):
+    def get_cache_key(self, request, view):
+        return self.cache_format % {"scope": self.scope, "ident": self.get_ident(request)}
+
+
+class AccountRateThrottle(TokenBucketThrottle):
+    """Throttles per user, or per submitted email for the anonymous auth endpoints."""
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            # Parsed JSON can be a list or a scalar, left to the view to reject
+            email = request.data.get("email") if isinstance(request.data, Mapping) else None
+            ident = email.strip().lower() if isinstance(email, str) else ""
+            if not ident:
+                return None
+        return self.cache_format % {"scope": self.scope, "ident": ident}
+
+
+class LoginIPRateThrottle(IPRateThrottle):
+    scope = "login_ip"
+
+
+class LoginAccountRateThrottle(AccountRateThrottle):
+    scope = "login_account"
+
+
+class SignupIPRateThrottle(IPRateThrottle):
+    scope = "signup_ip"
+
+
+class RefreshIPRateThrottle(IPRateThrottle):
+    scope = "refresh_ip"
+
+
+class WriteAccountRateThrottle(AccountRateThrottle):
+    scope = "write_account"
@@ -0,0 +1,148 @@
+# core/tracing.py
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from django.conf import settings
+
+# Seconds between checks of the overrides file for changes
+RELOAD_INTERVAL = 5.0
+
+
+class SamplingPolicy:
+    """
+    Sentry trace sampling rates, reloaded from SENTRY_SAMPLING_FILE when it changes.
+
+    `routes` maps path prefixes to base rates, the longest matching prefix wins. Requests on
+    routes with a non-zero rate are recorded up to `max_per_second` per worker, so whether
+    one failed or was slow is known before deciding to send it: errors and slow requests
+    are always sent, the others at their route's base rate, and only those are profiled.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_at = 0.0
+        self.mtime = None
+        self.config = {}
+        self.tokens = None
+        self.tokens_updated = time.monotonic()
+
+    def defaults(self):
+        return {
+            "default": settings.SENTRY_TRACES_SAMPLE_RATE,
+            "slow_ms": settings.SENTRY_TRACES_SLOW_MS,
+            "max_per_second": settings.SENTRY_TRACES_MAX_PER_SECOND,
+            "routes": dict(settings.SENTRY_TRACES_ROUTE_RATES),
+        }
+
+    def current(self):
+        now = time.monotonic()
+        if self.config and now - self.checked_at < RELOAD_INTERVAL:
+            return self.config
+        with self.lock:
+            self.checked_at = now
+            try:
+                mtime = os.stat(settings.SENTRY_SAMPLING_FILE).st_mtime
+            except OSError:
+                mtime = None
+            if mtime != self.mtime or not self.config:
+                config = self.defaults()
+                if mtime is not None:
+                    with open(settings.SENTRY_SAMPLING_FILE) as f:
+                        overrides = json.load(f)
+                    config.update({key: value for key, value in overrides.items() if key != "routes"})
+                    config["routes"].update(overrides.get("routes", {}))
+                self.config = config
+                self.mtime = mtime
+        return self.config
+
+    def rate_for(self, path):
+        config = self.current()
+        matches = [prefix for prefix in config["routes"] if path.startswith(prefix)]
+        if matches:
+            return config["routes"][max(matches, key=len)]
+        return config["default"]
+
+    def take_token(self):
+        """Per-worker token bucket capping recorded transactions per second."""
+        limit = self.current()["max_per_second"]
+        with self.lock:
+            now = time.monotonic()
+            if self.tokens is None:
+                self.tokens = limit
+            self.tokens = min(limit, self.tokens + (now - self.tokens_updated) * limit)
+            self.tokens_updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+policy = SamplingPolicy()
+
+
+def _request_path(sampling_context):
+    if environ := sampling_context.get("wsgi_environ"):
+        return environ.get("PATH_INFO", "")
+    if scope := sampling_context.get("asgi_scope"):
+        return scope.get("path", "")
+    return None
+
+
+def _draw(trace_id):
+    """A number in [0, 1) set by the trace id, the same for every decision about one trace."""
+    try:
+        return int(trace_id[:8], 16) / 2**32
+    except (TypeError, ValueError):
+        return random.random()
+
+
+def traces_sampler(sampling_context):
+    if sampling_context.get("parent_sampled") is not None:
+        return float(sampling_context["parent_sampled"])
+
+    path = _request_path(sampling_context)
+    if path is None:
+        # Management commands, tasks and other non-request transactions
+        return policy.current()["default"]
+    if policy.rate_for(path) <= 0 or not policy.take_token():
+        return 0.0
+    return 1.0
+
+
+def profiles_sampler(sampling_context):
+    """Profile the recorded requests that will be sent whatever their outcome, their route's base rate."""
+    path = _request_path(sampling_context)
+    if path is None:
+        return 1.0
+    trace_id = sampling_context.get("transaction_context", {}).get("trace_id")
+    return 1.0 if _draw(trace_id) < policy.rate_for(path) else 0.0
+
+
+def _duration_ms(event):
+    start, end = event.get("start_timestamp"), event.get("timestamp")
+    if isinstance(start, datetime) and isinstance(end, datetime):
+        return (end - start).total_seconds() * 1000
+    return 0.0
+
+
+def before_send_transaction(event, hint):
+    """Keep every recorded error or slow transaction, thin the rest down to their route's base rate."""
+    trace = event.get("contexts", {}).get("trace", {})
+    if trace.get("status", "ok") != "ok":
+        return event
+
+    if _duration_ms(event) >= policy.current()["slow_ms"]:
+        return event
+
+    url = event.get("request", {}).get("url")
+    if url is None:
+        return event
+    path = "/" + url.split("://", 1)[-1].partition("/")[2].partition("?")[0]
+    # The same draw as profiles_sampler's, so profiled transactions are the ones kept
+    if _draw(trace.get("trace_id")) < policy.rate_for(path):
+        return event
+    return None
@@ -0,0 +1,86 @@
+# core/views.py
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+from drf_spectacular.renderers import (
+    OpenApiJsonRenderer,
+    OpenApiJsonRenderer2,
+    OpenApiYamlRenderer,
+    OpenApiYamlRenderer2,
+)
+from drf_spectacular.settings import spectacular_settings
+from drf_spectacular.utils import extend_schema
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .batch import run_batch
+from .metrics import collect, exposition
+from .schema import load_artifacts
+from .serializers import BatchRequestSerializer, BatchResponseSerializer
+
+
+def metrics_view(request):
+    if not settings.METRICS_TOKEN:
+        # Open without a token in development only
+        if not settings.DEBUG:
+            return HttpResponseForbidden()
+    elif not constant_time_compare(request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponseForbidden()
+    return HttpResponse(exposition(collect()), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class BatchView(APIView):
+    @extend_schema(
+        summary="Batch requests",
+        description=(
+            "Run several API requests in one round trip, authenticated as the caller. "
+            "Requests run in order and each gets its own status; GETs between writes may run concurrently."
+        ),
+        request=BatchRequestSerializer,
+        responses=BatchResponseSerializer,
+    )
+    def post(self, request):
+        serializer = BatchRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({"responses": run_batch(request, serializer.validated_data["requests"])})
+
+
+def lazy_view(view_path, **initkwargs):
+    """A class-based view that's only imported by its first request, for views workers rarely serve."""
+    view = None
+
+    def lazy(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = import_string(view_path).as_view(**initkwargs)
+        return view(request, *args, **kwargs)
+
+    lazy.__name__ = view_path.rpartition(".")[2]
+    return lazy
+
+
+class SchemaView(APIView):
+    """
+    The schema from `manage.py build_schema`. Only generated per request with DEBUG, which is
+    also the only case that loads drf_spectacular's generator.
+    """
+
+    renderer_classes = [OpenApiYamlRenderer, OpenApiYamlRenderer2, OpenApiJsonRenderer, OpenApiJsonRenderer2]
+    permission_classes = spectacular_settings.SERVE_PERMISSIONS
+
+    @extend_schema(exclude=True)
+    def get(self, request, *args, **kwargs):
+        if settings.DEBUG:
+            from drf_spectacular.views import SpectacularAPIView
+
+            return SpectacularAPIView.as_view()(request._request, *args, **kwargs)
+        format = request.accepted_renderer.format
+        content, etag = load_artifacts()[format]
+        response = HttpResponse(content, content_type=request.accepted_media_type)
+        response["ETag"] = etag
+        response["Content-Disposition"] = f'inline; filename="{spectacular_settings.TITLE or "schema"}.{format}"'
+        # Cached by clients and proxies, revalidated with If-None-Match
+        patch_cache_control(response, public=True, no_cache=True)
+        return get_conditional_response(request, etag=etag, response=response)
@@ -0,0 +1,107 @@
+# core/warmup.py
+"""
+Setup a worker otherwise does lazily on its first requests, done before it accepts traffic
+by the hooks in gunicorn.conf.py.
+
+prime() only fills in-process caches and is safe to run in gunicorn's master before the
+workers are forked from it. connect() opens database connections and has to run in each
+worker.
+"""
+
+import inspect
+import logging
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.urls import URLResolver, get_resolver
+from django.utils import translation
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+_primed = False
+
+
+def compile_patterns(patterns):
+    for pattern in patterns:
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            compile_patterns(pattern.url_patterns)
+
+
+def prime_urls():
+    resolver = get_resolver()
+    compile_patterns(resolver.url_patterns)
+    # Populates the reverse lookups of every namespace, otherwise built by the first reverse()
+    resolver.reverse_dict
+
+
+def prime_serializers():
+    """Builds the fields of the apps' serializers, which loads the models' relation trees once."""
+    for app in settings.LOCAL_APPS:
+        try:
+            module = import_module(f"{app}.serializers")
+        except ModuleNotFoundError:
+            continue
+        for serializer_class in vars(module).values():
+            if (
+                inspect.isclass(serializer_class)
+                and issubclass(serializer_class, BaseSerializer)
+                and serializer_class.__module__ == module.__name__
+            ):
+                serializer_class().fields
+
+
+def prime_authentication():
+    """Loads the JWT backend, and with it `cryptography`, otherwise imported by the first authenticated request."""
+    import_module("rest_framework_simplejwt.state")
+
+
+def prime_translations():
+    with translation.override(settings.LANGUAGE_CODE):
+        translation.gettext("This field is required.")
+
+
+def connect():
+    for connection in connections.all():
+        try:
+            connection.ensure_connection()
+        except DatabaseError:
+            logger.warning("Warmup couldn't connect to database %r", connection.alias, exc_info=True)
+            continue
+        if not connection.settings_dict["CONN_MAX_AGE"]:
+            # Only persistent connections outlive a request, pooled ones go back to the warm pool
+            connection.close()
+
+
+def timed(steps):
+    timings = {}
+    for name, step in steps:
+        start = time.perf_counter()
+        step()
+        timings[name] = round((time.perf_counter() - start) * 1000, 1)
+    return timings
+
+
+def prime():
+    """Milliseconds spent per step, nothing when this process was primed already."""
+    global _primed
+    if _primed:
+        return {}
+    _primed = True
+    return timed(
+        (
+            ("urls", prime_urls),
+            ("serializers", prime_serializers),
+            ("authentication", prime_authentication),
+            ("translations", prime_translations),
+        )
+    )
+
+
+def warmup():
+    timings = {**prime(), **timed((("databases", connect),))}
+    logger.info("Warmed up in %.1fms: %s", sum(timings.values()), timings)
+    return timings
@@ -0,0 +1,23 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings, read from the working directory. Workers warm up before they accept
+requests, see core.warmup; `manage.py startup_profile` measures the difference.
+"""
+
+import decouple
+
+# The master imports and primes the app once, workers fork from it ready to serve
+preload_app = decouple.config("GUNICORN_PRELOAD_APP", default=True, cast=bool)
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from core.warmup import prime
+
+        prime()
+
+
+def post_worker_init(worker):
+    from core.warmup import warmup
+
+    warmup()
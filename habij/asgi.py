@@ -3,6 +3,11 @@ ASGI config for habij project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The journal event stream (/api/journal-logs/events/) is only served here, it would hold a
+worker per open stream under WSGI. Run it with an ASGI server, e.g.
+gunicorn habij.asgi:application -k uvicorn_worker.UvicornWorker (see the deploy job in
+.github/workflows/ci.yaml)
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -13,4 +18,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "habij.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from journal.events import EVENTS_PATH, events_app  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "http" and scope["path"] == EVENTS_PATH:
+        await events_app(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
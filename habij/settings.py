@@ -14,8 +14,8 @@ import os
 from datetime import timedelta
 from pathlib import Path
 
-import sentry_sdk
-from decouple import config
+from corsheaders.defaults import default_headers
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -51,6 +51,7 @@ PRIORITY_APPS = (
     "corsheaders",
 )
 LOCAL_APPS = (
+    "core",
     "journal",
     "users",
 )
@@ -59,6 +60,10 @@ INSTALLED_APPS = LOCAL_APPS + DJANGO_APPS + PRIORITY_APPS
 
 
 MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",
+    "core.middleware.InstrumentationMiddleware",
+    "core.middleware.QueryGuardMiddleware",
+    "core.middleware.CompressionMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -69,6 +74,101 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Per-request query/timing instrumentation, see core.middleware.InstrumentationMiddleware
+INSTRUMENTATION_SAMPLE_RATE = config("INSTRUMENTATION_SAMPLE_RATE", default=1.0 if DEBUG else 0.05, cast=float)
+INSTRUMENTATION_SERVER_TIMING = config("INSTRUMENTATION_SERVER_TIMING", default=DEBUG, cast=bool)
+# Identical query shapes repeated this many times in one request are logged as N+1
+INSTRUMENTATION_N_PLUS_ONE_THRESHOLD = config("INSTRUMENTATION_N_PLUS_ONE_THRESHOLD", default=5, cast=int)
+
+# Response compression, see core.middleware.CompressionMiddleware. Encodings in order of preference,
+# br and zstd need the brotli and zstandard packages.
+COMPRESSION_ENCODINGS = config("COMPRESSION_ENCODINGS", default="zstd,br,gzip", cast=Csv())
+COMPRESSION_MIN_SIZE = config("COMPRESSION_MIN_SIZE", default=1024, cast=int)
+COMPRESSION_LEVELS = {
+    "gzip": config("COMPRESSION_GZIP_LEVEL", default=6, cast=int),
+    "br": config("COMPRESSION_BROTLI_LEVEL", default=4, cast=int),
+    "zstd": config("COMPRESSION_ZSTD_LEVEL", default=3, cast=int),
+}
+
+# Metrics exposed at /metrics/, aggregated over worker processes through files in METRICS_DIR
+METRICS_DIR = config(
+    "METRICS_DIR", default="/dev/shm/habij-metrics" if os.path.isdir("/dev/shm") else "/tmp/habij-metrics"
+)
+METRICS_FLUSH_INTERVAL = config("METRICS_FLUSH_INTERVAL", default=1.0, cast=float)
+# Seconds without a flush after which the metrics of a process on another host sharing METRICS_DIR count as dead
+METRICS_WRITER_TIMEOUT = config("METRICS_WRITER_TIMEOUT", default=300, cast=int)
+# Scrapers must send "Authorization: Bearer <token>". Unset, /metrics/ is only served with DEBUG on.
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
+# Background tasks run by `manage.py run_tasks`, see core.tasks.
+# Queues as "name:concurrency", the limit is across all workers and 0 means unlimited
+TASK_QUEUES = {
+    name: int(limit or 0)
+    for name, _, limit in (
+        entry.partition(":") for entry in config("TASK_QUEUES", default="default:8,auth:4", cast=Csv())
+    )
+}
+TASK_WORKER_THREADS = config("TASK_WORKER_THREADS", default=4, cast=int)
+TASK_POLL_INTERVAL = config("TASK_POLL_INTERVAL", default=1.0, cast=float)
+# First retry after about this many seconds, doubling per attempt up to the max
+TASK_RETRY_BACKOFF = config("TASK_RETRY_BACKOFF", default=5, cast=int)
+TASK_RETRY_BACKOFF_MAX = config("TASK_RETRY_BACKOFF_MAX", default=3600, cast=int)
+# Tasks running longer than this are assumed to belong to a dead worker and run again
+TASK_LEASE_SECONDS = config("TASK_LEASE_SECONDS", default=600, cast=int)
+TASK_RETENTION_DAYS = config("TASK_RETENTION_DAYS", default=7, cast=int)
+# Tasks the workers schedule by themselves, by name with their interval in seconds
+TASK_PERIODIC = {
+    "journal.tasks.purge_journal_events": 3600,
+    "core.tasks.purge_idempotency_keys": 3600,
+    "journal.tasks.archive_journal_text": 3600,
+    "core.tasks.cull_caches": 600,
+}
+
+# Journal event stream (journal.events), served over ASGI
+SSE_HEARTBEAT_SECONDS = config("SSE_HEARTBEAT_SECONDS", default=20, cast=int)
+SSE_RETRY_MS = config("SSE_RETRY_MS", default=3000, cast=int)
+# Events buffered per client before it's told to refetch instead
+SSE_CLIENT_BUFFER = config("SSE_CLIENT_BUFFER", default=100, cast=int)
+SSE_REPLAY_LIMIT = config("SSE_REPLAY_LIMIT", default=500, cast=int)
+SSE_MAX_CONNECTIONS = config("SSE_MAX_CONNECTIONS", default=5000, cast=int)
+# Without Postgres LISTEN/NOTIFY the stream polls for events
+SSE_POLL_INTERVAL = config("SSE_POLL_INTERVAL", default=1.0, cast=float)
+JOURNAL_EVENT_RETENTION_HOURS = config("JOURNAL_EVENT_RETENTION_HOURS", default=24, cast=int)
+
+# Cached agenda per user and day (journal.agenda), dropped on every journal write
+AGENDA_CACHE = "shared"
+AGENDA_CACHE_SECONDS = config("AGENDA_CACHE_SECONDS", default=3600, cast=int)
+
+# Compressed cold storage of old journal text (journal.archive), 0 days keeps every text in the table
+JOURNAL_ARCHIVE_AFTER_DAYS = config("JOURNAL_ARCHIVE_AFTER_DAYS", default=180, cast=int)
+# Shorter texts cost more as an archive row than they take in the table
+JOURNAL_ARCHIVE_MIN_LENGTH = config("JOURNAL_ARCHIVE_MIN_LENGTH", default=24, cast=int)
+JOURNAL_ARCHIVE_BATCH_SIZE = config("JOURNAL_ARCHIVE_BATCH_SIZE", default=1000, cast=int)
+# Batches per database each time the periodic task runs, the command archives everything
+JOURNAL_ARCHIVE_BATCHES_PER_RUN = config("JOURNAL_ARCHIVE_BATCHES_PER_RUN", default=50, cast=int)
+JOURNAL_ARCHIVE_DICTIONARY_SIZE = config("JOURNAL_ARCHIVE_DICTIONARY_SIZE", default=32768, cast=int)
+JOURNAL_ARCHIVE_TRAINING_SAMPLES = config("JOURNAL_ARCHIVE_TRAINING_SAMPLES", default=50000, cast=int)
+
+# Idempotency-Key handling of write endpoints (core.idempotency)
+IDEMPOTENCY_CACHE = "shared"
+IDEMPOTENCY_TTL_SECONDS = config("IDEMPOTENCY_TTL_SECONDS", default=24 * 3600, cast=int)
+# How long a retry waits for the first request with its key to finish before getting a 409
+IDEMPOTENCY_WAIT_SECONDS = config("IDEMPOTENCY_WAIT_SECONDS", default=10, cast=float)
+# Keys claimed this long ago by a request that never finished are free again
+IDEMPOTENCY_LOCK_SECONDS = config("IDEMPOTENCY_LOCK_SECONDS", default=60, cast=int)
+
+# Admin change lists of large tables (core.admin_base) count exactly up to this many rows, and estimate above
+ADMIN_EXACT_COUNT_THRESHOLD = config("ADMIN_EXACT_COUNT_THRESHOLD", default=1000, cast=int)
+
+# Most users a single bulk activate/deactivate request may change
+USER_BULK_MAX_IDS = config("USER_BULK_MAX_IDS", default=1000, cast=int)
+
+# Batch endpoint (core.batch)
+BATCH_MAX_REQUESTS = config("BATCH_MAX_REQUESTS", default=20, cast=int)
+# Threads running consecutive batched GETs concurrently, each on its own DB connection.
+# 0 runs everything in order on the request's connection.
+BATCH_READ_THREADS = config("BATCH_READ_THREADS", default=0, cast=int)
+
 JWT_COOKIE_SECURE = not DEBUG
 
 # Cookie settings
@@ -82,6 +182,7 @@ JWT_AUTH_REFRESH_COOKIE = "refresh_token"
 # CORS settings
 CORS_ALLOWED_ORIGINS = config("CORS_ALLOWED_ORIGINS", "http://localhost").split(",")
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, "idempotency-key")
 
 ROOT_URLCONF = "habij.urls"
 
@@ -129,6 +230,8 @@ SPECTACULAR_SETTINGS = {
     "COMPONENT_SPLIT_REQUEST": True,
     "SORT_OPERATIONS": False,
 }
+# Where `manage.py build_schema` writes the schema served by /api/schema/ when DEBUG is off
+API_SCHEMA_DIR = config("API_SCHEMA_DIR", default=os.path.join(BASE_DIR, "openapi"))
 
 
 REST_FRAMEWORK = {
@@ -142,8 +245,25 @@ REST_FRAMEWORK = {
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend",
     ],
+    # Token buckets, see core.throttling
+    "DEFAULT_THROTTLE_RATES": {
+        "login_ip": config("THROTTLE_LOGIN_IP", default="20/min"),
+        "login_account": config("THROTTLE_LOGIN_ACCOUNT", default="5/min"),
+        "signup_ip": config("THROTTLE_SIGNUP_IP", default="5/min"),
+        "refresh_ip": config("THROTTLE_REFRESH_IP", default="30/min"),
+        "write_account": config("THROTTLE_WRITE_ACCOUNT", default="120/min"),
+    },
+    # Proxies in front of the app (nginx), the client address is the one the outermost appended to X-Forwarded-For.
+    # Unset, DRF would take the whole header as sent by the client, and throttles by IP could be dodged.
+    "NUM_PROXIES": config("NUM_PROXIES", default=1, cast=int),
 }
 
+# Throttle counters live in a SQLite file shared by all workers on the host, in memory when /dev/shm exists
+THROTTLE_STORE_PATH = config(
+    "THROTTLE_STORE_PATH",
+    default="/dev/shm/habij-throttle.sqlite3" if os.path.isdir("/dev/shm") else "/tmp/habij-throttle.sqlite3",
+)
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 DATABASES = {
@@ -159,7 +279,117 @@ DATABASES = {
         },
         # 1 minute persistent connection
         "CONN_MAX_AGE": config("DB_CONN_MAX_AGE", default=60, cast=int),
+        "CONN_HEALTH_CHECKS": config("DB_CONN_HEALTH_CHECKS", default=True, cast=bool),
+    }
+}
+
+# Database limits per request (core.query_guard) by view label as in the metrics: statement
+# timeout in ms, "default" for every other view, and the most rows one query may return, only
+# for the views listed with one. 0 disables. A view with its own timeout costs a round trip to
+# switch the connection to it, and back after.
+QUERY_LIMITS = {
+    "default": {"timeout_ms": config("DB_STATEMENT_TIMEOUT_MS", default=5000, cast=int)},
+    # Unpaginated, its cost grows with the user's history
+    "JournalLogViewSet.list": {"max_rows": 5000},
+}
+
+# Native connection pool of psycopg 3 (psycopg_pool, installed with psycopg[binary,pool])
+DB_POOL = config("DB_POOL", default=False, cast=bool)
+if DB_POOL:
+    # The pool replaces persistent connections, CONN_HEALTH_CHECKS makes it check connections before handing them out
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+    DATABASES["default"]["OPTIONS"]["pool"] = {
+        "min_size": config("DB_POOL_MIN_SIZE", default=2, cast=int),
+        "max_size": config("DB_POOL_MAX_SIZE", default=10, cast=int),
+        # Seconds a request waits for a free connection before failing
+        "timeout": config("DB_POOL_TIMEOUT", default=10.0, cast=float),
+        "max_idle": config("DB_POOL_MAX_IDLE", default=300.0, cast=float),
+        "max_lifetime": config("DB_POOL_MAX_LIFETIME", default=1800.0, cast=float),
+    }
+
+# Transaction pooling (PgBouncer pool_mode=transaction) hands each transaction to any server
+# connection, so nothing may outlive a transaction: no server-side cursors (.iterator() on querysets)
+# and no prepared statements, which Django already disables for psycopg 3 unless prepare_threshold is set.
+DB_PGBOUNCER = config("DB_PGBOUNCER", default=False, cast=bool)
+if DB_PGBOUNCER:
+    DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
+# LISTEN doesn't survive transaction pooling either, the event stream listens on this server directly
+EVENTS_LISTEN_HOST = config("EVENTS_LISTEN_HOST", default="")
+EVENTS_LISTEN_PORT = config("EVENTS_LISTEN_PORT", default=DATABASES["default"]["PORT"])
+
+# Read replicas, as comma separated host[:port] entries sharing the primary's credentials.
+# Read-only viewset actions read from them, see core.mixins.ReplicaReadMixin.
+DATABASE_REPLICAS = []
+for index, replica in enumerate(config("DB_REPLICA_HOSTS", default="", cast=Csv())):
+    host, _, port = replica.partition(":")
+    alias = f"replica_{index}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "OPTIONS": {**DATABASES["default"]["OPTIONS"]},
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+# Journal shards, as comma separated "name", "host[:port]/name" or "sqlite:///path" entries.
+# Journal data is spread over default and these by user, see journal.sharding.
+JOURNAL_SHARDS = []
+for index, shard in enumerate(config("DB_SHARDS", default="", cast=Csv()), start=1):
+    alias = f"shard_{index}"
+    if shard.startswith("sqlite:///"):
+        DATABASES[alias] = {"ENGINE": "django.db.backends.sqlite3", "NAME": shard.removeprefix("sqlite:///")}
+    else:
+        location, _, name = shard.rpartition("/")
+        host, _, port = location.partition(":")
+        DATABASES[alias] = {
+            **DATABASES["default"],
+            "OPTIONS": {**DATABASES["default"]["OPTIONS"]},
+            "NAME": name,
+            "HOST": host or DATABASES["default"]["HOST"],
+            "PORT": port or DATABASES["default"]["PORT"],
+        }
+    JOURNAL_SHARDS.append(alias)
+if JOURNAL_SHARDS:
+    JOURNAL_SHARDS.insert(0, "default")
+
+# Seconds a worker keeps its copy of the user -> shard map
+SHARD_MAP_CACHE_SECONDS = config("SHARD_MAP_CACHE_SECONDS", default=5, cast=int)
+SHARD_MAP_CACHE = "shared"
+
+DATABASE_ROUTERS = ["journal.sharding.ShardRouter", "core.db_routers.ReplicaRouter"]
+
+# Seconds a user's reads stay on the primary after they write
+REPLICA_PIN_SECONDS = config("REPLICA_PIN_SECONDS", default=5, cast=int)
+REPLICA_PIN_CACHE = "shared"
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# core.cache.TieredCache: a bounded copy of recent entries in each process in front of files
+# shared by every worker on the host, in memory when /dev/shm exists. Each alias has its own
+# directory under SHARED_CACHE_LOCATION, so clearing one leaves the other.
+SHARED_CACHE_LOCATION = config(
+    "SHARED_CACHE_LOCATION",
+    default="/dev/shm/habij-cache" if os.path.isdir("/dev/shm") else "/tmp/habij-cache",
+)
+CACHES = {
+    alias: {
+        "BACKEND": "core.cache.TieredCache",
+        "LOCATION": os.path.join(SHARED_CACHE_LOCATION, alias),
+        "OPTIONS": {
+            "NAME": alias,
+            # Files kept by core.tasks.cull_caches, the least recently written go first
+            "MAX_ENTRIES": config("CACHE_MAX_ENTRIES", default=200000, cast=int),
+            # 0 for a quarter of the filesystem's size, e.g. 16MB of Docker's default 64MB /dev/shm
+            "MAX_BYTES": config("CACHE_MAX_BYTES", default=0, cast=int),
+            # Writes between culls of the directory written to, on top of cull_caches
+            "CULL_EVERY": config("CACHE_CULL_EVERY", default=100, cast=int),
+            # Per process and alias
+            "LOCAL_MAX_BYTES": config("CACHE_LOCAL_MAX_BYTES", default=16 * 2**20, cast=int),
+        },
     }
+    for alias in ("default", "shared")
 }
 
 
@@ -168,7 +398,8 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=14),
     "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": True,
-    "UPDATE_LAST_LOGIN": True,
+    # last_login is written off-request by users.tasks.update_last_login
+    "UPDATE_LAST_LOGIN": False,
     "ALGORITHM": "HS256",
     "SIGNING_KEY": SECRET_KEY,
     "VERIFYING_KEY": None,
@@ -211,6 +442,46 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# https://docs.djangoproject.com/en/5.1/topics/auth/passwords/
+# The active profile hashes new passwords; the others stay listed so existing hashes still verify
+# and get upgraded to the active profile on the user's next successful login.
+PASSWORD_HASHER_PROFILES = {
+    "pbkdf2": "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "scrypt": "users.hashers.TunedScryptPasswordHasher",
+    "argon2": "users.hashers.TunedArgon2PasswordHasher",
+}
+PASSWORD_HASHER_PROFILE = config("PASSWORD_HASHER_PROFILE", default="pbkdf2")
+PASSWORD_HASHERS = [PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE]] + [
+    hasher for profile, hasher in PASSWORD_HASHER_PROFILES.items() if profile != PASSWORD_HASHER_PROFILE
+]
+
+ARGON2_TIME_COST = config("ARGON2_TIME_COST", default=2, cast=int)
+ARGON2_MEMORY_COST = config("ARGON2_MEMORY_COST", default=19456, cast=int)  # KiB
+ARGON2_PARALLELISM = config("ARGON2_PARALLELISM", default=1, cast=int)
+SCRYPT_WORK_FACTOR = config("SCRYPT_WORK_FACTOR", default=2**14, cast=int)
+SCRYPT_BLOCK_SIZE = config("SCRYPT_BLOCK_SIZE", default=8, cast=int)
+SCRYPT_PARALLELISM = config("SCRYPT_PARALLELISM", default=2, cast=int)
+
+# Hashing runs on a bounded per-worker thread pool; 0 workers hashes inline in the request thread
+PASSWORD_HASHING_WORKERS = config("PASSWORD_HASHING_WORKERS", default=2, cast=int)
+PASSWORD_HASHING_QUEUE_SIZE = config("PASSWORD_HASHING_QUEUE_SIZE", default=8, cast=int)
+PASSWORD_HASHING_QUEUE_TIMEOUT = config("PASSWORD_HASHING_QUEUE_TIMEOUT", default=2.0, cast=float)
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.1/topics/logging/
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "core": {"handlers": ["console"], "level": config("LOG_LEVEL", default="INFO")},
+    },
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -248,6 +519,11 @@ if USE_S3:
     # s3 private media settings
     PRIVATE_MEDIA_LOCATION = "private"
 else:
+    STORAGES = {
+        "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+        # Writes .gz (and .br/.zst) variants next to the collected files, for the web server in front to send
+        "staticfiles": {"BACKEND": "core.storage.PrecompressedStaticFilesStorage"},
+    }
     STATIC_URL = "/staticfiles/"
     STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
     MEDIA_URL = "/mediafiles/"
@@ -260,11 +536,28 @@ else:
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 AUTH_USER_MODEL = "users.User"
 
+# Trace sampling, see core.tracing. Rates can be changed at runtime with `manage.py trace_sampling`.
+SENTRY_TRACES_SAMPLE_RATE = config("SENTRY_TRACES_SAMPLE_RATE", default=0.05, cast=float)
+SENTRY_TRACES_SLOW_MS = config("SENTRY_TRACES_SLOW_MS", default=1000, cast=float)
+SENTRY_TRACES_MAX_PER_SECOND = config("SENTRY_TRACES_MAX_PER_SECOND", default=5, cast=float)
+SENTRY_TRACES_ROUTE_RATES = {
+    "/metrics/": 0.0,
+    "/staticfiles/": 0.0,
+    "/api/schema/": 0.01,
+    "/api/journal-logs/": 0.02,
+}
+SENTRY_SAMPLING_FILE = config("SENTRY_SAMPLING_FILE", default=os.path.join(BASE_DIR, "sentry-sampling.json"))
+
 if SENTRY_DSN := config("SENTRY_DSN", default=""):
+    # Imported only when used, it pulls in its HTTP transport and adds ~100ms to every worker's startup
+    import sentry_sdk
+
+    from core.tracing import before_send_transaction, profiles_sampler, traces_sampler
+
     sentry_sdk.init(
         dsn=SENTRY_DSN,
-        traces_sample_rate=config("SENTRY_TRACES_SAMPLE_RATE", default=1.0, cast=float),
-        _experiments={
-            "continuous_profiling_auto_start": True,
-        },
+        traces_sampler=traces_sampler,
+        before_send_transaction=before_send_transaction,
+        # Per transaction, instead of a profiler running all the time
+        profiles_sampler=profiles_sampler,
     )
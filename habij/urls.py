@@ -19,18 +19,17 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
-from drf_spectacular.views import (
-    SpectacularAPIView,
-    SpectacularRedocView,
-    SpectacularSwaggerView,
-)
+
+from core.views import BatchView, SchemaView, lazy_view, metrics_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics/", metrics_view, name="metrics"),
+    path("api/batch/", BatchView.as_view(), name="batch"),
     path("api/", include("journal.urls")),
     path("api/", include("users.urls")),
     # Swagger URLs
-    path("api/schema/", SpectacularAPIView.as_view(), name="schema"),
-    path("api/docs/", SpectacularSwaggerView.as_view(url_name="schema"), name="swagger-ui"),
-    path("api/redoc/", SpectacularRedocView.as_view(url_name="schema"), name="redoc"),
+    path("api/schema/", SchemaView.as_view(), name="schema"),
+    path("api/docs/", lazy_view("drf_spectacular.views.SpectacularSwaggerView", url_name="schema"), name="swagger-ui"),
+    path("api/redoc/", lazy_view("drf_spectacular.views.SpectacularRedocView", url_name="schema"), name="redoc"),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
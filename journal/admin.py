@@ -1,17 +1,26 @@
 # journals/admin.py
 from django.contrib import admin
 
+from core.admin_base import LargeTableAdmin
+
 from .models import Habit, JournalLog
 
 
+class DefaultDatabaseAdmin(LargeTableAdmin):
+    def get_queryset(self, request):
+        # Without a user there's no shard to route to, the admin browses the journals kept on default
+        return super().get_queryset(request).using("default")
+
+
 @admin.register(JournalLog)
-class JournalLogAdmin(admin.ModelAdmin):
+class JournalLogAdmin(DefaultDatabaseAdmin):
     list_display = ("id", "text", "user", "type", "scheduled_for", "done_at", "is_deleted", "created_at")
     list_filter = ("type", "done_at", "deleted_at", "created_at")
     search_fields = ("text", "user__email")
     readonly_fields = ("created_at", "updated_at")
     raw_id_fields = ("user",)
     date_hierarchy = "created_at"
+    str_select_related = ("user",)
 
     def is_deleted(self, obj):
         return obj.is_deleted
@@ -20,13 +29,14 @@ class JournalLogAdmin(admin.ModelAdmin):
 
 
 @admin.register(Habit)
-class HabitAdmin(admin.ModelAdmin):
+class HabitAdmin(DefaultDatabaseAdmin):
     list_display = ("text", "user", "is_deleted", "created_at")
     list_filter = ("deleted_at", "created_at")
     search_fields = ("text", "user__email")
     readonly_fields = ("created_at", "updated_at")
     raw_id_fields = ("user", "source_log")
     date_hierarchy = "created_at"
+    str_select_related = ("user",)
 
     def is_deleted(self, obj):
         return obj.is_deleted
@@ -0,0 +1,80 @@
+# journal/agenda.py
+"""
+The home screen's agenda: today's logs, the todos due by the end of today and the active
+habits with whether they're done.
+
+Built in two queries and cached per user and day in AGENDA_CACHE. Saves and deletes of
+JournalLog and Habit drop the user's cached agenda once they commit; bulk updates bypass
+the signals and have to call invalidate_agenda themselves.
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Habit, JournalLog
+from .serializers import AgendaSerializer
+
+AGENDA_KEY = "journal-agenda:{user_id}:{day}"
+LOG_FIELDS = ("id", "text", "type", "scheduled_for", "done_at", "created_at")
+
+
+def day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def build_agenda(user_id, day):
+    start, end = day_bounds(day)
+    logs, todos = [], []
+    rows = (
+        JournalLog.objects.filter(user_id=user_id, deleted_at__isnull=True)
+        .filter(
+            Q(type=JournalLog.LogType.LOG, created_at__gte=start, created_at__lt=end)
+            | Q(type=JournalLog.LogType.TODO, scheduled_for__lt=end) & (Q(done_at__isnull=True) | Q(done_at__gte=start))
+        )
+        .order_by("-created_at")
+        .values(*LOG_FIELDS)
+    )
+    for row in rows:
+        (todos if row["type"] == JournalLog.LogType.TODO else logs).append(row)
+    todos.sort(key=lambda row: row["scheduled_for"])
+
+    habits = list(
+        Habit.objects.filter(user_id=user_id, deleted_at__isnull=True)
+        .order_by("-created_at")
+        .values("id", "text", done_at=F("source_log__done_at"))
+    )
+    for habit in habits:
+        habit["done_today"] = habit["done_at"] is not None and habit["done_at"] >= start
+
+    return AgendaSerializer({"date": day, "logs": logs, "todos": todos, "habits": habits}).data
+
+
+def get_agenda(user_id):
+    day = timezone.localdate()
+    key = AGENDA_KEY.format(user_id=user_id, day=day.isoformat())
+    return caches[settings.AGENDA_CACHE].fetch(key, lambda: build_agenda(user_id, day), settings.AGENDA_CACHE_SECONDS)
+
+
+def invalidate_agenda(user_id):
+    day = timezone.localdate().isoformat()
+    caches[settings.AGENDA_CACHE].delete(AGENDA_KEY.format(user_id=user_id, day=day))
+
+
+@receiver(post_save, sender=JournalLog)
+@receiver(post_save, sender=Habit)
+@receiver(post_delete, sender=JournalLog)
+@receiver(post_delete, sender=Habit)
+def journal_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    user_id = instance.user_id
+    # After the commit, or a concurrent read could cache the old rows again
+    transaction.on_commit(lambda: invalidate_agenda(user_id), using=instance._state.db)
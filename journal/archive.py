@@ -0,0 +1,187 @@
+# journal/archive.py
+"""
+Cold storage for the text of old journal logs.
+
+`archive` moves the text of logs untouched for JOURNAL_ARCHIVE_AFTER_DAYS into
+ArchivedJournalText, compressed one log at a time with a dictionary trained on the
+database's journal text, and leaves it empty in journal_logs with `text_archived` set.
+Reading `JournalLog.text` loads it back (see journal.models.ArchivedTextDescriptor), for
+all the archived logs of a queryset in one query; setting it moves it back to the table.
+
+Open todos stay in the table, as does anything the agenda shows (written or done today),
+so the agenda's value queries never meet an archived text. Texts are not searchable once
+archived. Texts are compressed with zstd dictionaries. Each archived text names the
+dictionary it needs, texts archived with the zlib preset dictionaries of earlier versions
+can still be read.
+"""
+
+import logging
+import zlib
+from datetime import timedelta
+
+import zstandard
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.functions import Length
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import ArchivedJournalText, JournalLog, JournalTextDictionary
+
+logger = logging.getLogger(__name__)
+
+CODEC = "zstd"
+ZSTD_LEVEL = 19
+# zstd fails to train on a handful of texts
+MIN_TRAINING_SAMPLES = 1000
+
+# (database, dictionary id) -> (codec, dictionary), dictionaries never change
+_dictionaries = {}
+
+
+def train(samples, size=None):
+    """A zstd dictionary for texts like `samples`."""
+    size = size or settings.JOURNAL_ARCHIVE_DICTIONARY_SIZE
+    return zstandard.train_dictionary(size, [sample.encode() for sample in samples]).as_bytes()
+
+
+def compressor(dictionary):
+    """A function compressing one text with the zstd dictionary."""
+    zstd = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary, write_checksum=False, write_dict_id=False)
+    return lambda text: zstd.compress(text.encode())
+
+
+def decompress(codec, dictionary, data):
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(data).decode()
+    # Raw deflate with a preset dictionary, archived before zstd
+    decompressor = zlib.decompressobj(-15, zdict=dictionary)
+    return (decompressor.decompress(data) + decompressor.flush()).decode()
+
+
+def _dictionary(database, dictionary_id):
+    key = (database, dictionary_id)
+    if key not in _dictionaries:
+        codec, data = JournalTextDictionary.objects.using(database).values_list("codec", "data").get(pk=dictionary_id)
+        data = bytes(data)
+        if codec == "zstd":
+            data = zstandard.ZstdCompressionDict(data)
+        _dictionaries[key] = (codec, data)
+    return _dictionaries[key]
+
+
+def load_archived_texts(logs):
+    """Set the archived text of these logs, with one query per database."""
+    by_database = {}
+    for log in logs:
+        if "_archived_text" not in log.__dict__:
+            by_database.setdefault(log._state.db or "default", []).append(log)
+    for database, pending in by_database.items():
+        rows = ArchivedJournalText.objects.using(database).filter(log_id__in=[log.pk for log in pending])
+        texts = {
+            log_id: decompress(*_dictionary(database, dictionary_id), bytes(data))
+            for log_id, dictionary_id, data in rows.values_list("log_id", "dictionary_id", "data")
+        }
+        for log in pending:
+            log._archived_text = texts.get(log.pk, "")
+
+
+def archivable(cutoff):
+    """Logs whose text may move to the archive."""
+    open_todos = Q(type=JournalLog.LogType.TODO, done_at__isnull=True, deleted_at__isnull=True)
+    return (
+        JournalLog.objects.alias(length=Length("text"))
+        .filter(text_archived=False, updated_at__lt=cutoff, length__gte=settings.JOURNAL_ARCHIVE_MIN_LENGTH)
+        .exclude(open_todos)
+    )
+
+
+def current_dictionary(database, cutoff, retrain=False):
+    """The newest dictionary of CODEC on the database, trained on archivable texts when there is none (or `retrain`)."""
+    dictionaries = JournalTextDictionary.objects.using(database).filter(codec=CODEC)
+    dictionary = None if retrain else dictionaries.order_by("-pk").first()
+    if dictionary is not None:
+        return dictionary
+    samples = list(
+        archivable(cutoff)
+        .using(database)
+        .order_by("pk")
+        .values_list("text", flat=True)[: settings.JOURNAL_ARCHIVE_TRAINING_SAMPLES]
+    )
+    if len(samples) < MIN_TRAINING_SAMPLES:
+        logger.info("Not archiving journal text on %s yet, %d texts to train on", database, len(samples))
+        return None
+    return dictionaries.create(codec=CODEC, data=train(samples), samples=len(samples))
+
+
+def archive_batch(database, cutoff, dictionary, after_id=0, batch_size=None):
+    """
+    Archive the next batch of archivable logs with ids above `after_id`, in one transaction.
+    Returns (last id, texts archived, bytes of text, bytes compressed); no last id when done.
+    """
+    compress = compressor(_dictionary(database, dictionary.pk)[1])
+    with transaction.atomic(using=database):
+        logs = list(
+            archivable(cutoff)
+            .using(database)
+            # Logs being edited are left for the next run
+            .select_for_update(skip_locked=True)
+            .filter(pk__gt=after_id)
+            .order_by("pk")
+            .values_list("pk", "text")[: batch_size or settings.JOURNAL_ARCHIVE_BATCH_SIZE]
+        )
+        if not logs:
+            return None, 0, 0, 0
+        rows = [ArchivedJournalText(log_id=pk, dictionary_id=dictionary.pk, data=compress(text)) for pk, text in logs]
+        ArchivedJournalText.objects.using(database).bulk_create(
+            rows, update_conflicts=True, unique_fields=("log",), update_fields=("dictionary", "data")
+        )
+        # Not a change to the log: no signals, and updated_at stays
+        JournalLog.objects.using(database).filter(pk__in=[pk for pk, _ in logs]).update(text="", text_archived=True)
+    return logs[-1][0], len(logs), sum(len(text.encode()) for _, text in logs), sum(len(row.data) for row in rows)
+
+
+def archive(database="default", max_batches=None, retrain=False):
+    """Archive the archivable logs of a database, in batches. Yields what archive_batch returns for each."""
+    if not settings.JOURNAL_ARCHIVE_AFTER_DAYS:
+        return
+    # At least a day, the agenda never shows an archived text
+    cutoff = timezone.now() - timedelta(days=max(settings.JOURNAL_ARCHIVE_AFTER_DAYS, 1))
+    dictionary = current_dictionary(database, cutoff, retrain)
+    if dictionary is None:
+        return
+    last_id, batches = 0, 0
+    while max_batches is None or batches < max_batches:
+        last_id, *counts = archive_batch(database, cutoff, dictionary, last_id)
+        if last_id is None:
+            return
+        batches += 1
+        yield last_id, *counts
+
+
+def table_sizes(database="default"):
+    """Bytes on disk of journal_logs and of the archive, TOAST included. None on other databases than Postgres."""
+    connection = connections[database]
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_table_size(%s), pg_table_size(%s)",
+            [JournalLog._meta.db_table, ArchivedJournalText._meta.db_table],
+        )
+        return cursor.fetchone()
+
+
+@receiver(post_save, sender=JournalLog)
+def text_unarchived(sender, instance, raw=False, **kwargs):
+    # A new text was saved over an archived one
+    if not raw and instance.__dict__.pop("_unarchived", False):
+        ArchivedJournalText.objects.using(instance._state.db).filter(log_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=JournalLog)
+def archived_log_deleted(sender, instance, **kwargs):
+    if instance.__dict__.get("text_archived"):
+        ArchivedJournalText.objects.using(instance._state.db).filter(log_id=instance.pk).delete()
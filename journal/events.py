@@ -0,0 +1,216 @@
+# journal/events.py
+"""
+Server-Sent Events stream of journal changes, so a user's other devices don't need to poll.
+
+Served at EVENTS_PATH by habij.asgi. Writes record a JournalEvent and NOTIFY it in the same
+statement; each process fans the notifications out to its connected clients through one
+core.pubsub.Hub. Clients resume
+with Last-Event-ID and get a `reset` event when they have to refetch instead, after
+falling too far behind or asking for events that were already purged.
+"""
+
+import asyncio
+import io
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from corsheaders.middleware import CorsMiddleware
+from django.conf import settings
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections, transaction
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated
+
+from core.metrics import registry
+from core.pubsub import OVERFLOW, Hub
+from users.authentication import CustomJWTAuthentication
+
+from .models import JournalEvent
+
+CHANNEL = "journal_events"
+EVENTS_PATH = "/api/journal-logs/events/"
+RESET = "event: reset\ndata: {}\n\n"
+
+
+def publish(event_type, log, data):
+    """Record and announce a change to `log` once the write that made it commits."""
+    user_id, log_id = log.user_id, log.pk
+    transaction.on_commit(lambda: _publish(event_type, user_id, log_id, data), using=log._state.db)
+
+
+def _publish(event_type, user_id, log_id, data):
+    connection = connections["default"]
+    if connection.vendor != "postgresql":
+        JournalEvent.objects.using("default").create(user_id=user_id, type=event_type, log_id=log_id, data=data)
+        return
+    # One statement, the notification goes out when the insert commits
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            WITH event AS (
+                INSERT INTO {JournalEvent._meta.db_table} (user_id, type, log_id, data, created_at)
+                VALUES (%s, %s, %s, %s::jsonb, %s)
+                RETURNING id, user_id
+            )
+            SELECT pg_notify(%s, user_id || ':' || id) FROM event
+            """,
+            [user_id, event_type, log_id, json.dumps(data), timezone.now(), CHANNEL],
+        )
+
+
+class JournalEventSource:
+    def events(self, queryset):
+        return [(event.user_id, event.pk, event) for event in queryset.order_by("id")]
+
+    def load(self, ids, keys):
+        return self.events(JournalEvent.objects.using("default").filter(id__in=ids, user_id__in=keys))
+
+    def load_after(self, event_id, keys):
+        return self.events(JournalEvent.objects.using("default").filter(id__gt=event_id, user_id__in=keys))
+
+    def latest(self):
+        return JournalEvent.objects.using("default").order_by("-id").values_list("id", flat=True).first()
+
+
+hub = Hub(CHANNEL, JournalEventSource())
+
+
+def missed_events(user_id, last_id):
+    """Events after `last_id`, or None when they can't all be replayed and the client has to refetch."""
+    oldest = JournalEvent.objects.using("default").order_by("id").values_list("id", flat=True).first()
+    if oldest is not None and last_id < oldest - 1:
+        return None
+    events = list(
+        JournalEvent.objects.using("default")
+        .filter(user_id=user_id, id__gt=last_id)
+        .order_by("id")[: settings.SSE_REPLAY_LIMIT + 1]
+    )
+    return None if len(events) > settings.SSE_REPLAY_LIMIT else events
+
+
+def format_event(event):
+    return f"id: {event.pk}\nevent: {event.type}\ndata: {json.dumps(event.data, separators=(',', ':'))}\n\n"
+
+
+async def stream(user_id, last_id, expires_at):
+    subscription = hub.subscribe(user_id)
+    try:
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n"
+        if last_id is not None:
+            missed = await hub.call(missed_events, user_id, last_id)
+            if missed is None:
+                yield RESET
+                return
+            for event in missed:
+                last_id = event.pk
+                yield format_event(event)
+
+        while True:
+            timeout = min(settings.SSE_HEARTBEAT_SECONDS, expires_at - time.time())
+            if timeout <= 0:
+                # Access token expired, the client reconnects with a fresh one
+                return
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            if event is OVERFLOW:
+                yield RESET
+                return
+            if last_id is not None and event.pk <= last_id:
+                # Already sent while replaying
+                continue
+            yield format_event(event)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def authenticate(request):
+    # On a thread of the default executor, which doesn't keep its connections
+    try:
+        result = CustomJWTAuthentication().authenticate(request)
+    finally:
+        connections.close_all()
+    if result is None:
+        raise NotAuthenticated()
+    return result
+
+
+def with_cors(request, response):
+    """`response` with the headers of the project's CORS middleware, or that middleware's answer to a preflight."""
+    return CorsMiddleware(lambda request: response)(request)
+
+
+async def send_response(send, response, more_body=False):
+    headers = [(name.encode("ascii"), value.encode("latin1")) for name, value in response.items()]
+    await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+    if not more_body:
+        await send({"type": "http.response.body", "body": response.content})
+
+
+async def events_app(scope, receive, send):
+    """
+    ASGI app streaming the authenticated user's journal changes as text/event-stream:
+    `created`, `updated`, `done` and `deleted` events carrying the log, `reset` when the
+    client has to refetch.
+
+    It bypasses Django's request handling on purpose: that runs sync middleware and code
+    on a thread per request, which an open stream would hold on to along with its DB
+    connection. Authentication runs on the loop's default executor instead, off the hub's
+    thread so that reconnecting clients don't hold up delivery, and the host and CORS checks
+    of the middleware are done here.
+    """
+    request = ASGIRequest(scope, io.BytesIO())
+    try:
+        request.get_host()
+    except DisallowedHost:
+        await send_response(send, HttpResponseBadRequest())
+        return
+    if scope["method"] != "GET":
+        # Unless it's a CORS preflight
+        response = JsonResponse({"detail": f'Method "{scope["method"]}" not allowed.'}, status=405)
+        await send_response(send, with_cors(request, response))
+        return
+    try:
+        user, token = await sync_to_async(authenticate, thread_sensitive=False)(request)
+    except (AuthenticationFailed, NotAuthenticated) as exc:
+        body = exc.detail if isinstance(exc.detail, dict) else {"detail": exc.detail}
+        await send_response(send, with_cors(request, JsonResponse(body, status=401)))
+        return
+    if hub.connections >= settings.SSE_MAX_CONNECTIONS:
+        body = {"detail": "Too many open event streams, try again later."}
+        await send_response(send, with_cors(request, JsonResponse(body, status=503, headers={"Retry-After": "30"})))
+        return
+
+    last_id = request.headers.get("Last-Event-ID") or request.GET.get("last_event_id")
+    last_id = int(last_id) if last_id and last_id.isdigit() else None
+    response = HttpResponse(
+        content_type="text/event-stream",
+        # Don't let nginx buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    await send_response(send, with_cors(request, response), more_body=True)
+
+    async def write():
+        # send() waits while the client's socket buffer is full, the hub then overflows this subscription
+        async for chunk in stream(user.pk, last_id, token["exp"]):
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    registry.add_gauge("habij_sse_connections")
+    writer, watcher = asyncio.ensure_future(write()), asyncio.ensure_future(disconnected())
+    try:
+        await asyncio.wait((writer, watcher), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (writer, watcher):
+            task.cancel()
+        await asyncio.gather(writer, watcher, return_exceptions=True)
+        registry.add_gauge("habij_sse_connections", value=-1)
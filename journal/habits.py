@@ -0,0 +1,104 @@
+# journal/habits.py
+"""
+One active habit per user and normalized text (see journal.models.normalize_habit_text).
+
+Creating a habit that already exists links the new source log to the existing habit
+instead, with a single INSERT ... ON CONFLICT against the habits_user_text_uniq index.
+Habits from before the index get their hash, and their duplicates merged, with
+`manage.py merge_duplicate_habits`.
+"""
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .agenda import invalidate_agenda
+from .models import Habit, habit_text_hash
+
+
+def upsert_habit(user_id, text, source_log_id, database="default"):
+    """Create the user's habit, or point their active habit with the same text at the new log. Returns its id."""
+    connection = connections[database]
+    quote = connection.ops.quote_name
+    now = timezone.now()
+    values = {
+        "user": user_id,
+        "text": text,
+        "text_hash": habit_text_hash(text),
+        "source_log": source_log_id,
+        "created_at": now,
+        "updated_at": now,
+    }
+    fields = [Habit._meta.get_field(name) for name in values]
+    column = {field.name: quote(field.column) for field in Habit._meta.concrete_fields}
+    sql = (
+        f"INSERT INTO {quote(Habit._meta.db_table)} ({', '.join(column[name] for name in values)}) "
+        f"VALUES ({', '.join(['%s'] * len(values))}) "
+        # The partial index's condition as Django writes it, SQLite only matches it verbatim
+        f"ON CONFLICT ({column['user']}, {column['text_hash']}) "
+        f"WHERE ({column['deleted_at']} IS NULL AND NOT ({column['text_hash']} = '')) "
+        f"DO UPDATE SET {column['source_log']} = excluded.{column['source_log']}, "
+        f"{column['updated_at']} = excluded.{column['updated_at']} "
+        f"RETURNING {column['id']}"
+    )
+    params = [field.get_db_prep_save(value, connection) for field, value in zip(fields, values.values())]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        habit_id = cursor.fetchone()[0]
+    # Raw SQL skips the signals that drop the cached agenda
+    transaction.on_commit(lambda: invalidate_agenda(user_id), using=database)
+    return habit_id
+
+
+def _update(habits, database):
+    # executemany of one UPDATE per row, bulk_update's CASE expressions cost far more to build
+    connection = connections[database]
+    quote = connection.ops.quote_name
+    fields = [Habit._meta.get_field(name) for name in ("text_hash", "source_log", "deleted_at")]
+    sql = (
+        f"UPDATE {quote(Habit._meta.db_table)} SET "
+        + ", ".join(f"{quote(field.column)} = %s" for field in fields)
+        + f" WHERE {quote(Habit._meta.pk.column)} = %s"
+    )
+    params = [
+        [field.get_db_prep_save(getattr(habit, field.attname), connection) for field in fields] + [habit.pk]
+        for habit in habits
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, params)
+
+
+def merge_duplicates(user_ids, database="default"):
+    """
+    Hash the habits of these users and soft delete the duplicates among their active ones.
+
+    The oldest habit of each text is kept and linked to the newest source log of its
+    duplicates. Returns the number of habits merged away.
+    """
+    now = timezone.now()
+    with transaction.atomic(using=database):
+        habits = list(
+            Habit.objects.using(database)
+            .select_for_update()
+            .filter(user_id__in=user_ids)
+            .order_by("created_at", "id")
+            .only("id", "user_id", "text", "text_hash", "source_log_id", "deleted_at", "created_at")
+        )
+        kept, merged, rehashed = {}, [], []
+        for habit in habits:
+            habit.text_hash = habit_text_hash(habit.text)
+            if habit.deleted_at is not None:
+                rehashed.append(habit)
+                continue
+            survivor = kept.setdefault((habit.user_id, habit.text_hash), habit)
+            if survivor is habit:
+                continue
+            if habit.source_log_id is not None:
+                survivor.source_log_id = habit.source_log_id
+            habit.deleted_at = now
+            merged.append(habit)
+
+        # Duplicates leave the unique index before the survivors enter it
+        _update(merged + rehashed + list(kept.values()), database)
+        for user_id in {habit.user_id for habit in merged}:
+            transaction.on_commit(lambda user_id=user_id: invalidate_agenda(user_id), using=database)
+    return len(merged)
@@ -0,0 +1,47 @@
+# journal/management/commands/archive_journal_text.py
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from journal.archive import archive, table_sizes
+
+
+def megabytes(size):
+    return f"{size / 2**20:.1f}MB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the text of journal logs untouched for JOURNAL_ARCHIVE_AFTER_DAYS to the compressed archive, "
+        "a batch per transaction, on every shard, compressed with zstd dictionaries. Safe to run while the API serves."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-batches", type=int, help="Stop after this many batches per database")
+        parser.add_argument(
+            "--retrain", action="store_true", help="Train a new dictionary first, for the texts archived from now on"
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = 0
+        for database in settings.JOURNAL_SHARDS or ["default"]:
+            archived = original = compressed = 0
+            for last_id, count, text_bytes, data_bytes in archive(database, options["max_batches"], options["retrain"]):
+                archived += count
+                original += text_bytes
+                compressed += data_bytes
+                self.stdout.write(f"{database}: up to log {last_id}, {archived} texts archived")
+            total += archived
+            if archived:
+                self.stdout.write(
+                    f"{database}: {megabytes(original)} of text stored as {megabytes(compressed)}, "
+                    f"{compressed / original:.0%}"
+                )
+            sizes = table_sizes(database)
+            if sizes:
+                # Freed space is reused by new rows, VACUUM FULL or pg_repack give it back to the disk
+                self.stdout.write(f"{database}: journal_logs {megabytes(sizes[0])}, archive {megabytes(sizes[1])}")
+
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} journal texts in {time.perf_counter() - started:.1f}s"))
@@ -0,0 +1,70 @@
+# journal/management/commands/backfill_journal_summaries.py
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
+
+from journal.models import JournalLog
+from journal.summaries import rebuild
+
+
+def rebuild_chunk(first, last, database):
+    try:
+        return rebuild(first, last, database)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the weekly and monthly journal summaries from the full history. Users are split into "
+        "ranges of ids that worker processes rebuild in parallel, each from one grouped pass over its "
+        "users' logs, on every shard."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Processes rebuilding ranges, 1 to run inline")
+        parser.add_argument("--chunk-size", type=int, default=500, help="User ids per range")
+        parser.add_argument("--first-user", type=int, help="Only users with at least this id")
+        parser.add_argument("--last-user", type=int, help="Only users with at most this id")
+
+    def handle(self, *args, **options):
+        chunks = []
+        for database in settings.JOURNAL_SHARDS or ["default"]:
+            bounds = JournalLog._base_manager.using(database).aggregate(first=Min("user_id"), last=Max("user_id"))
+            if bounds["first"] is None:
+                continue
+            first = max(bounds["first"], options["first_user"] or 0)
+            last = min(bounds["last"], options["last_user"] or bounds["last"])
+            for lower in range(first, last + 1, options["chunk_size"]):
+                chunks.append((lower, min(lower + options["chunk_size"] - 1, last), database))
+
+        started = time.perf_counter()
+        total = 0
+        for (first, last, database), saved in self.run(chunks, options["workers"]):
+            total += saved
+            self.stdout.write(f"{database}: users {first}-{last}, {saved} summaries")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rebuilt {total} summaries in {len(chunks)} ranges in {time.perf_counter() - started:.1f}s"
+            )
+        )
+
+    def run(self, chunks, workers):
+        if workers <= 1:
+            for chunk in chunks:
+                yield chunk, rebuild(*chunk)
+            return
+        # Building the rows is CPU bound, threads would take turns on the GIL. Forked
+        # workers inherit the configured app and open their own connections.
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = {executor.submit(rebuild_chunk, *chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
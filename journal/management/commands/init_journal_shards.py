@@ -0,0 +1,39 @@
+# journal/management/commands/init_journal_shards.py
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from journal.sharding import SHARDED_MODELS
+
+# Each shard allocates ids from its own range, so rows keep their ids when moved between shards
+SHARD_ID_SPACING = 10**12
+
+
+class Command(BaseCommand):
+    help = "Move the id sequences of the journal tables on each shard into that shard's own id range"
+
+    def handle(self, *args, **options):
+        if not settings.JOURNAL_SHARDS:
+            raise CommandError("Sharding is disabled, set DB_SHARDS first")
+
+        for index, alias in enumerate(settings.JOURNAL_SHARDS):
+            if index == 0:
+                # default keeps its existing sequence
+                continue
+            connection = connections[alias]
+            start = index * SHARD_ID_SPACING
+            for model in SHARDED_MODELS:
+                table = connection.ops.quote_name(model._meta.db_table)
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+                    value = max(start, cursor.fetchone()[0])
+                    if connection.vendor == "postgresql":
+                        cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)", [table, value])
+                    elif connection.vendor == "sqlite":
+                        cursor.execute("DELETE FROM sqlite_sequence WHERE name = %s", [model._meta.db_table])
+                        cursor.execute(
+                            "INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [model._meta.db_table, value]
+                        )
+                    else:
+                        raise CommandError(f"Unsupported database vendor '{connection.vendor}' for {alias}")
+                self.stdout.write(f"{alias}: {model._meta.db_table} ids continue after {value}")
@@ -0,0 +1,41 @@
+# journal/management/commands/merge_duplicate_habits.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from journal.habits import merge_duplicates
+from journal.models import Habit
+
+
+class Command(BaseCommand):
+    help = (
+        "Hash the habits created before the duplicate check and merge each user's active habits with the "
+        "same normalized text into the oldest one, a batch of users per transaction, on every shard. "
+        "Safe to run while the API serves, and to run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="Users per transaction")
+        parser.add_argument(
+            "--all", action="store_true", help="Every user, not just those with unhashed habits (after rule changes)"
+        )
+
+    def handle(self, *args, **options):
+        total_users = total_merged = 0
+        for database in settings.JOURNAL_SHARDS or ["default"]:
+            habits = Habit._base_manager.using(database)
+            if not options["all"]:
+                habits = habits.filter(text_hash="")
+            last_user_id = 0
+            while user_ids := list(
+                habits.filter(user_id__gt=last_user_id)
+                .order_by("user_id")
+                .values_list("user_id", flat=True)
+                .distinct()[: options["batch_size"]]
+            ):
+                merged = merge_duplicates(user_ids, database)
+                total_users += len(user_ids)
+                total_merged += merged
+                last_user_id = user_ids[-1]
+                self.stdout.write(f"{database}: users {user_ids[0]}-{last_user_id}, {merged} duplicates merged")
+
+        self.stdout.write(self.style.SUCCESS(f"Checked {total_users} users, merged {total_merged} duplicate habits"))
@@ -0,0 +1,108 @@
+# journal/management/commands/rebalance_journal_shards.py
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from journal.models import Habit, JournalLog, JournalSummary
+from journal.sharding import assign_shard, freeze_journal, shard_for_user, thaw_journal
+from journal.summaries import rebuild
+
+# Longest a user's writes stay refused when a move is killed midway
+FREEZE_SECONDS = 300
+
+
+def copy_rows(model, user_id, source, target, batch_size=1000, lock=False):
+    """
+    Upsert a user's rows from source into target, keeping ids and timestamps.
+
+    Raw SQL because bulk_create would overwrite auto_now/auto_now_add values.
+    With `lock`, the source rows stay locked until the caller's transaction on source ends.
+    Returns the ids that were copied.
+    """
+    connection = connections[target]
+    quote = connection.ops.quote_name
+    fields = model._meta.concrete_fields
+    pk_column = model._meta.pk.column
+    sql = (
+        f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(quote(f.column) for f in fields)}) "
+        f"VALUES ({', '.join(['%s'] * len(fields))}) "
+        f"ON CONFLICT ({quote(pk_column)}) DO UPDATE SET "
+        + ", ".join(f"{quote(f.column)} = excluded.{quote(f.column)}" for f in fields if not f.primary_key)
+    )
+
+    queryset = model._base_manager.using(source).filter(user_id=user_id).order_by("pk")
+    if lock:
+        queryset = queryset.select_for_update()
+
+    copied = []
+    last_pk = 0
+    while batch := list(queryset.filter(pk__gt=last_pk)[:batch_size]):
+        params = [[f.get_db_prep_save(getattr(obj, f.attname), connection) for f in fields] for obj in batch]
+        with transaction.atomic(using=target), connection.cursor() as cursor:
+            cursor.executemany(sql, params)
+        copied.extend(obj.pk for obj in batch)
+        last_pk = batch[-1].pk
+    return copied
+
+
+class Command(BaseCommand):
+    help = (
+        "Move users' journal logs and habits to another shard while the API keeps serving them. "
+        "Rows are copied, then the user's journal writes are refused for a few seconds while the "
+        "copy is brought up to date and the shard map is switched, before the old rows are deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", required=True, help="User id (repeatable)")
+        parser.add_argument("--to", required=True, help="Target shard alias")
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        target = options["to"]
+        if target not in settings.JOURNAL_SHARDS:
+            raise CommandError(f"'{target}' is not a journal shard, choose from {', '.join(settings.JOURNAL_SHARDS)}")
+
+        for user_id in options["user"]:
+            source = shard_for_user(user_id, fresh=True)
+            if source == target:
+                self.stdout.write(f"User {user_id} already on {target}")
+                continue
+            self.move_user(user_id, source, target, options["batch_size"])
+
+    def move_user(self, user_id, source, target, batch_size):
+        # Logs before habits, habits reference their source log
+        copied = {model: copy_rows(model, user_id, source, target, batch_size) for model in (JournalLog, Habit)}
+        self.stdout.write(
+            f"User {user_id}: copied {len(copied[JournalLog])} logs and {len(copied[Habit])} habits to {target}"
+        )
+
+        # Long enough for every worker to see the freeze, or a shard map change, and finish requests started before
+        wait = settings.SHARD_MAP_CACHE_SECONDS + 1
+        freeze_journal(user_id, FREEZE_SECONDS)
+        try:
+            time.sleep(wait)
+            # Copied again in full: not every write moves updated_at, like archiving or merging habits.
+            # The source rows stay locked until the shard map is switched, should a late write still come.
+            with transaction.atomic(using=source):
+                for model in (JournalLog, Habit):
+                    kept = set(copy_rows(model, user_id, source, target, batch_size, lock=True))
+                    copies = set(model._base_manager.using(target).filter(user_id=user_id).values_list("pk", flat=True))
+                    # Rows deleted from the old shard after they were copied
+                    if gone := copies - kept:
+                        model._base_manager.using(target).filter(pk__in=gone).delete()
+                assign_shard(user_id, target)
+            # Workers may still route to the old shard until their copy of the shard map expires
+            time.sleep(wait)
+        finally:
+            thaw_journal(user_id)
+
+        # Archived texts were read from the archive and copied in full, the target archives them again in time
+        JournalLog._base_manager.using(target).filter(user_id=user_id, text_archived=True).update(text_archived=False)
+        # Summaries are derived, the target's are rebuilt from the moved logs instead of copied
+        rebuild(user_id, user_id, target)
+        JournalSummary._base_manager.using(source).filter(user_id=user_id).delete()
+        Habit._base_manager.using(source).filter(user_id=user_id).delete()
+        JournalLog._base_manager.using(source).filter(user_id=user_id).delete()
+        self.stdout.write(self.style.SUCCESS(f"User {user_id}: moved from {source} to {target}"))
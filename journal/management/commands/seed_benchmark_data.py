@@ -0,0 +1,116 @@
+# journal/management/commands/seed_benchmark_data.py
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from journal.models import Habit, JournalLog, UserShard, habit_text_hash
+from journal.sharding import placement_for_new_user, sharding_enabled
+from users.models import User
+
+EMAIL_FORMAT = "bench-{index}@example.com"
+WORDS = (
+    "read walk call mom water plants write journal gym stretch meditate groceries pay rent clean kitchen "
+    "study spanish practice guitar run 5k sleep early drink water review notes plan week cook dinner"
+).split()
+
+
+@contextmanager
+def keep_timestamps(*models):
+    """bulk_create would overwrite auto_now/auto_now_add, seeded rows need their spread-out timestamps."""
+    fields = [f for model in models for f in model._meta.concrete_fields if getattr(f, "auto_now_add", False)]
+    fields += [f for model in models for f in model._meta.concrete_fields if getattr(f, "auto_now", False)]
+    saved = [(f, f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, auto_now, auto_now_add in saved:
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed benchmark users with realistic journal histories: a long-tailed number of logs per user, "
+        f"mostly logs with some todos and habits, spread over past days. Users are {EMAIL_FORMAT}."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--logs-per-user", type=int, default=300, help="Median logs per user")
+        parser.add_argument("--days", type=int, default=365, help="How far back the history goes")
+        parser.add_argument("--password", default="benchmark-password")
+        parser.add_argument("--start", type=int, default=0, help="Index of the first user, to add more users later")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        now = timezone.now()
+        # One hash for everyone, hashing per user would dominate the seeding time
+        password = make_password(options["password"])
+
+        users = User.objects.bulk_create(
+            [
+                User(email=EMAIL_FORMAT.format(index=index), password=password, first_name="Bench")
+                for index in range(options["start"], options["start"] + options["users"])
+            ],
+            batch_size=options["batch_size"],
+        )
+        if sharding_enabled():
+            UserShard.objects.bulk_create(
+                [UserShard(user=user, shard=placement_for_new_user(user.pk)) for user in users]
+            )
+
+        total_logs = total_habits = 0
+        for user in users:
+            database = placement_for_new_user(user.pk) if sharding_enabled() else "default"
+            logs = self.build_logs(rng, user, now, options["logs_per_user"], options["days"])
+            with keep_timestamps(JournalLog, Habit), transaction.atomic(using=database):
+                logs = JournalLog.objects.using(database).bulk_create(logs, batch_size=options["batch_size"])
+                habits = {}
+                for log in sorted(logs, key=lambda log: log.created_at):
+                    if log.type == JournalLog.LogType.HABIT:
+                        # As journal.habits does: one habit per text, linked to its latest log
+                        habit = habits.setdefault(
+                            habit_text_hash(log.text),
+                            Habit(text=log.text, user=user, created_at=log.created_at, updated_at=now),
+                        )
+                        habit.source_log = log
+                Habit.objects.using(database).bulk_create(habits.values(), batch_size=options["batch_size"])
+            total_logs += len(logs)
+            total_habits += len(habits)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Seeded {len(users)} users, {total_logs} journal logs and {total_habits} habits")
+        )
+
+    def build_logs(self, rng, user, now, median, days):
+        # Log-normal: most users have a modest history, a few have a huge one
+        count = max(1, int(rng.lognormvariate(0, 1) * median))
+        logs = []
+        for _ in range(count):
+            created_at = now - timedelta(seconds=rng.uniform(0, days * 86400))
+            kind = rng.choices(
+                (JournalLog.LogType.LOG, JournalLog.LogType.TODO, JournalLog.LogType.HABIT), weights=(60, 30, 10)
+            )[0]
+            log = JournalLog(
+                user=user,
+                type=kind,
+                text=" ".join(rng.choices(WORDS, k=rng.randint(2, 12))),
+                created_at=created_at,
+                updated_at=created_at,
+            )
+            if kind == JournalLog.LogType.TODO:
+                log.scheduled_for = created_at + timedelta(days=rng.uniform(0, 14))
+                if log.scheduled_for < now and rng.random() < 0.7:
+                    log.done_at = log.scheduled_for
+            elif rng.random() < 0.02:
+                log.deleted_at = created_at + timedelta(days=1)
+            logs.append(log)
+        return logs
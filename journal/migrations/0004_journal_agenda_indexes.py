@@ -0,0 +1,30 @@
+# Generated by Django 5.1.15 on 2026-10-19 02:04
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("journal", "0003_journal_events"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="journallog",
+            index=models.Index(
+                condition=models.Q(("deleted_at__isnull", True)),
+                fields=["user", "type", "-created_at"],
+                name="journal_logs_user_type_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="journallog",
+            index=models.Index(
+                condition=models.Q(("deleted_at__isnull", True), ("type", "todo")),
+                fields=["user", "done_at"],
+                name="journal_logs_user_todo_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.15 on 2026-10-19 02:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("journal", "0004_journal_agenda_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JournalSummary",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("period", models.CharField(choices=[("week", "Week"), ("month", "Month")], max_length=5)),
+                ("start", models.DateField()),
+                ("logs", models.PositiveIntegerField(default=0)),
+                ("todos_created", models.PositiveIntegerField(default=0)),
+                ("todos_completed", models.PositiveIntegerField(default=0)),
+                ("habits_created", models.PositiveIntegerField(default=0)),
+                ("habit_completions", models.PositiveIntegerField(default=0)),
+                ("active_days", models.BigIntegerField(default=0)),
+                ("habit_days", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="journal_summaries",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "journal summary",
+                "verbose_name_plural": "journal summaries",
+                "db_table": "journal_summaries",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("user", "period", "start"), name="journal_summaries_user_period_uniq"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.15 on 2026-10-19 02:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+import journal.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("journal", "0005_journal_summaries"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="habit",
+            name="text_hash",
+            field=journal.models.TextHashField(blank=True, default="", max_length=32, source="text"),
+        ),
+        migrations.AddConstraint(
+            model_name="habit",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("deleted_at__isnull", True), models.Q(("text_hash", ""), _negated=True)),
+                fields=("user", "text_hash"),
+                name="habits_user_text_uniq",
+            ),
+        ),
+    ]
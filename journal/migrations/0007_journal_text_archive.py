@@ -0,0 +1,79 @@
+# Generated by Django 5.1.15 on 2026-10-19 02:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import journal.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("journal", "0006_habit_text_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="JournalTextDictionary",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("codec", models.CharField(max_length=8)),
+                ("data", models.BinaryField()),
+                ("samples", models.PositiveIntegerField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "verbose_name": "journal text dictionary",
+                "verbose_name_plural": "journal text dictionaries",
+                "db_table": "journal_text_dictionaries",
+            },
+        ),
+        migrations.AlterModelOptions(
+            name="journallog",
+            options={
+                "base_manager_name": "objects",
+                "ordering": ["-created_at"],
+                "verbose_name": "journal log",
+                "verbose_name_plural": "journal logs",
+            },
+        ),
+        migrations.AddField(
+            model_name="journallog",
+            name="text_archived",
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AlterField(
+            model_name="journallog",
+            name="text",
+            field=journal.models.ArchivableTextField(),
+        ),
+        migrations.CreateModel(
+            name="ArchivedJournalText",
+            fields=[
+                (
+                    "log",
+                    models.OneToOneField(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="archive",
+                        serialize=False,
+                        to="journal.journallog",
+                    ),
+                ),
+                ("data", models.BinaryField()),
+                (
+                    "dictionary",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="+",
+                        to="journal.journaltextdictionary",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "archived journal text",
+                "verbose_name_plural": "archived journal texts",
+                "db_table": "journal_archived_texts",
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.15 on 2026-10-19 03:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations
+
+import journal.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("journal", "0007_journal_text_archive"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="habit",
+            name="user",
+            field=journal.models.JournalUserField(
+                on_delete=django.db.models.deletion.CASCADE, related_name="habits", to=settings.AUTH_USER_MODEL
+            ),
+        ),
+        migrations.AlterField(
+            model_name="journallog",
+            name="user",
+            field=journal.models.JournalUserField(
+                on_delete=django.db.models.deletion.CASCADE, related_name="journal_logs", to=settings.AUTH_USER_MODEL
+            ),
+        ),
+        migrations.AlterField(
+            model_name="journalsummary",
+            name="user",
+            field=journal.models.JournalUserField(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="journal_summaries",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
@@ -1,34 +1,131 @@
 # journals/models.py
+import hashlib
+import unicodedata
+
+from django.conf import settings
 from django.db import models
+from django.db.models.query import ModelIterable
+from django.db.models.query_utils import DeferredAttribute
 from django.utils.translation import gettext_lazy as _
 
 from users.models import User
 
 
+class ArchivedTextDescriptor(DeferredAttribute):
+    """
+    Reads the text of an archived log from the archive on first access, see journal.archive.
+    Setting a new text brings it back into the table on save.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if value or not instance.__dict__.get("text_archived"):
+            return value
+        if "_archived_text" not in instance.__dict__:
+            # journal.archive imports the models
+            from .archive import load_archived_texts
+
+            load_archived_texts(instance.__dict__.get("_archive_batch") or [instance])
+        return instance._archived_text
+
+    def __set__(self, instance, value):
+        if value and instance.__dict__.get("text_archived"):
+            instance.text_archived = False
+            instance._unarchived = True
+        instance.__dict__[self.field.attname] = value
+
+
+class ArchivableTextField(models.TextField):
+    """TextField whose value may live in ArchivedJournalText, empty in the table while `text_archived` is set."""
+
+    descriptor_class = ArchivedTextDescriptor
+
+
+class JournalUserField(models.ForeignKey):
+    """
+    The user a journal row belongs to. Users stay on default while sharded journal rows may
+    live on another database, so the FK constraint only exists when DB_SHARDS isn't set.
+
+    Shards migrated later are created without it, and default keeps it: rows on default
+    always belong to users on default.
+    """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("db_constraint", not settings.JOURNAL_SHARDS)
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        # Decided by the settings of each database's migration, not recorded in it
+        kwargs.pop("db_constraint", None)
+        return name, path, args, kwargs
+
+
+class JournalLogQuerySet(models.QuerySet):
+    def _fetch_all(self):
+        fetched = self._result_cache is None
+        super()._fetch_all()
+        if fetched and self._iterable_class is ModelIterable:
+            # The first archived text read loads those of all the logs fetched with it
+            archived = [log for log in self._result_cache if log.__dict__.get("text_archived")]
+            for log in archived:
+                log._archive_batch = archived
+
+
 class JournalLog(models.Model):
     class LogType(models.TextChoices):
         HABIT = "habit", _("Habit")
         LOG = "log", _("Log")
         TODO = "todo", _("Todo")
 
-    text = models.TextField()
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="journal_logs")
+    text = ArchivableTextField()
+    user = JournalUserField(User, on_delete=models.CASCADE, related_name="journal_logs")
     done_at = models.DateTimeField(null=True, blank=True)
     deleted_at = models.DateTimeField(null=True, blank=True)
     type = models.CharField(max_length=5, choices=LogType.choices, default=LogType.LOG)
     scheduled_for = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # The text was moved to ArchivedJournalText
+    text_archived = models.BooleanField(default=False, editable=False)
+
+    objects = JournalLogQuerySet.as_manager()
 
     class Meta:
         verbose_name = _("journal log")
         verbose_name_plural = _("journal logs")
         db_table = "journal_logs"
+        base_manager_name = "objects"
         ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["user", "type", "-created_at"],
+                name="journal_logs_user_type_idx",
+                condition=models.Q(deleted_at__isnull=True),
+            ),
+            models.Index(
+                fields=["user", "done_at"],
+                name="journal_logs_user_todo_idx",
+                condition=models.Q(type="todo", deleted_at__isnull=True),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.get_type_display()} by {self.user.email}: {self.text[:50]}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        log = super().from_db(db, field_names, values)
+        # Compared on save, see journal.summaries
+        log._summary_state = log.summary_state()
+        return log
+
+    def summary_state(self):
+        """What the journal summaries count of this log. Deferred fields are None."""
+        return tuple(self.__dict__.get(field) for field in ("type", "created_at", "done_at", "deleted_at"))
+
     @property
     def is_deleted(self):
         return self.deleted_at is not None
@@ -38,9 +135,45 @@ class JournalLog(models.Model):
         return self.done_at is not None
 
 
+def normalize_habit_text(text):
+    """Text as compared for duplicates: case, punctuation and spacing don't matter."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = "".join(" " if unicodedata.category(char)[0] in "PZC" else char for char in text)
+    return " ".join(text.split())
+
+
+def habit_text_hash(text):
+    return hashlib.blake2b(normalize_habit_text(text).encode(), digest_size=16).hexdigest()
+
+
+class TextHashField(models.CharField):
+    """habit_text_hash of another field, set on every save including bulk_create. Empty for rows never hashed."""
+
+    def __init__(self, *args, source="text", **kwargs):
+        self.source = source
+        kwargs.setdefault("max_length", 32)
+        kwargs.setdefault("blank", True)
+        kwargs.setdefault("default", "")
+        kwargs["editable"] = False
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs["source"] = self.source
+        del kwargs["editable"]
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = habit_text_hash(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, value)
+        return value
+
+
 class Habit(models.Model):
     text = models.TextField()
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="habits")
+    # Active habits are unique per user by normalized text, see journal.habits
+    text_hash = TextHashField()
+    user = JournalUserField(User, on_delete=models.CASCADE, related_name="habits")
     source_log = models.ForeignKey(JournalLog, on_delete=models.SET_NULL, null=True, related_name="derived_habits")
     deleted_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -51,6 +184,14 @@ class Habit(models.Model):
         verbose_name_plural = _("habits")
         db_table = "habits"
         ordering = ["-created_at"]
+        constraints = [
+            # Habits from before the hash are left out until `manage.py merge_duplicate_habits` hashes them
+            models.UniqueConstraint(
+                fields=["user", "text_hash"],
+                name="habits_user_text_uniq",
+                condition=models.Q(deleted_at__isnull=True) & ~models.Q(text_hash=""),
+            )
+        ]
 
     def __str__(self):
         return f"Habit by {self.user.email}: {self.text[:50]}"
@@ -58,3 +199,117 @@ class Habit(models.Model):
     @property
     def is_deleted(self):
         return self.deleted_at is not None
+
+
+class JournalSummary(models.Model):
+    """
+    A user's journal over one week or month, kept up to date by journal.summaries.
+
+    Days are bits of `active_days` and `habit_days`, bit 0 being the period's first day.
+    """
+
+    class Period(models.TextChoices):
+        WEEK = "week", _("Week")
+        MONTH = "month", _("Month")
+
+    user = JournalUserField(User, on_delete=models.CASCADE, related_name="journal_summaries")
+    period = models.CharField(max_length=5, choices=Period.choices)
+    start = models.DateField()
+    logs = models.PositiveIntegerField(default=0)
+    todos_created = models.PositiveIntegerField(default=0)
+    todos_completed = models.PositiveIntegerField(default=0)
+    habits_created = models.PositiveIntegerField(default=0)
+    habit_completions = models.PositiveIntegerField(default=0)
+    # Days with anything created or done, and days with a habit done
+    active_days = models.BigIntegerField(default=0)
+    habit_days = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("journal summary")
+        verbose_name_plural = _("journal summaries")
+        db_table = "journal_summaries"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "period", "start"], name="journal_summaries_user_period_uniq")
+        ]
+
+    def __str__(self):
+        return f"{self.get_period_display()} of {self.start} for user {self.user_id}"
+
+
+class JournalTextDictionary(models.Model):
+    """Compression dictionary trained on journal text, stored on each journal database. Never changed once saved."""
+
+    codec = models.CharField(max_length=8)
+    data = models.BinaryField()
+    samples = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("journal text dictionary")
+        verbose_name_plural = _("journal text dictionaries")
+        db_table = "journal_text_dictionaries"
+
+    def __str__(self):
+        return f"{self.codec} dictionary {self.pk}, {len(self.data)} bytes"
+
+
+class ArchivedJournalText(models.Model):
+    """The compressed text of an old journal log, see journal.archive."""
+
+    # Deleted with its log by journal.archive, only logs archived have one
+    log = models.OneToOneField(
+        JournalLog, on_delete=models.DO_NOTHING, primary_key=True, db_constraint=False, related_name="archive"
+    )
+    dictionary = models.ForeignKey(JournalTextDictionary, on_delete=models.PROTECT, related_name="+")
+    data = models.BinaryField()
+
+    class Meta:
+        verbose_name = _("archived journal text")
+        verbose_name_plural = _("archived journal texts")
+        db_table = "journal_archived_texts"
+
+    def __str__(self):
+        return f"Archived text of log {self.log_id}"
+
+
+class UserShard(models.Model):
+    """Which database holds a user's journal, see journal.sharding. Always stored on default."""
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="journal_shard")
+    shard = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("user shard")
+        verbose_name_plural = _("user shards")
+        db_table = "journal_user_shards"
+
+    def __str__(self):
+        return f"User {self.user_id} on {self.shard}"
+
+
+class JournalEvent(models.Model):
+    """A change to a user's journal, streamed to their devices by journal.events. Always stored on default."""
+
+    class EventType(models.TextChoices):
+        CREATED = "created", _("Created")
+        UPDATED = "updated", _("Updated")
+        DONE = "done", _("Done")
+        DELETED = "deleted", _("Deleted")
+
+    # Events outlive the rows they describe and are purged by age, so no constraints
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, related_name="+", db_constraint=False)
+    type = models.CharField(max_length=7, choices=EventType.choices)
+    log_id = models.BigIntegerField()
+    data = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = _("journal event")
+        verbose_name_plural = _("journal events")
+        db_table = "journal_events"
+        indexes = [models.Index(fields=["user", "id"], name="journal_events_user_id_idx")]
+
+    def __str__(self):
+        return f"{self.type} log {self.log_id} of user {self.user_id}"
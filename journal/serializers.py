@@ -1,7 +1,8 @@
 # journals/serializers.py
 from rest_framework import serializers
 
-from .models import Habit, JournalLog
+from .models import Habit, JournalLog, JournalSummary
+from .tasks import create_habit
 
 
 class JournalLogCreateSerializer(serializers.ModelSerializer):
@@ -21,7 +22,7 @@ class JournalLogCreateSerializer(serializers.ModelSerializer):
         journal_log = JournalLog.objects.create(**validated_data)
 
         if validated_data.get("type") == JournalLog.LogType.HABIT:
-            Habit.objects.create(text=validated_data["text"], user=validated_data["user"], source_log=journal_log)
+            create_habit.enqueue(journal_log.pk, journal_log.user_id)
 
         return journal_log
 
@@ -32,16 +33,49 @@ class JournalLogListSerializer(serializers.ModelSerializer):
         fields = ("id", "text", "type", "scheduled_for", "done_at", "created_at")
 
 
-class HabitCreateSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Habit
-        fields = ("text", "source_log", "user", "id")
-        extra_kwargs = {
-            "user": {"write_only": True},
-        }
-
-
 class HabitListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Habit
         fields = ("id", "text")
+
+
+class AgendaHabitSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    text = serializers.CharField()
+    done_at = serializers.DateTimeField(allow_null=True)
+    done_today = serializers.BooleanField()
+
+
+class AgendaSerializer(serializers.Serializer):
+    date = serializers.DateField()
+    logs = JournalLogListSerializer(many=True, help_text="Logs written today")
+    todos = JournalLogListSerializer(many=True, help_text="Todos due by the end of today, open or done today")
+    habits = AgendaHabitSerializer(many=True)
+
+
+class JournalSummaryQuerySerializer(serializers.Serializer):
+    period = serializers.ChoiceField(choices=JournalSummary.Period.choices, default=JournalSummary.Period.WEEK)
+    date = serializers.DateField(required=False, help_text="Any day of the period, today by default")
+
+
+class JournalPeriodSerializer(serializers.Serializer):
+    period = serializers.ChoiceField(choices=JournalSummary.Period.choices)
+    start = serializers.DateField()
+    end = serializers.DateField(help_text="Last day of the period")
+    logs = serializers.IntegerField(help_text="Logs of any type written in the period")
+    todos_created = serializers.IntegerField()
+    todos_completed = serializers.IntegerField()
+    habits_created = serializers.IntegerField()
+    habit_completions = serializers.IntegerField()
+    active_days = serializers.IntegerField(help_text="Days with a log written or done")
+    habit_days = serializers.IntegerField(help_text="Days with a habit done")
+    habit_adherence = serializers.FloatField(
+        allow_null=True, help_text="Share of the period's days so far with a habit done, null before it starts"
+    )
+    longest_streak = serializers.IntegerField(help_text="Most consecutive active days within the period")
+    current_streak = serializers.IntegerField(help_text="Consecutive active days up to the period's end or today")
+
+
+class JournalSummarySerializer(JournalPeriodSerializer):
+    streak_change = serializers.IntegerField(help_text="Current streak compared to the previous period's")
+    previous = JournalPeriodSerializer()
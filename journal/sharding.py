@@ -0,0 +1,189 @@
+# journal/sharding.py
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.deletion import Collector
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+
+from users.models import User
+
+from .models import Habit, JournalLog, JournalSummary, UserShard
+
+SHARDED_MODELS = (JournalLog, Habit, JournalSummary)
+SHARD_KEY = "journal-shard:{user_id}"
+FROZEN_KEY = "journal-frozen:{user_id}"
+
+# User whose journal the current request works on, set by UserShardMixin
+_current_user_id = ContextVar("journal_shard_user_id", default=None)
+
+# Per-process copy of the shard map, kept for SHARD_MAP_CACHE_SECONDS so routing doesn't hit the cache per query
+_local_shards = {}
+LOCAL_SHARDS_MAX_SIZE = 10000
+
+
+def sharding_enabled():
+    return bool(settings.JOURNAL_SHARDS)
+
+
+def placement_for_new_user(user_id):
+    return settings.JOURNAL_SHARDS[user_id % len(settings.JOURNAL_SHARDS)]
+
+
+def shard_for_user(user_id, fresh=False):
+    """Database alias holding the user's journal. Users without an assignment predate sharding and stay on default."""
+    if not fresh:
+        cached = _local_shards.get(user_id)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
+    cache = caches[settings.SHARD_MAP_CACHE]
+    key = SHARD_KEY.format(user_id=user_id)
+    shard = None if fresh else cache.get(key)
+    if shard is None:
+        shard = (
+            UserShard.objects.using("default").filter(user_id=user_id).values_list("shard", flat=True).first()
+            or "default"
+        )
+        cache.set(key, shard, None)
+
+    if len(_local_shards) >= LOCAL_SHARDS_MAX_SIZE:
+        _local_shards.clear()
+    _local_shards[user_id] = (shard, time.monotonic() + settings.SHARD_MAP_CACHE_SECONDS)
+    return shard
+
+
+def assign_shard(user_id, shard):
+    # One INSERT ... ON CONFLICT, it runs in every signup
+    UserShard.objects.using("default").bulk_create(
+        [UserShard(user_id=user_id, shard=shard)],
+        update_conflicts=True,
+        unique_fields=["user"],
+        update_fields=["shard", "updated_at"],
+    )
+    caches[settings.SHARD_MAP_CACHE].set(SHARD_KEY.format(user_id=user_id), shard, None)
+    _local_shards.pop(user_id, None)
+
+
+@contextmanager
+def user_journal(user_id):
+    """Routes the journal queries in the block to the shard of the user, like UserShardMixin does for a request."""
+    token = _current_user_id.set(user_id)
+    try:
+        yield shard_for_user(user_id) if sharding_enabled() else "default"
+    finally:
+        _current_user_id.reset(token)
+
+
+class ShardNotSelected(RuntimeError):
+    """A sharded model was queried without an instance, a user context or `.using()` to pick its shard."""
+
+
+class JournalMoving(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "This journal is moving to another database, please try again in a few seconds."
+    default_code = "journal_moving"
+
+    @property
+    def wait(self):
+        # Sent as Retry-After
+        return settings.SHARD_MAP_CACHE_SECONDS + 1
+
+
+def freeze_journal(user_id, timeout):
+    """Refuse writes to the user's journal for up to `timeout` seconds, while rebalance_journal_shards moves it."""
+    caches[settings.SHARD_MAP_CACHE].set(FROZEN_KEY.format(user_id=user_id), True, timeout)
+
+
+def thaw_journal(user_id):
+    caches[settings.SHARD_MAP_CACHE].delete(FROZEN_KEY.format(user_id=user_id))
+
+
+def check_journal_writable(user_id):
+    if sharding_enabled() and caches[settings.SHARD_MAP_CACHE].get(FROZEN_KEY.format(user_id=user_id)):
+        raise JournalMoving()
+
+
+class ShardRouter:
+    """
+    Routes JournalLog, Habit and JournalSummary queries to the shard of the user they belong to.
+
+    The user comes from the model instance in the hints when there is one (saves, related
+    managers, deletes), otherwise from the context set by UserShardMixin or user_journal.
+    Queries with neither raise ShardNotSelected instead of reading default, where only the
+    journals of users that predate sharding are. Everything else falls through to the next router.
+    """
+
+    def _shard(self, model, hints):
+        if not sharding_enabled() or model not in SHARDED_MODELS:
+            return None
+
+        instance = hints.get("instance")
+        if isinstance(instance, SHARDED_MODELS) and instance._state.db:
+            return instance._state.db
+        if isinstance(instance, User):
+            user_id = instance.pk
+        else:
+            user_id = getattr(instance, "user_id", None) or _current_user_id.get()
+        if user_id is None:
+            raise ShardNotSelected(f"No shard for this {model.__name__} query, use user_journal() or .using()")
+        return shard_for_user(user_id)
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Journal rows on shards reference users on default, without FK constraints (see JournalUserField)
+        if isinstance(obj1, SHARDED_MODELS) or isinstance(obj2, SHARDED_MODELS):
+            return True
+        return None
+
+
+class UserShardMixin:
+    """
+    Routes the journal queries of a viewset to the shard of the authenticated user,
+    and refuses its writes while the user's journal is moving.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        self._shard_token = None
+        super().initial(request, *args, **kwargs)
+        if request.user.is_authenticated:
+            if request.method not in SAFE_METHODS:
+                check_journal_writable(request.user.pk)
+            self._shard_token = _current_user_id.set(request.user.pk)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if getattr(self, "_shard_token", None) is not None:
+            _current_user_id.reset(self._shard_token)
+            self._shard_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+@receiver(post_save, sender=User)
+def place_new_user(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and sharding_enabled():
+        assign_shard(instance.pk, placement_for_new_user(instance.pk))
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_journal(sender, instance, **kwargs):
+    # The delete collector only cascades within the user's database
+    if not sharding_enabled():
+        return
+    shard = shard_for_user(instance.pk, fresh=True)
+    if shard != "default":
+        # With the user as the origin, like the cascade on default, so receivers can tell
+        collector = Collector(using=shard, origin=instance)
+        for model in (JournalSummary, Habit, JournalLog):
+            collector.collect(model.objects.using(shard).filter(user_id=instance.pk))
+        collector.delete()
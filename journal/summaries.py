@@ -0,0 +1,276 @@
+# journal/summaries.py
+"""
+Weekly and monthly summaries of each user's journal, stored in JournalSummary.
+
+A log counts towards the periods of the day it was created and of the day it was done
+(local dates). Saves and deletes of JournalLog that change either day, the type or the
+deletion queue a refresh of just the affected periods of that user, which recomputes them
+from the user's logs of those periods. The days a transaction changes are merged into one
+refresh per user when it commits, and deleting a user refreshes nothing.
+`manage.py backfill_journal_summaries` builds them from the whole history; the summary
+endpoint reads a period in one lookup.
+"""
+
+import functools
+import threading
+from datetime import datetime, time, timedelta
+
+from django.db import connections, transaction
+from django.db.models import Count, Q, Value
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from users.models import User
+
+from .models import JournalLog, JournalSummary
+
+COUNTERS = ("logs", "todos_created", "todos_completed", "habits_created", "habit_completions")
+SUMMARY_FIELDS = (*COUNTERS, "active_days", "habit_days")
+
+# Days to refresh per (database, user_id), gathered until the transaction that changed them commits
+_pending = threading.local()
+
+
+def period_start(period, day):
+    if period == JournalSummary.Period.WEEK:
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def period_end(period, start):
+    """First day after the period."""
+    if period == JournalSummary.Period.WEEK:
+        return start + timedelta(days=7)
+    return (start + timedelta(days=31)).replace(day=1)
+
+
+def daily_counts(logs, created=Q(), done=Q()):
+    """
+    (user_id, day, done, logs, todos, habits) rows of how many of the logs were created and
+    done on each local day, limited by the `created` and `done` filters. Grouped by the
+    database, a user has far fewer active days than logs.
+    """
+    logs = logs.filter(deleted_at__isnull=True).order_by()
+    counts = {
+        "count": Count("pk"),
+        "todos": Count("pk", filter=Q(type=JournalLog.LogType.TODO)),
+        "habits": Count("pk", filter=Q(type=JournalLog.LogType.HABIT)),
+    }
+    columns = ("user_id", "day", "done", *counts)
+    created_counts = (
+        logs.filter(created)
+        .values("user_id", day=TruncDate("created_at"))
+        .annotate(done=Value(False), **counts)
+        .values_list(*columns)
+    )
+    done_counts = (
+        logs.filter(done, done_at__isnull=False)
+        .values("user_id", day=TruncDate("done_at"))
+        .annotate(done=Value(True), **counts)
+        .values_list(*columns)
+    )
+    return created_counts.union(done_counts, all=True)
+
+
+@functools.lru_cache(maxsize=4096)
+def _start(period, day):
+    return period_start(period, day)
+
+
+def accumulate(totals, row, periods=None):
+    """Add a daily_counts row to the summaries in `totals`, keyed by (user_id, period, start)."""
+    user_id, day, done, count, todos, habits = row
+    for period in JournalSummary.Period.values:
+        start = _start(period, day)
+        if periods is not None and (period, start) not in periods:
+            continue
+        summary = totals.get((user_id, period, start))
+        if summary is None:
+            summary = totals[user_id, period, start] = JournalSummary(user_id=user_id, period=period, start=start)
+        bit = 1 << (day - start).days
+        summary.active_days |= bit
+        if not done:
+            summary.logs += count
+            summary.todos_created += todos
+            summary.habits_created += habits
+        else:
+            summary.todos_completed += todos
+            summary.habit_completions += habits
+            if habits:
+                summary.habit_days |= bit
+
+
+def save(summaries, database):
+    JournalSummary.objects.using(database).bulk_create(
+        summaries,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=("user", "period", "start"),
+        update_fields=(*SUMMARY_FIELDS, "updated_at"),
+    )
+
+
+def _lock_users(first_user_id, last_user_id, database):
+    # Serializes refreshes and rebuilds of a user, or an older one could commit its counts last.
+    # In id order, so two rebuilds of overlapping ranges don't deadlock.
+    connection = connections[database]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(hashtext('journal_summaries:' || id)) "
+                "FROM generate_series(%s::bigint, %s::bigint) AS id ORDER BY id",
+                [first_user_id, last_user_id],
+            )
+
+
+def _lock_user(user_id, database):
+    _lock_users(user_id, user_id, database)
+
+
+def _midnight(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _ranges(periods):
+    """The periods as merged [start, end) datetime ranges."""
+    merged = []
+    for start, end in sorted((start, period_end(period, start)) for period, start in periods):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(_midnight(start), _midnight(end)) for start, end in merged]
+
+
+def refresh(user_id, days, database="default"):
+    """Recompute the weeks and months of a user that contain any of `days`."""
+    periods = {(period, period_start(period, day)) for day in days for period in JournalSummary.Period.values}
+    if not periods:
+        return
+    created, done = Q(), Q()
+    for lower, upper in _ranges(periods):
+        created |= Q(created_at__gte=lower, created_at__lt=upper)
+        done |= Q(done_at__gte=lower, done_at__lt=upper)
+
+    with transaction.atomic(using=database):
+        _lock_user(user_id, database)
+        totals = {}
+        for row in daily_counts(JournalLog.objects.using(database).filter(user_id=user_id), created, done):
+            accumulate(totals, row, periods)
+        save(list(totals.values()), database)
+
+        empty = periods - {(period, start) for _, period, start in totals}
+        if empty:
+            emptied = Q()
+            for period, start in empty:
+                emptied |= Q(period=period, start=start)
+            JournalSummary.objects.using(database).filter(emptied, user_id=user_id).delete()
+
+
+def rebuild(first_user_id, last_user_id, database="default"):
+    """Recompute every summary of the users with ids in [first_user_id, last_user_id]. Returns the number saved."""
+    users = Q(user_id__gte=first_user_id, user_id__lte=last_user_id)
+    with transaction.atomic(using=database):
+        _lock_users(first_user_id, last_user_id, database)
+        totals = {}
+        for row in daily_counts(JournalLog.objects.using(database).filter(users)).iterator(chunk_size=5000):
+            accumulate(totals, row)
+        JournalSummary.objects.using(database).filter(users).delete()
+        save(list(totals.values()), database)
+    return len(totals)
+
+
+def _streaks(active_days, length):
+    """Longest run of active days, and the run ending on the last of `length` days."""
+    longest = current = 0
+    for index in range(length):
+        current = current + 1 if active_days >> index & 1 else 0
+        longest = max(longest, current)
+    return longest, current
+
+
+def _describe(summary, period, start, today):
+    """The summary as the endpoint shows it, and whether its current streak runs back to the period's start."""
+    end = period_end(period, start)
+    length = (end - start).days
+    elapsed = min(max((today - start).days + 1, 0), length)
+    active_days = summary.active_days if summary else 0
+    habit_days = summary.habit_days if summary else 0
+
+    longest, current = _streaks(active_days, elapsed)
+    last = elapsed
+    if current == 0 and start <= today < end:
+        # A streak isn't broken before the day is over
+        last = elapsed - 1
+        current = _streaks(active_days, last)[1]
+
+    return {
+        "period": period,
+        "start": start,
+        "end": end - timedelta(days=1),
+        **{field: getattr(summary, field, 0) for field in COUNTERS},
+        "active_days": active_days.bit_count(),
+        "habit_days": habit_days.bit_count(),
+        "habit_adherence": round(habit_days.bit_count() / elapsed, 3) if elapsed else None,
+        "longest_streak": longest,
+        "current_streak": current,
+    }, elapsed > 0 and current == last
+
+
+def get_summary(user_id, period, day=None):
+    """
+    The user's summary of the week or month containing `day`, with the one before it.
+
+    A current streak that runs back to the start of the period continues into the
+    previous one, streaks are not followed further back than that.
+    """
+    today = timezone.localdate()
+    start = period_start(period, day or today)
+    previous_start = period_start(period, start - timedelta(days=1))
+    rows = {
+        summary.start: summary
+        for summary in JournalSummary.objects.filter(user_id=user_id, period=period, start__in=(start, previous_start))
+    }
+    summary, continues = _describe(rows.get(start), period, start, today)
+    previous, _ = _describe(rows.get(previous_start), period, previous_start, today)
+    if continues:
+        summary["current_streak"] += previous["current_streak"]
+    summary["streak_change"] = summary["current_streak"] - previous["current_streak"]
+    summary["previous"] = previous
+    return summary
+
+
+def _enqueue_refresh(key):
+    days = _pending.days.pop(key, None)
+    if days:
+        from .tasks import refresh_journal_summaries
+
+        refresh_journal_summaries.enqueue(key[1], sorted(days))
+
+
+@receiver(post_save, sender=JournalLog)
+@receiver(post_delete, sender=JournalLog)
+def log_changed(sender, instance, signal, created=False, raw=False, origin=None, **kwargs):
+    if raw or isinstance(origin, User):
+        # The user's summaries are deleted along with them
+        return
+    loaded = getattr(instance, "_summary_state", None)
+    current = instance.summary_state()
+    if signal is post_save and not created and loaded == current:
+        # Text edits don't change any summary
+        return
+    instance._summary_state = current
+    days = set()
+    for state in (loaded, current):
+        for value in (state or ())[1:3]:
+            if value is not None:
+                days.add(timezone.localdate(value).isoformat())
+    if days:
+        key = (instance._state.db, instance.user_id)
+        if not hasattr(_pending, "days"):
+            _pending.days = {}
+        _pending.days.setdefault(key, set()).update(days)
+        # Every change registers a callback, the first to run after the commit enqueues the merged days
+        transaction.on_commit(functools.partial(_enqueue_refresh, key), using=instance._state.db)
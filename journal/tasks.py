@@ -0,0 +1,49 @@
+# journal/tasks.py
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.tasks import task
+
+from .archive import archive
+from .models import JournalEvent, JournalLog
+from .sharding import check_journal_writable, shard_for_user, sharding_enabled
+from .summaries import refresh
+
+
+@task
+def create_habit(log_id, user_id):
+    """Create the habit of a journal log created as a habit, or link the log to the user's habit of the same text."""
+    # Retried once the journal has moved
+    check_journal_writable(user_id)
+    database = shard_for_user(user_id) if sharding_enabled() else "default"
+    log = JournalLog.objects.using(database).filter(pk=log_id, type=JournalLog.LogType.HABIT).first()
+    if log is None:
+        # Deleted or changed type since
+        return
+    # At the top, journal.agenda -> serializers -> tasks -> habits would import in a cycle
+    from .habits import upsert_habit
+
+    upsert_habit(user_id, log.text, log.pk, database)
+
+
+@task
+def purge_journal_events():
+    cutoff = timezone.now() - timedelta(hours=settings.JOURNAL_EVENT_RETENTION_HOURS)
+    JournalEvent.objects.using("default").filter(created_at__lt=cutoff).delete()
+
+
+@task
+def archive_journal_text():
+    """Move old journal text to the compressed archive, a bounded number of batches per database per run."""
+    for database in settings.JOURNAL_SHARDS or ["default"]:
+        for _ in archive(database, max_batches=settings.JOURNAL_ARCHIVE_BATCHES_PER_RUN):
+            pass
+
+
+@task
+def refresh_journal_summaries(user_id, days):
+    """Recompute the weeks and months of a user's journal summaries that contain the ISO dates in `days`."""
+    database = shard_for_user(user_id) if sharding_enabled() else "default"
+    refresh(user_id, [date.fromisoformat(day) for day in days], database)
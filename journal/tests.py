@@ -1 +1,399 @@
-# Create your tests here.
+import asyncio
+import zlib
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+import zstandard
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from core.models import Task
+from core.pubsub import Hub
+from core.tasks import TASKS
+from core.testing import Budget, IsolatedStoresMixin, QueryBudgetTestCase
+from users.models import User
+
+from . import archive, events
+from .models import ArchivedJournalText, Habit, JournalEvent, JournalLog, JournalSummary, JournalTextDictionary
+from .sharding import _local_shards, assign_shard, user_journal
+from .summaries import rebuild
+from .tasks import refresh_journal_summaries
+
+
+class JournalLogQueryBudgetTests(QueryBudgetTestCase):
+    budgets = {
+        "list": Budget("GET", "/api/journal-logs/", queries=2, max_bytes=12000),
+        "list_by_type": Budget("GET", "/api/journal-logs/?type=todo", queries=2, max_bytes=4500),
+        "list_by_date": Budget("GET", "/api/journal-logs/?date={today}", queries=2, max_bytes=12000),
+        "retrieve": Budget("GET", "/api/journal-logs/{log}/", queries=2, max_bytes=500),
+        "create": Budget("POST", "/api/journal-logs/", queries=4, data={"text": "new", "type": "log"}, status=201),
+        "create_habit": Budget(
+            "POST", "/api/journal-logs/", queries=5, data={"text": "new", "type": "habit"}, status=201
+        ),
+        "update": Budget("PUT", "/api/journal-logs/{log}/", queries=4, data={"text": "edited", "type": "log"}),
+        "partial_update": Budget("PATCH", "/api/journal-logs/{log}/", queries=4, data={"text": "edited"}),
+        "destroy": Budget("DELETE", "/api/journal-logs/{log}/", queries=6, status=204),
+        "done": Budget("POST", "/api/journal-logs/{todo}/done/", queries=5),
+        "agenda": Budget("GET", "/api/journal-logs/agenda/", queries=3, max_bytes=9000),
+        "summary": Budget("GET", "/api/journal-logs/summary/?period=month", queries=2, max_bytes=1000),
+        "habitize": Budget("POST", "/api/journal-logs/{log}/habitize/", queries=7, max_bytes=1000, status=201),
+    }
+
+    def dataset(self, size):
+        user = User.objects.create_user(f"journal-{size}@example.com", "password")
+        now = timezone.now()
+        with user_journal(user.pk):
+            logs = JournalLog.objects.bulk_create(
+                [JournalLog(user=user, text=f"log {index}") for index in range(size)]
+                + [
+                    JournalLog(user=user, text=f"todo {index}", type=JournalLog.LogType.TODO, scheduled_for=now)
+                    for index in range(size)
+                ]
+                + [JournalLog(user=user, text=f"habit {index}", type=JournalLog.LogType.HABIT) for index in range(size)]
+            )
+            Habit.objects.bulk_create(
+                [
+                    Habit(user=user, text=log.text, source_log=log)
+                    for log in logs
+                    if log.type == JournalLog.LogType.HABIT
+                ]
+            )
+        # Someone else's data must not show up, or cost queries
+        other = User.objects.create_user(f"other-{size}@example.com", "password")
+        with user_journal(other.pk):
+            JournalLog.objects.bulk_create([JournalLog(user=other, text="other") for _ in range(size)])
+
+        return {
+            "user": user,
+            "today": (now - timedelta(minutes=1)).date().isoformat(),
+            "log": logs[0].pk,
+            "todo": logs[size].pk,
+        }
+
+    def test_agenda_is_cached_until_the_journal_changes(self):
+        fixtures = self.dataset(2)
+        self.authenticate(fixtures["user"])
+        first = self.client.get("/api/journal-logs/agenda/").json()
+        self.assertEqual((len(first["logs"]), len(first["todos"]), len(first["habits"])), (2, 2, 2))
+
+        # Authentication only
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get("/api/journal-logs/agenda/").json(), first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/api/journal-logs/{fixtures['todo']}/done/")
+        todos = self.client.get("/api/journal-logs/agenda/").json()["todos"]
+        self.assertIsNotNone(next(todo for todo in todos if todo["id"] == fixtures["todo"])["done_at"])
+
+    def test_summaries_follow_journal_writes(self):
+        fixtures = self.dataset(2)
+        user = fixtures["user"]
+        # Seeded rows bypass the signals
+        with user_journal(user.pk) as database:
+            rebuild(user.pk, user.pk, database)
+        self.authenticate(user)
+        week = self.client.get("/api/journal-logs/summary/").json()
+        self.assertEqual((week["logs"], week["todos_created"], week["habits_created"]), (6, 2, 2))
+        self.assertEqual((week["active_days"], week["current_streak"]), (1, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/api/journal-logs/{fixtures['todo']}/done/")
+            self.client.post("/api/journal-logs/", {"text": "new", "type": "log"})
+            self.client.delete(f"/api/journal-logs/{fixtures['log']}/")
+        # Run by the task workers
+        for task in Task.objects.filter(name="journal.tasks.refresh_journal_summaries"):
+            TASKS[task.name](*task.args, **task.kwargs)
+
+        month = self.client.get("/api/journal-logs/summary/?period=month").json()
+        self.assertEqual((month["logs"], month["todos_completed"]), (6, 1))
+        self.assertEqual(JournalSummary.objects.using(database).filter(user=user).count(), 2)
+        self.assertEqual(self.client.get("/api/journal-logs/summary/?period=year").status_code, 400)
+
+    def test_summary_refreshes_are_merged_per_transaction(self):
+        user = self.dataset(1)["user"]
+        with mock.patch.object(refresh_journal_summaries, "enqueue") as enqueue:
+            with user_journal(user.pk) as database, self.captureOnCommitCallbacks(using=database, execute=True):
+                JournalLog.objects.create(user=user, text="one")
+                JournalLog.objects.create(user=user, text="two")
+            enqueue.assert_called_once_with(user.pk, [timezone.localdate().isoformat()])
+
+            # The summaries go with the user
+            with self.captureOnCommitCallbacks(using=database, execute=True):
+                user.delete()
+            enqueue.assert_called_once()
+
+    def test_habits_are_deduplicated_by_normalized_text(self):
+        fixtures = self.dataset(1)
+        user = fixtures["user"]
+        self.authenticate(user)
+        first = self.client.post("/api/journal-logs/", {"text": "Drink  water!", "type": "log"}).json()
+        second = self.client.post("/api/journal-logs/", {"text": "drink water", "type": "log"}).json()
+        self.client.post(f"/api/journal-logs/{first['id']}/habitize/")
+        habits = self.client.post(f"/api/journal-logs/{second['id']}/habitize/").json()
+
+        self.assertEqual([habit["text"] for habit in habits].count("Drink  water!"), 1)
+        self.assertNotIn("drink water", [habit["text"] for habit in habits])
+        with user_journal(user.pk) as database:
+            self.assertEqual(Habit.objects.get(user=user, text="Drink  water!").source_log_id, second["id"])
+
+            # Habits from before the hash are merged by the command, into the oldest
+            legacy = []
+            for text, source_log_id in (("Read", fixtures["log"]), ("read.", second["id"])):
+                legacy.append(Habit.objects.create(user=user, text=text, source_log_id=source_log_id))
+                Habit.objects.filter(pk=legacy[-1].pk).update(text_hash="")
+        call_command("merge_duplicate_habits", stdout=StringIO())
+        active = Habit.objects.using(database).filter(user=user, deleted_at__isnull=True)
+        self.assertEqual(active.filter(text__in=("Read", "read.")).get().pk, legacy[0].pk)
+        self.assertEqual(active.get(pk=legacy[0].pk).source_log_id, second["id"])
+        self.assertFalse(active.filter(text_hash="").exists())
+
+    def test_old_text_moves_to_the_archive(self):
+        fixtures = self.dataset(3)
+        user = fixtures["user"]
+        old = timezone.now() - timedelta(days=365)
+        with user_journal(user.pk) as database:
+            # zstd needs more texts to train on than the dataset has
+            samples = [f"log {index}, written a long time ago" for index in range(archive.MIN_TRAINING_SAMPLES)]
+            JournalTextDictionary.objects.using(database).create(
+                codec=archive.CODEC, data=archive.train(samples), samples=len(samples)
+            )
+            for log in JournalLog.objects.filter(user=user):
+                JournalLog.objects.filter(pk=log.pk).update(text=f"{log.text}, written a long time ago", updated_at=old)
+        call_command("archive_journal_text", stdout=StringIO())
+
+        # Open todos stay in the table, the agenda shows them
+        logs = JournalLog.objects.using(database)
+        archived = logs.filter(user=user, text_archived=True)
+        self.assertEqual(archived.count(), 6)
+        self.assertFalse(archived.exclude(text="").exists())
+        self.assertEqual(ArchivedJournalText.objects.using(database).count(), 6)
+
+        self.authenticate(user)
+        # One query more for all the archived texts of the page
+        with self.assertNumQueries(3):
+            texts = [log["text"] for log in self.client.get("/api/journal-logs/").json()]
+        self.assertEqual(len(texts), 9)
+        self.assertTrue(all(text.endswith(", written a long time ago") for text in texts))
+        self.assertEqual(logs.get(pk=fixtures["log"]).text, "log 0, written a long time ago")
+
+        # A new text goes back to the table
+        self.client.patch(f"/api/journal-logs/{fixtures['log']}/", {"text": "rewritten"})
+        log = logs.get(pk=fixtures["log"])
+        self.assertEqual((log.text, log.text_archived), ("rewritten", False))
+        self.assertFalse(ArchivedJournalText.objects.using(database).filter(log=log).exists())
+
+        deleted = archived.first()
+        self.client.delete(f"/api/journal-logs/{deleted.pk}/")
+        self.assertFalse(ArchivedJournalText.objects.using(database).filter(log_id=deleted.pk).exists())
+
+
+class JournalArchiveCodecTests(SimpleTestCase):
+    samples = [f"Day {index}: walked the dog, read a chapter and drank water" for index in range(1000)]
+
+    def test_texts_round_trip_through_zstd(self):
+        dictionary = zstandard.ZstdCompressionDict(archive.train(self.samples))
+        compress = archive.compressor(dictionary)
+        for text in ("Day 1001: walked the dog", "Something else entirely, ünïcode too"):
+            data = compress(text)
+            self.assertEqual(archive.decompress("zstd", dictionary, data), text)
+        self.assertLess(len(compress(self.samples[0])), len(self.samples[0]) // 2)
+
+    def test_zlib_archives_stay_readable(self):
+        dictionary = b" walked the dog, read a chapter and drank water"
+        deflate = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=dictionary)
+        data = deflate.compress(self.samples[0].encode()) + deflate.flush()
+        self.assertEqual(archive.decompress("zlib", dictionary, data), self.samples[0])
+
+
+@skipUnless(len(settings.JOURNAL_SHARDS) > 1, "Set DB_SHARDS to test sharding")
+class JournalShardTests(QueryBudgetTestCase):
+    databases = {"default", *settings.JOURNAL_SHARDS}
+
+    def setUp(self):
+        super().setUp()
+        # Test databases reuse user ids
+        _local_shards.clear()
+        call_command("init_journal_shards", stdout=StringIO())
+
+    def dataset(self, size):
+        user = User.objects.create_user(f"sharded-{size}@example.com", "password")
+        assign_shard(user.pk, "shard_1")
+        logs = JournalLog.objects.using("shard_1").bulk_create(
+            [JournalLog(user=user, text=f"habit {index}", type=JournalLog.LogType.HABIT) for index in range(size)]
+        )
+        Habit.objects.using("shard_1").bulk_create([Habit(user=user, text=log.text, source_log=log) for log in logs])
+        return {"user": user, "log": logs[0].pk}
+
+    def test_journal_lives_on_the_users_shard(self):
+        fixtures = self.dataset(2)
+        self.authenticate(fixtures["user"])
+        created = self.client.post("/api/journal-logs/", {"text": "new", "type": "log"}).json()
+
+        self.assertTrue(JournalLog.objects.using("shard_1").filter(pk=created["id"]).exists())
+        self.assertFalse(JournalLog.objects.using("default").filter(user=fixtures["user"]).exists())
+        self.assertEqual(len(self.client.get("/api/journal-logs/").json()), 3)
+
+    def test_rebalance_brings_writes_during_the_move_over(self):
+        fixtures = self.dataset(3)
+        user = fixtures["user"]
+        self.authenticate(user)
+        deleted_at = timezone.now()
+        frozen = []
+
+        def during_move(seconds):
+            if frozen:
+                return
+            response = self.client.post("/api/journal-logs/", {"text": "new", "type": "log"})
+            frozen.append((response.status_code, response.headers.get("Retry-After")))
+            # Writes that got in before the freeze, one of them not moving updated_at
+            Habit.objects.using("shard_1").filter(source_log_id=fixtures["log"]).update(deleted_at=deleted_at)
+            JournalLog.objects.using("shard_1").filter(user=user).exclude(pk=fixtures["log"]).first().delete()
+
+        with mock.patch("journal.management.commands.rebalance_journal_shards.time.sleep", side_effect=during_move):
+            call_command("rebalance_journal_shards", user=[user.pk], to="default", stdout=StringIO())
+
+        self.assertEqual(frozen, [(503, str(settings.SHARD_MAP_CACHE_SECONDS + 1))])
+        self.assertFalse(JournalLog.objects.using("shard_1").filter(user=user).exists())
+        self.assertFalse(Habit.objects.using("shard_1").filter(user=user).exists())
+        self.assertEqual(JournalLog.objects.using("default").filter(user=user).count(), 2)
+        self.assertEqual(Habit.objects.using("default").get(source_log_id=fixtures["log"]).deleted_at, deleted_at)
+
+        # Writable again, on the new shard
+        created = self.client.post("/api/journal-logs/", {"text": "new", "type": "log"})
+        self.assertEqual(created.status_code, 201)
+        self.assertTrue(JournalLog.objects.using("default").filter(pk=created.json()["id"]).exists())
+
+
+class EventStream:
+    """A request to the event stream app, read as it arrives."""
+
+    def __init__(self, method="GET", headers=None):
+        headers = {"host": "testserver", **(headers or {})}
+        self.scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": events.EVENTS_PATH,
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+            "server": ("testserver", 80),
+            "client": ("127.0.0.1", 50000),
+        }
+        self.status, self.headers, self.body = None, {}, ""
+        self.closed = asyncio.Event()
+
+    async def receive(self):
+        await self.closed.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            self.headers = {name.decode().lower(): value.decode() for name, value in message["headers"]}
+        else:
+            self.body += message.get("body", b"").decode()
+
+    async def until(self, text, timeout=5):
+        async def arrived():
+            while text not in self.body:
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(arrived(), timeout)
+
+    def open(self):
+        return asyncio.ensure_future(events.events_app(self.scope, self.receive, self.send))
+
+
+@override_settings(SSE_POLL_INTERVAL=0.01)
+class JournalEventStreamTests(IsolatedStoresMixin, TransactionTestCase):
+    databases = {"default", *settings.JOURNAL_SHARDS}
+
+    def setUp(self):
+        super().setUp()
+        self.hub = Hub(events.CHANNEL, events.JournalEventSource())
+        patcher = mock.patch.object(events, "hub", self.hub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.hub.executor.shutdown)
+        self.addCleanup(lambda: self.hub.executor.submit(connections.close_all).result())
+        self.user = User.objects.create_user("events@example.com", "password")
+        self.headers = {"authorization": f"Bearer {AccessToken.for_user(self.user)}"}
+
+    def write(self, text):
+        with user_journal(self.user.pk) as database, transaction.atomic(using=database):
+            log = JournalLog.objects.create(user=self.user, text=text)
+            events.publish(JournalEvent.EventType.CREATED, log, {"id": log.pk, "text": text})
+        return JournalEvent.objects.get(log_id=log.pk)
+
+    async def stop(self, *streams):
+        for stream in streams:
+            stream.closed.set()
+        await asyncio.gather(*(stream.task for stream in streams))
+        if self.hub.task is not None:
+            self.hub.task.cancel()
+            await asyncio.gather(self.hub.task, return_exceptions=True)
+
+    def test_publish_records_the_event_once_committed(self):
+        with user_journal(self.user.pk) as database, transaction.atomic(using=database):
+            log = JournalLog.objects.create(user=self.user, text="new")
+            events.publish(JournalEvent.EventType.CREATED, log, {"id": log.pk})
+            self.assertFalse(JournalEvent.objects.exists())
+        event = JournalEvent.objects.get()
+        self.assertEqual((event.user_id, event.log_id, event.data), (self.user.pk, log.pk, {"id": log.pk}))
+
+    async def test_streams_changes_as_they_commit(self):
+        other = await sync_to_async(User.objects.create_user)("other-events@example.com", "password")
+        stream = EventStream(headers=self.headers)
+        stream.task = stream.open()
+        await stream.until("retry:")
+        await sync_to_async(JournalLog(user=other, text="someone else's").save)()
+        event = await sync_to_async(self.write)("hello")
+        await stream.until(f"id: {event.pk}\n")
+        await self.stop(stream)
+
+        self.assertEqual((stream.status, stream.headers["content-type"]), (200, "text/event-stream"))
+        self.assertIn(f'id: {event.pk}\nevent: created\ndata: {{"id":{event.log_id},"text":"hello"}}', stream.body)
+        self.assertNotIn("someone else's", stream.body)
+
+    async def test_replays_events_after_the_last_event_id(self):
+        first, second = [await sync_to_async(self.write)(text) for text in ("first", "second")]
+        stream = EventStream(headers={**self.headers, "last-event-id": str(first.pk)})
+        stream.task = stream.open()
+        await stream.until(f"id: {second.pk}\n")
+        await self.stop(stream)
+        self.assertNotIn(f"id: {first.pk}\n", stream.body)
+
+        # Purged since, the client has to refetch
+        await sync_to_async(JournalEvent.objects.filter(pk=first.pk).delete)()
+        stream = EventStream(headers={**self.headers, "last-event-id": "0"})
+        stream.task = stream.open()
+        await stream.until("event: reset")
+        await self.stop(stream)
+
+    async def test_checks_the_host_and_cors_like_the_api(self):
+        stream = EventStream(headers={"host": "attacker.example"})
+        await events.events_app(stream.scope, stream.receive, stream.send)
+        self.assertEqual(stream.status, 400)
+
+        origin = {"origin": settings.CORS_ALLOWED_ORIGINS[0]}
+        stream = EventStream(headers=origin)
+        await events.events_app(stream.scope, stream.receive, stream.send)
+        self.assertEqual((stream.status, stream.headers["access-control-allow-origin"]), (401, origin["origin"]))
+
+        preflight = EventStream("OPTIONS", headers={**origin, "access-control-request-method": "GET"})
+        await events.events_app(preflight.scope, preflight.receive, preflight.send)
+        self.assertEqual(preflight.status, 200)
+        self.assertIn("GET", preflight.headers["access-control-allow-methods"])
+
+        stream = EventStream(headers={"origin": "https://attacker.example"})
+        await events.events_app(stream.scope, stream.receive, stream.send)
+        self.assertNotIn("access-control-allow-origin", stream.headers)
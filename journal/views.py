@@ -8,13 +8,24 @@ from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from .models import Habit, JournalLog
+from core.idempotency import idempotent
+from core.mixins import ReplicaReadMixin
+from core.throttling import WriteAccountRateThrottle
+
+from .agenda import get_agenda
+from .events import publish
+from .habits import upsert_habit
+from .models import Habit, JournalEvent, JournalLog
 from .serializers import (
-    HabitCreateSerializer,
+    AgendaSerializer,
     HabitListSerializer,
     JournalLogCreateSerializer,
     JournalLogListSerializer,
+    JournalSummaryQuerySerializer,
+    JournalSummarySerializer,
 )
+from .sharding import UserShardMixin
+from .summaries import get_summary
 
 
 class JournalLogFilter(filters.FilterSet):
@@ -26,11 +37,19 @@ class JournalLogFilter(filters.FilterSet):
         fields = ["date", "type"]
 
 
-class JournalLogViewSet(viewsets.ModelViewSet):
+class JournalLogViewSet(ReplicaReadMixin, UserShardMixin, viewsets.ModelViewSet):
+    write_actions = ("create", "update", "partial_update", "destroy", "mark_as_done", "create_habit_from_journal")
+    # Summaries are refreshed in the background anyway, replication lag doesn't matter to them
+    replica_actions = ("list", "retrieve", "summary")
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend]
     filterset_class = JournalLogFilter
 
+    def get_throttles(self):
+        if self.action in self.write_actions:
+            return [WriteAccountRateThrottle()]
+        return super().get_throttles()
+
     def get_serializer_class(self):
         if self.action == "create":
             return JournalLogCreateSerializer
@@ -44,12 +63,23 @@ class JournalLogViewSet(viewsets.ModelViewSet):
         description="Create a new journal log entry. If type is 'todo', scheduled_for is required",
         responses={201: JournalLogListSerializer},
     )
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         journal_log = serializer.save(user=request.user)
+        data = JournalLogListSerializer(journal_log).data
+        publish(JournalEvent.EventType.CREATED, journal_log, data)
+
+        return Response(data, status=status.HTTP_201_CREATED)
 
-        return Response(JournalLogListSerializer(journal_log).data, status=status.HTTP_201_CREATED)
+    def perform_update(self, serializer):
+        journal_log = serializer.save()
+        publish(JournalEvent.EventType.UPDATED, journal_log, JournalLogListSerializer(journal_log).data)
+
+    def perform_destroy(self, instance):
+        publish(JournalEvent.EventType.DELETED, instance, {"id": instance.pk})
+        instance.delete()
 
     @extend_schema(
         summary="List journal logs",
@@ -68,19 +98,47 @@ class JournalLogViewSet(viewsets.ModelViewSet):
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
+    @extend_schema(
+        summary="Today's agenda",
+        description="Today's logs, the todos due by the end of today and the active habits with their completion",
+        responses={200: AgendaSerializer},
+    )
+    @action(detail=False, methods=["get"], url_path="agenda")
+    def agenda(self, request):
+        return Response(get_agenda(request.user.pk))
+
+    @extend_schema(
+        summary="Weekly or monthly summary",
+        description=(
+            "Counts, habit adherence and streaks of the week (from Monday) or month containing the date, "
+            "with the previous period's for comparison. Updated shortly after each journal change"
+        ),
+        parameters=[JournalSummaryQuerySerializer],
+        responses={200: JournalSummarySerializer},
+    )
+    @action(detail=False, methods=["get"], url_path="summary")
+    def summary(self, request):
+        query = JournalSummaryQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        summary = get_summary(request.user.pk, query.validated_data["period"], query.validated_data.get("date"))
+        return Response(JournalSummarySerializer(summary).data)
+
     @extend_schema(
         summary="Mark journal log as done",
         description="Update the done_at field of a journal log to the current date and time.",
         responses={200: JournalLogListSerializer},
     )
     @action(detail=True, methods=["post"], url_path="done")
+    @idempotent
     def mark_as_done(self, _, pk=None):
         try:
             journal_log = self.get_queryset().get(pk=pk)
             if journal_log.done_at is None:
                 journal_log.done_at = timezone.now()
                 journal_log.save()
-                return Response(JournalLogListSerializer(journal_log).data, status=status.HTTP_200_OK)
+                data = JournalLogListSerializer(journal_log).data
+                publish(JournalEvent.EventType.DONE, journal_log, data)
+                return Response(data, status=status.HTTP_200_OK)
             else:
                 return Response({"detail": "Log is already marked as done."}, status=status.HTTP_400_BAD_REQUEST)
         except JournalLog.DoesNotExist:
@@ -92,6 +150,7 @@ class JournalLogViewSet(viewsets.ModelViewSet):
         responses={200: JournalLogListSerializer},
     )
     @action(detail=True, methods=["post"], url_path="habitize")
+    @idempotent
     def create_habit_from_journal(self, request, pk=None):
         try:
             journal = self.get_queryset().get(pk=pk)
@@ -99,17 +158,12 @@ class JournalLogViewSet(viewsets.ModelViewSet):
                 return Response({"detail": "This log is already a habit"}, status=status.HTTP_400_BAD_REQUEST)
             else:
                 journal.type = JournalLog.LogType.HABIT
-
-                temp_habit_data = {"text": journal.text, "source_log": journal.id, "user": request.user.id}
-
-                serializer = HabitCreateSerializer(data=temp_habit_data, context={"request": request})
-
-                serializer.is_valid(raise_exception=True)
-
                 journal.save()
-                serializer.save()
+                # Links the log to the user's habit of the same text when there is one
+                upsert_habit(request.user.pk, journal.text, journal.pk, journal._state.db)
+                publish(JournalEvent.EventType.UPDATED, journal, JournalLogListSerializer(journal).data)
 
-                habits = Habit.objects.filter(user=request.user, deleted_at__isnull=True)
+                habits = Habit.objects.filter(user=request.user, deleted_at__isnull=True).only("id", "text")
                 habits_serializer = HabitListSerializer(habits, many=True)
 
                 return Response(habits_serializer.data, status=status.HTTP_201_CREATED)
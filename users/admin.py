@@ -3,15 +3,16 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _
 
+from core.admin_base import LargeTableAdmin
+
 from .models import User
 
 
 @admin.register(User)
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(LargeTableAdmin, UserAdmin):
     list_display = ("email", "first_name", "last_name", "phone_number", "is_active", "is_staff", "created_at")
     list_filter = ("is_active", "is_staff", "is_superuser", "created_at")
     search_fields = ("email", "first_name", "last_name", "phone_number")
-    ordering = ("-created_at",)
 
     fieldsets = (
         (None, {"fields": ("email", "password")}),
@@ -0,0 +1,72 @@
+# users/hashers.py
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, ScryptPasswordHasher
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """Argon2id with costs taken from settings; changing them rehashes users on their next login."""
+
+    time_cost = settings.ARGON2_TIME_COST
+    memory_cost = settings.ARGON2_MEMORY_COST
+    parallelism = settings.ARGON2_PARALLELISM
+
+
+class TunedScryptPasswordHasher(ScryptPasswordHasher):
+    """Scrypt with costs taken from settings; changing them rehashes users on their next login."""
+
+    work_factor = settings.SCRYPT_WORK_FACTOR
+    block_size = settings.SCRYPT_BLOCK_SIZE
+    parallelism = settings.SCRYPT_PARALLELISM
+    # hashlib's 32 MiB default is too small for anything above the Django defaults
+    maxmem = 256 * settings.SCRYPT_WORK_FACTOR * settings.SCRYPT_BLOCK_SIZE * 2
+
+
+class PasswordHashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Server is busy, please try again shortly."
+    default_code = "password_hashing_busy"
+
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool, _slots
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _slots = threading.BoundedSemaphore(
+                    settings.PASSWORD_HASHING_WORKERS + settings.PASSWORD_HASHING_QUEUE_SIZE
+                )
+                _pool = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASHING_WORKERS,
+                    thread_name_prefix="password-hasher",
+                )
+    return _pool, _slots
+
+
+def run_hasher(func, *args, **kwargs):
+    """
+    Run a CPU-bound hashing call on the bounded hashing pool.
+
+    The hash functions release the GIL, so capping the pool caps how many cores password
+    hashing can take from a worker. Callers that can't get a slot within the queue timeout
+    get a 503 instead of piling up behind the pool.
+    """
+    if settings.PASSWORD_HASHING_WORKERS <= 0:
+        return func(*args, **kwargs)
+
+    pool, slots = _get_pool()
+    if not slots.acquire(timeout=settings.PASSWORD_HASHING_QUEUE_TIMEOUT):
+        raise PasswordHashingBusy()
+    try:
+        return pool.submit(func, *args, **kwargs).result()
+    finally:
+        slots.release()
@@ -0,0 +1,72 @@
+# users/management/commands/benchmark_hashers.py
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+
+def _hash_for(hasher_path, duration):
+    hasher = import_string(hasher_path)()
+    salt = hasher.salt()
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        hasher.encode("correct horse battery staple", salt)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+class Command(BaseCommand):
+    help = "Report password hashes per second per core for each hasher profile"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profile",
+            action="append",
+            choices=sorted(settings.PASSWORD_HASHER_PROFILES),
+            help="Profile to benchmark (repeatable, defaults to all)",
+        )
+        parser.add_argument("--duration", type=float, default=3.0, help="Seconds to hash per measurement")
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count(),
+            help="Processes for the all-cores measurement (defaults to the CPU count)",
+        )
+
+    def handle(self, *args, **options):
+        profiles = options["profile"] or list(settings.PASSWORD_HASHER_PROFILES)
+        duration = options["duration"]
+        processes = options["processes"]
+        if processes < 1:
+            raise CommandError("--processes must be at least 1")
+
+        self.stdout.write(
+            f"{'profile':<8} {'p50 ms':>8} {'p99 ms':>8} {'hash/s/core':>12} {f'hash/s x{processes}':>12}"
+        )
+        for profile in profiles:
+            hasher_path = settings.PASSWORD_HASHER_PROFILES[profile]
+            try:
+                import_string(hasher_path)().encode("warmup", "warmupsalt")
+            except ValueError as exc:
+                self.stdout.write(self.style.WARNING(f"{profile:<8} skipped: {exc}"))
+                continue
+
+            latencies = sorted(_hash_for(hasher_path, duration))
+            per_core = len(latencies) / sum(latencies)
+            p50 = statistics.median(latencies) * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                runs = list(pool.map(_hash_for, [hasher_path] * processes, [duration] * processes))
+            all_cores = sum(len(run) for run in runs) / duration
+
+            marker = " *" if profile == settings.PASSWORD_HASHER_PROFILE else ""
+            self.stdout.write(f"{profile:<8} {p50:>8.1f} {p99:>8.1f} {per_core:>12.1f} {all_cores:>12.1f}{marker}")
+
+        self.stdout.write("* active profile")
@@ -1,8 +1,11 @@
 # users/models.py
+from django.contrib.auth.hashers import make_password, verify_password
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+from .hashers import run_hasher
+
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -40,10 +43,28 @@ class User(AbstractUser):
         verbose_name = _("user")
         verbose_name_plural = _("users")
         db_table = "users"
+        indexes = [
+            # Staff listings, newest first and by status; email prefixes use the unique index's _like twin
+            models.Index(fields=["-created_at"], name="users_created_at_idx"),
+            models.Index(fields=["is_active", "-created_at"], name="users_active_created_at_idx"),
+        ]
 
     def __str__(self):
         return self.email
 
+    def set_password(self, raw_password):
+        self.password = run_hasher(make_password, raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        is_correct, must_update = run_hasher(verify_password, raw_password, self.password)
+        if is_correct and must_update:
+            # Transparently move the stored hash to the active hasher profile
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=["password"])
+        return is_correct
+
     @property
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
@@ -1,8 +1,14 @@
 # users/serializers.py
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 
 from .models import User
+from .tasks import update_last_login
+from .tokens import record_refresh_tokens
 
 
 class UserCreateSerializer(serializers.ModelSerializer):
@@ -51,6 +57,15 @@ class UserDetailSerializer(serializers.ModelSerializer):
         read_only_fields = ("created_at", "updated_at")
 
 
+class UserBulkSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=settings.USER_BULK_MAX_IDS)
+
+
+class UserBulkResultSerializer(serializers.Serializer):
+    updated = serializers.IntegerField(help_text="Users whose status changed")
+    revoked_tokens = serializers.IntegerField(help_text="Refresh tokens blacklisted")
+
+
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
@@ -72,6 +87,7 @@ class LoginSerializer(TokenObtainPairSerializer):
 
     def validate(self, attrs):
         data = super().validate(attrs)
+        update_last_login.enqueue(self.user.pk, timezone.now().isoformat())
 
         # Add extra responses here
         data["user"] = {
@@ -84,6 +100,32 @@ class LoginSerializer(TokenObtainPairSerializer):
         return data
 
 
+class RefreshSerializer(TokenRefreshSerializer):
+    """Token refresh recording the rotation's outstanding and blacklisted tokens in two queries."""
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+
+        user_id = refresh.payload.get(api_settings.USER_ID_CLAIM)
+        if user_id:
+            user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+            if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+                raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+
+        data = {"access": str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            rotated = self.token_class(attrs["refresh"], verify=False)
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            revoked = [rotated] if api_settings.BLACKLIST_AFTER_ROTATION else []
+            record_refresh_tokens(user_id, issued=[refresh], revoked=revoked)
+            data["refresh"] = str(refresh)
+
+        return data
+
+
 class SignUpSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     confirm_password = serializers.CharField(write_only=True)
@@ -0,0 +1,15 @@
+# users/tasks.py
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from core.tasks import task
+
+from .models import User
+
+
+@task(queue="auth")
+def update_last_login(user_id, timestamp):
+    logged_in_at = parse_datetime(timestamp)
+    User.objects.filter(Q(last_login__isnull=True) | Q(last_login__lt=logged_in_at), pk=user_id).update(
+        last_login=logged_in_at
+    )
@@ -1 +1,100 @@
-# Create your tests here.
+from django.conf import settings
+
+from core.testing import Budget, QueryBudgetTestCase
+from journal.sharding import assign_shard
+
+from .models import User
+from .tokens import revoke_refresh_tokens
+
+
+class UserQueryBudgetTests(QueryBudgetTestCase):
+    budgets = {
+        "list": Budget("GET", "/api/users/", queries=2, max_bytes=9000),
+        "list_filtered": Budget(
+            "GET", "/api/users/?email=user-&is_active=true&created_at_after=2000-01-01T00:00:00Z", queries=2
+        ),
+        "retrieve": Budget("GET", "/api/users/{me}/", queries=2, max_bytes=500),
+        "create": Budget(
+            "POST",
+            "/api/users/",
+            queries=2,
+            # Placing the user on a shard
+            sharded_queries=1,
+            data={"email": "new-{size}@example.com", "password": "S3cure-pass", "confirm_password": "S3cure-pass"},
+            status=201,
+            authenticated=False,
+        ),
+        "update": Budget("PUT", "/api/users/{me}/", queries=4, data={"email": "{email}", "first_name": "New"}),
+        "partial_update": Budget("PATCH", "/api/users/{me}/", queries=3, data={"first_name": "New"}),
+        # Looking up the shard and deleting the journal there
+        "destroy": Budget("DELETE", "/api/users/{me}/", queries=11, sharded_queries=4, status=204),
+        "activate": Budget("POST", "/api/users/{other}/activate/", queries=3),
+        "deactivate": Budget("POST", "/api/users/{other}/deactivate/", queries=4),
+        "bulk_activate": Budget("POST", "/api/users/bulk-activate/", queries=2, data={"ids": ["{other}", "{last}"]}),
+        "bulk_deactivate": Budget(
+            "POST", "/api/users/bulk-deactivate/", queries=3, data={"ids": ["{other}", "{last}"]}
+        ),
+    }
+
+    def dataset(self, size):
+        staff = User.objects.create_user(f"staff-{size}@example.com", "password", is_staff=True)
+        if settings.JOURNAL_SHARDS:
+            # Placement alternates between shards, keep every size on the same one
+            assign_shard(staff.pk, settings.JOURNAL_SHARDS[-1])
+        users = User.objects.bulk_create([User(email=f"user-{size}-{index}@example.com") for index in range(size)])
+        return {
+            "user": staff,
+            "me": staff.pk,
+            "email": staff.email,
+            "other": users[0].pk,
+            "last": users[-1].pk,
+            "size": size,
+        }
+
+
+class AuthQueryBudgetTests(QueryBudgetTestCase):
+    budgets = {
+        "login": Budget(
+            "POST",
+            "/api/auth/login/",
+            queries=3,
+            data={"email": "{email}", "password": "password"},
+            authenticated=False,
+        ),
+        "signup": Budget(
+            "POST",
+            "/api/auth/signup/",
+            queries=3,
+            sharded_queries=1,
+            data={"email": "signup-{size}@example.com", "password": "S3cure-pass", "confirm_password": "S3cure-pass"},
+            status=201,
+            authenticated=False,
+        ),
+        "refresh": Budget("POST", "/api/auth/refresh/", queries=4, data={"refresh": "{refresh}"}, authenticated=False),
+        "verify": Budget("POST", "/api/auth/verify/", queries=1, data={"token": "{refresh}"}, authenticated=False),
+        "logout": Budget("POST", "/api/auth/logout/", queries=4, data={"refresh": "{refresh}"}),
+    }
+
+    def dataset(self, size):
+        user = User.objects.create_user(f"auth-{size}@example.com", "password")
+        return {"user": user, "email": user.email, "refresh": str(self.authenticate(user)), "size": size}
+
+    def test_login_with_a_body_that_is_not_an_object(self):
+        for body in ([], "email", 5):
+            response = self.client.post("/api/auth/login/", body, format="json")
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_rotated_and_logged_out_tokens_are_refused_at_once(self):
+        refresh = self.dataset(1)["refresh"]
+        rotated = self.client.post("/api/auth/refresh/", {"refresh": refresh}).json()["refresh"]
+        self.assertEqual(self.client.post("/api/auth/refresh/", {"refresh": refresh}).status_code, 401)
+
+        self.client.post("/api/auth/logout/", {"refresh": rotated})
+        self.assertEqual(self.client.post("/api/auth/refresh/", {"refresh": rotated}).status_code, 401)
+
+    def test_revocation_covers_tokens_issued_just_before(self):
+        fixtures = self.dataset(1)
+        rotated = self.client.post("/api/auth/refresh/", {"refresh": fixtures["refresh"]}).json()["refresh"]
+        # The first token was blacklisted by the rotation, the new one is on the outstanding list already
+        self.assertEqual(revoke_refresh_tokens([fixtures["user"].pk]), 1)
+        self.assertEqual(self.client.post("/api/auth/refresh/", {"refresh": rotated}).status_code, 401)
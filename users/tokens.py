@@ -0,0 +1,65 @@
+# users/tokens.py
+from django.db import connections
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+
+def record_refresh_tokens(user_id, issued=(), revoked=()):
+    """
+    Put a user's refresh tokens on the outstanding list and blacklist the `revoked` ones, in two queries at most.
+
+    Done in the request, not by a task: revoke_refresh_tokens only finds tokens on the list,
+    and a blacklisted token must be refused from the next request on.
+    """
+    OutstandingToken.objects.bulk_create(
+        [
+            OutstandingToken(
+                jti=token[api_settings.JTI_CLAIM],
+                user_id=user_id,
+                token=str(token),
+                created_at=token.current_time,
+                expires_at=datetime_from_epoch(token["exp"]),
+            )
+            for token in (*issued, *revoked)
+        ],
+        ignore_conflicts=True,
+    )
+    if not revoked:
+        return
+    jtis = [token[api_settings.JTI_CLAIM] for token in revoked]
+    placeholders = ", ".join(["%s"] * len(jtis))
+    with connections["default"].cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {BlacklistedToken._meta.db_table} (token_id, blacklisted_at)
+            SELECT id, %s FROM {OutstandingToken._meta.db_table} WHERE jti IN ({placeholders})
+            ON CONFLICT (token_id) DO NOTHING
+            """,
+            [timezone.now(), *jtis],
+        )
+
+
+def revoke_refresh_tokens(user_ids):
+    """
+    Blacklist the unexpired refresh tokens of these users in one statement, returning how many were revoked.
+
+    Covers every token issued until then: login, signup and rotation put theirs on the outstanding
+    list in the request that issues them (see record_refresh_tokens).
+    """
+    if not user_ids:
+        return 0
+    now = timezone.now()
+    placeholders = ", ".join(["%s"] * len(user_ids))
+    with connections["default"].cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {BlacklistedToken._meta.db_table} (token_id, blacklisted_at)
+            SELECT id, %s FROM {OutstandingToken._meta.db_table}
+            WHERE user_id IN ({placeholders}) AND expires_at > %s
+            ON CONFLICT (token_id) DO NOTHING
+            """,
+            [now, *user_ids, now],
+        )
+        return cursor.rowcount
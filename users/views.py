@@ -1,22 +1,47 @@
 # users/views.py
 from django.conf import settings
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django_filters import rest_framework as filters
+from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema
 from rest_framework import status, viewsets
-from rest_framework.decorators import action, api_view, permission_classes
-from rest_framework.permissions import AllowAny
+from rest_framework.decorators import action, api_view, permission_classes, throttle_classes
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
+from core.idempotency import idempotent
+from core.mixins import ReplicaReadMixin
+from core.pagination import KeysetPagination
+from core.throttling import (
+    LoginAccountRateThrottle,
+    LoginIPRateThrottle,
+    RefreshIPRateThrottle,
+    SignupIPRateThrottle,
+)
+
 from .models import User
 from .permissions import IsUserOrAdmin
-from .serializers import LoginSerializer, SignUpSerializer, UserCreateSerializer, UserDetailSerializer
+from .serializers import (
+    LoginSerializer,
+    RefreshSerializer,
+    SignUpSerializer,
+    UserBulkResultSerializer,
+    UserBulkSerializer,
+    UserCreateSerializer,
+    UserDetailSerializer,
+)
+from .tokens import record_refresh_tokens, revoke_refresh_tokens
 
 
 class LoginView(TokenObtainPairView):
     permission_classes = (AllowAny,)
     serializer_class = LoginSerializer
+    throttle_classes = (LoginIPRateThrottle, LoginAccountRateThrottle)
 
     def set_token_cookies(self, response, access_token, refresh_token):
         response.set_cookie(
@@ -69,6 +94,9 @@ class LoginView(TokenObtainPairView):
 
 
 class CustomTokenRefreshView(TokenRefreshView):
+    serializer_class = RefreshSerializer
+    throttle_classes = (RefreshIPRateThrottle,)
+
     @extend_schema(summary="Refresh token", description="Get new access token using refresh token")
     def post(self, request, *args, **kwargs):
         # Try to get refresh token from cookie if not in body
@@ -99,7 +127,9 @@ def logout_view(request):
         refresh_token = request.COOKIES.get("refresh_token") or request.data.get("refresh")
         if refresh_token:
             token = RefreshToken(refresh_token)
-            token.blacklist()
+            # Someone else's token is still revoked, just not counted as the caller's
+            owner = token.payload.get(api_settings.USER_ID_CLAIM)
+            record_refresh_tokens(request.user.pk if str(owner) == str(request.user.pk) else None, revoked=[token])
 
         response = Response({"message": "Successfully logged out."}, status=status.HTTP_200_OK)
         response.delete_cookie("access_token")
@@ -139,64 +169,122 @@ def logout_view(request):
 )
 @api_view(["POST"])
 @permission_classes([AllowAny])
+@throttle_classes([SignupIPRateThrottle])
+@idempotent(private=("tokens",), reissue=lambda data: signup_response(get_object_or_404(User, pk=data["user"]["id"])))
 def signup_view(request):
     serializer = SignUpSerializer(data=request.data)
     if serializer.is_valid():
-        user = serializer.save()
-        refresh = RefreshToken.for_user(user)
-        access_token = str(refresh.access_token)
-        refresh_token = str(refresh)
+        return signup_response(serializer.save())
 
-        response = Response(
-            {
-                "user": {
-                    "id": user.id,
-                    "email": user.email,
-                    "first_name": user.first_name,
-                    "last_name": user.last_name,
-                },
-                "tokens": {
-                    "access": access_token,
-                    "refresh": refresh_token,
-                },
+    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def signup_response(user):
+    """The new user, with a new pair of tokens in the body and in cookies. Also what retried signups get."""
+    refresh = RefreshToken.for_user(user)
+    access_token = str(refresh.access_token)
+    refresh_token = str(refresh)
+
+    response = Response(
+        {
+            "user": {
+                "id": user.id,
+                "email": user.email,
+                "first_name": user.first_name,
+                "last_name": user.last_name,
             },
-            status=status.HTTP_201_CREATED,
-        )
+            "tokens": {
+                "access": access_token,
+                "refresh": refresh_token,
+            },
+        },
+        status=status.HTTP_201_CREATED,
+    )
 
-        # Set cookies
-        response.set_cookie(
-            "access_token",
-            access_token,
-            max_age=int(settings.SIMPLE_JWT["ACCESS_TOKEN_LIFETIME"].total_seconds()),
-            httponly=True,
-            secure=settings.JWT_COOKIE_SECURE,
-            samesite="Lax",
-            domain=None,
-        )
-        response.set_cookie(
-            "refresh_token",
-            refresh_token,
-            max_age=int(settings.SIMPLE_JWT["REFRESH_TOKEN_LIFETIME"].total_seconds()),
-            httponly=True,
-            secure=settings.JWT_COOKIE_SECURE,
-            samesite="Lax",
-            domain=None,
-        )
+    # Set cookies
+    response.set_cookie(
+        "access_token",
+        access_token,
+        max_age=int(settings.SIMPLE_JWT["ACCESS_TOKEN_LIFETIME"].total_seconds()),
+        httponly=True,
+        secure=settings.JWT_COOKIE_SECURE,
+        samesite="Lax",
+        domain=None,
+    )
+    response.set_cookie(
+        "refresh_token",
+        refresh_token,
+        max_age=int(settings.SIMPLE_JWT["REFRESH_TOKEN_LIFETIME"].total_seconds()),
+        httponly=True,
+        secure=settings.JWT_COOKIE_SECURE,
+        samesite="Lax",
+        domain=None,
+    )
 
-        return response
+    return response
 
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class UserFilter(filters.FilterSet):
+    email = filters.CharFilter(lookup_expr="startswith", help_text="Email prefix, case sensitive")
+    is_active = filters.BooleanFilter()
+    created_at = filters.IsoDateTimeFromToRangeFilter(
+        help_text="Created in a range, as created_at_after and/or created_at_before"
+    )
 
-class UserViewSet(viewsets.ModelViewSet):
+    class Meta:
+        model = User
+        fields = ["email", "is_active", "created_at"]
+
+
+def set_active(user_ids, is_active):
+    """
+    Activate or deactivate users in one UPDATE. Deactivated users' refresh tokens are revoked
+    too, though refreshing already fails for inactive users, so this needs no transaction.
+    """
+    updated = (
+        User.objects.filter(pk__in=user_ids)
+        .exclude(is_active=is_active)
+        .update(is_active=is_active, updated_at=timezone.now())
+    )
+    revoked = 0 if is_active else revoke_refresh_tokens(user_ids)
+    return updated, revoked
+
+
+class UserViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     permission_classes = [IsUserOrAdmin]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = UserFilter
+
+    def get_queryset(self):
+        # Staff see everyone, users only themselves
+        if self.request.user.is_staff:
+            return User.objects.all()
+        return User.objects.filter(pk=self.request.user.pk)
+
+    def get_permissions(self):
+        if self.action in ("bulk_activate", "bulk_deactivate"):
+            return [IsAdminUser()]
+        return super().get_permissions()
+
+    def get_throttles(self):
+        if self.action == "create":
+            return [SignupIPRateThrottle()]
+        return super().get_throttles()
 
     def get_serializer_class(self):
         if self.action == "create":
             return UserCreateSerializer
         return UserDetailSerializer
 
+    @extend_schema(
+        summary="List users",
+        description="Staff get every user, newest first, others only themselves. Paginated with a cursor.",
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     @extend_schema(summary="Create new user", description="Create a new user with the provided data")
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -214,18 +302,43 @@ class UserViewSet(viewsets.ModelViewSet):
         user = serializer.save()
         return Response(UserDetailSerializer(user).data)
 
-    @extend_schema(summary="Deactivate user", description="Soft delete user by setting is_active to False")
+    @extend_schema(
+        summary="Deactivate user",
+        description="Soft delete user by setting is_active to False, revoking their refresh tokens",
+    )
     @action(detail=True, methods=["post"])
     def deactivate(self, request, pk=None):
-        user = self.get_object()
-        user.is_active = False
-        user.save()
+        set_active([self.get_object().pk], False)
         return Response({"message": "User deactivated successfully"}, status=status.HTTP_200_OK)
 
     @extend_schema(summary="Activate user", description="Reactivate deactivated user")
     @action(detail=True, methods=["post"])
     def activate(self, request, pk=None):
-        user = self.get_object()
-        user.is_active = True
-        user.save()
+        set_active([self.get_object().pk], True)
         return Response({"message": "User activated successfully"}, status=status.HTTP_200_OK)
+
+    @extend_schema(
+        summary="Deactivate users",
+        description="Deactivate the given users in one update and revoke their refresh tokens. Staff only.",
+        request=UserBulkSerializer,
+        responses=UserBulkResultSerializer,
+    )
+    @action(detail=False, methods=["post"], url_path="bulk-deactivate")
+    def bulk_deactivate(self, request):
+        return self.bulk_set_active(request, False)
+
+    @extend_schema(
+        summary="Activate users",
+        description="Reactivate the given users in one update. Staff only.",
+        request=UserBulkSerializer,
+        responses=UserBulkResultSerializer,
+    )
+    @action(detail=False, methods=["post"], url_path="bulk-activate")
+    def bulk_activate(self, request):
+        return self.bulk_set_active(request, True)
+
+    def bulk_set_active(self, request, is_active):
+        serializer = UserBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated, revoked = set_active(serializer.validated_data["ids"], is_active)
+        return Response({"updated": updated, "revoked_tokens": revoked})